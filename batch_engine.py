@@ -0,0 +1,231 @@
+import math
+import time
+import numpy as np
+from typing import List, Tuple, Dict, Optional
+from plain import Plain
+from walker import Walker
+from spatial_index import PointGrid, SegmentGrid
+from geometry import segments_intersect_many, crossed_points
+from running_stats import RunningStats
+from trajectory_store import TrajectoryStore
+from profiler import PhaseProfiler
+
+
+class BatchEngine:
+    """
+    A class that advances many walkers together as NumPy arrays. Every walker follows the same rules as
+    Plain.move_walker and Walker.move, so the statistics it produces are the same as the ones of the serial
+    Simulation loop, only computed for all the simulations at once.
+    """
+    __LATTICE_DIRECTIONS: np.ndarray = np.array([(0, 1), (0, -1), (1, 0), (-1, 0)], dtype=float)
+    __TRAJECTORY_BUFFER_POINTS: int = 2 ** 22  # The locations kept in memory before writing them to a trajectory store
+
+    def __init__(self, plain: Plain, walker: Walker, num_steps: int, exit_radius: float,
+                 rng: Optional[np.random.Generator] = None, profiler: Optional[PhaseProfiler] = None) -> None:
+        self.__walker: Walker = walker
+        self.__num_steps: int = num_steps
+        self.__exit_radius: float = exit_radius
+        self.__rng: np.random.Generator = rng if rng is not None else np.random.default_rng()
+        self.__profiler: Optional[PhaseProfiler] = profiler
+        self.__obstacles_index: PointGrid = plain.get_obstacles_index()
+        self.__obstacles: np.ndarray = np.array(self.__obstacles_index.get_points(), dtype=float).reshape(-1, 2)
+        self.__portals_index: PointGrid = plain.get_portals_index()
+        self.__portals, self.__portal_ends, self.__portal_chain_lengths = plain.get_portal_table()
+        self.__walls_index: SegmentGrid = plain.get_walls_index()
+        self.__walls: np.ndarray = plain.get_walls_array()
+        self.__walls_collinear: np.ndarray = plain.get_walls_collinear()
+
+    def __draw_steps(self, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        "The method draws one step vector for every walker according to the movement type of the walker"
+        count = len(x)
+        movement_type = self.__walker.get_movement_type()
+        if movement_type == 1:
+            angle = self.__rng.random(count) * (2 * math.pi)
+            return np.cos(angle), np.sin(angle)
+        if movement_type == 2:
+            angle = self.__rng.random(count) * (2 * math.pi)
+            step_size = 0.5 + self.__rng.random(count)
+            return step_size * np.cos(angle), step_size * np.sin(angle)
+        if movement_type == 3:
+            direction = self.__LATTICE_DIRECTIONS[self.__rng.integers(0, 4, count)]
+            return direction[:, 0], direction[:, 1]
+        if movement_type == 4:
+            choice = self.__walker.choose_directions(self.__rng.random(count))
+            dx = np.zeros(count)
+            dy = np.zeros(count)
+            lattice = choice < Walker.TO_ORIGIN
+            dx[lattice] = self.__LATTICE_DIRECTIONS[choice[lattice], 0]
+            dy[lattice] = self.__LATTICE_DIRECTIONS[choice[lattice], 1]
+            home = (choice == Walker.TO_ORIGIN) & ((x != 0) | (y != 0))
+            theta = np.arctan2(-y[home], -x[home])
+            dx[home] = np.cos(theta)
+            dy[home] = np.sin(theta)
+            return dx, dy
+        return np.zeros(count), np.zeros(count)
+
+    def __lap(self, phase: str, start: float) -> float:
+        "The method adds the time since start to a phase when the run is profiled and returns the current time"
+        if self.__profiler is None:
+            return start
+        return self.__profiler.lap(phase, start)
+
+    def __count(self, event: str, mask: np.ndarray) -> None:
+        "The method adds the walkers an event happened to when the run is profiled"
+        if self.__profiler is not None:
+            self.__profiler.count(event, int(np.count_nonzero(mask)))
+
+    def __blocked(self, x: np.ndarray, y: np.ndarray, last_x: np.ndarray, last_y: np.ndarray,
+                  first_move: np.ndarray, start: float) -> Tuple[np.ndarray, float]:
+        """The method checks which walkers collided with an obstacle or a wall, like Plain.is_obstacle and hit_walls,
+         and returns them with the time the check ended"""
+        blocked = np.zeros(len(x), dtype=bool)
+        if len(self.__obstacles):
+            # Only the pairs of a walker and an obstacle in the cells of its step need to be checked
+            walkers, candidates = self.__obstacles_index.query_many(last_x, last_y, x, y)
+            obstacles = self.__obstacles[candidates]
+            hit = crossed_points(x[walkers], y[walkers], last_x[walkers], last_y[walkers],
+                                 (obstacles[:, 0], obstacles[:, 1]))
+            blocked[walkers[hit]] = True
+        start = self.__lap('is_obstacle', start)
+        if len(self.__walls):
+            # Only the pairs of a walker and a wall in the cells of its step need to be checked
+            walkers, candidates = self.__walls_index.query_many(last_x, last_y, x, y)
+            x1, y1, x2, y2 = self.__walls[candidates].T
+            hit = segments_intersect_many(last_x[walkers], last_y[walkers], x[walkers], y[walkers], x1, y1, x2, y2)
+            # The walls in the same line as the origin don't stop the first move
+            hit &= ~(self.__walls_collinear[candidates] & first_move[walkers])
+            blocked[walkers[hit]] = True
+        return blocked, self.__lap('hit_walls', start)
+
+    def __magic_portals(self, x: np.ndarray, y: np.ndarray, last_x: np.ndarray, last_y: np.ndarray,
+                        moved: np.ndarray) -> None:
+        "The method moves the walkers that entered a magic portal to the end of its chain, like Plain.magic_portal"
+        if len(self.__portals) == 0:
+            return
+        # Only the walkers that moved can enter a portal, a reset would make the step from the last location long
+        movers = np.nonzero(moved)[0]
+        pairs, candidates = self.__portals_index.query_many(last_x[movers], last_y[movers], x[movers], y[movers])
+        walkers = movers[pairs]
+        portals = self.__portals[candidates]
+        hit = crossed_points(x[walkers], y[walkers], last_x[walkers], last_y[walkers], (portals[:, 0], portals[:, 1]))
+        # The first portal on the step of every walker is the one it enters
+        entered = np.full(len(x), len(self.__portals))
+        np.minimum.at(entered, walkers[hit], candidates[hit])
+        teleported = np.nonzero(entered < len(self.__portals))[0]
+        portal = entered[teleported]
+        x[teleported] = self.__portal_ends[portal, 0]
+        y[teleported] = self.__portal_ends[portal, 1]
+        if self.__profiler is not None:
+            self.__profiler.count('teleports', int(self.__portal_chain_lengths[portal].sum()))
+
+    @staticmethod
+    def __add_moments(moments: Tuple[np.ndarray, np.ndarray], step: int, values: np.ndarray) -> None:
+        "The method saves the mean and the sum of squared differences from the mean of the values of a step"
+        mean = values.mean()
+        moments[0][step] = mean
+        moments[1][step] = ((values - mean) ** 2).sum()
+
+    def run(self, num_simulations: int, store: Optional[TrajectoryStore] = None,
+            first_simulation: int = 0) -> Tuple[RunningStats, Dict[str, RunningStats], np.ndarray,
+                                                Dict[str, np.ndarray], List[np.ndarray]]:
+        """
+        Run num_simulations simulations together
+        :param num_simulations: the number of walkers to advance together
+        :param store: a trajectory store to write the location of every walker after every step to, or None
+        :param first_simulation: the index in the store of the first walker
+        :return: the statistics over all the simulations of the distances from the start after every step, the
+        statistics of the distances from the axes after every step, the steps to exit the radius of every simulation
+        (0 if the walker never exited), the axis crossings of every simulation and the histories of the simulations,
+        as arrays of shape (points, 2): every simulation in the walker's 'all' history mode, only the last one in
+        'last' mode and none in 'off' mode
+        """
+        num_steps = self.__num_steps
+        no_resets = np.zeros(num_simulations, dtype=bool)
+        if self.__walker.get_reset() > 0:
+            # The step of the next reset of every walker, the steps between resets are geometric like in Walker.reset
+            reset_at = 1 + self.__walker.reset_gaps(self.__rng.random(num_simulations))
+            next_reset = int(reset_at.min())
+        else:
+            next_reset = num_steps + 1  # Never
+        x = np.zeros(num_simulations)
+        y = np.zeros(num_simulations)
+        first_move = np.ones(num_simulations, dtype=bool)
+        # The mean and the sum of squared differences from the mean of every metric after every step
+        distances = (np.zeros(num_steps + 1), np.zeros(num_steps + 1))
+        distances_from_axis = {'x': (np.zeros(num_steps + 1), np.zeros(num_steps + 1)),
+                               'y': (np.zeros(num_steps + 1), np.zeros(num_steps + 1))}
+        steps_to_exit = np.zeros(num_simulations, dtype=np.int64)
+        axis_crossings = {'x': np.zeros(num_simulations, dtype=np.int64),
+                          'y': np.zeros(num_simulations, dtype=np.int64)}
+        history_mode = self.__walker.get_history_mode()
+        kept = num_simulations if history_mode == 'all' else (1 if history_mode == 'last' else 0)
+        # The locations of the kept walkers after every step, and whether they belong to the history (the walker
+        # moved or was reset, like in Plain.move_walker)
+        positions = np.zeros((num_steps + 1, kept, 2))
+        recorded = np.zeros((num_steps + 1, kept), dtype=bool)
+        recorded[0] = True
+        if store is not None:
+            # The locations are written to the store in blocks of steps
+            block_steps = max(1, min(num_steps + 1, self.__TRAJECTORY_BUFFER_POINTS // num_simulations))
+            block = np.zeros((num_simulations, block_steps, 2))
+            block_start = 0
+
+        for i in range(1, num_steps + 1):
+            last_x = x
+            last_y = y
+            start = time.perf_counter()
+            if i == next_reset:
+                reset_mask = reset_at == i
+                reset_at[reset_mask] = i + 1 + self.__walker.reset_gaps(
+                    self.__rng.random(int(np.count_nonzero(reset_mask))))
+                next_reset = int(reset_at.min())
+            else:
+                reset_mask = no_resets  # Skip ahead to the next reset
+            start = self.__lap('reset_draw', start)
+            dx, dy = self.__draw_steps(last_x, last_y)
+            x = last_x + dx
+            y = last_y + dy
+            start = self.__lap('move', start)
+            moving = ~reset_mask
+            blocked, start = self.__blocked(x, y, last_x, last_y, first_move, start)
+            moved = moving & ~blocked
+            # Walkers that collided go back to their last location, walkers that were reset go back to the origin
+            x = np.where(moved, x, np.where(reset_mask, 0.0, last_x))
+            y = np.where(moved, y, np.where(reset_mask, 0.0, last_y))
+            self.__magic_portals(x, y, last_x, last_y, moved)
+            start = self.__lap('magic_portal', start)
+            if self.__profiler is not None:
+                self.__profiler.count('steps', num_simulations)
+            self.__count('resets', reset_mask)
+            self.__count('collisions', moving & blocked)
+            first_move = np.where(reset_mask, True, np.where(moved, False, first_move))
+
+            # Check for crossing the y-axis (change in x-coordinate sign) and the x-axis (change in y-coordinate sign)
+            axis_crossings['y'] += ((last_x <= 0) & (0 < x)) | ((last_x >= 0) & (0 > x))
+            axis_crossings['x'] += ((last_y <= 0) & (0 < y)) | ((last_y >= 0) & (0 > y))
+            self.__add_moments(distances_from_axis['y'], i, np.abs(x))
+            self.__add_moments(distances_from_axis['x'], i, np.abs(y))
+            distance = np.sqrt(x ** 2 + y ** 2)
+            self.__add_moments(distances, i, distance)
+            steps_to_exit[(distance > self.__exit_radius) & (steps_to_exit == 0)] = i
+            if store is not None:
+                if i - block_start == block_steps:
+                    store.write(first_simulation, block_start, block)
+                    block_start = i
+                block[:, i - block_start, 0] = x
+                block[:, i - block_start, 1] = y
+            start = time.perf_counter()
+            if kept:
+                positions[i, :, 0] = x[num_simulations - kept:]
+                positions[i, :, 1] = y[num_simulations - kept:]
+                recorded[i] = (reset_mask | moved)[num_simulations - kept:]
+                self.__lap('history', start)
+
+        if store is not None:
+            store.write(first_simulation, block_start, block[:, :num_steps + 1 - block_start])
+            store.flush()
+        distance_stats = RunningStats.from_moments(num_simulations, *distances)
+        axis_distance_stats = {axis: RunningStats.from_moments(num_simulations, *distances_from_axis[axis])
+                               for axis in ['x', 'y']}
+        histories = [positions[recorded[:, walker], walker] for walker in range(kept)]
+        return distance_stats, axis_distance_stats, steps_to_exit, axis_crossings, histories
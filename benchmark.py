@@ -0,0 +1,222 @@
+import sys
+import json
+import math
+import time
+import random
+import platform
+import argparse
+import tracemalloc
+import numpy as np
+from typing import List, Tuple, Dict, Callable, Optional
+from plain import Plain
+from walker import Walker
+from simulation import Simulation
+
+BENCHMARKS: Tuple[str, ...] = ('walker_move', 'move_walker', 'run_simulations')
+GEOMETRY_KINDS: Tuple[str, ...] = ('obstacles', 'walls', 'magic_portals')
+# The exact engine moves the probability of every location it can reach, without resets its time grows with the cube
+# of the steps, so longer runs are skipped unless asked for
+EXACT_MAX_STEPS: int = 2000
+
+
+def make_plain(kind: Optional[str], count: int, seed: int = 0) -> Plain:
+    """
+    Build a plain with count random obstacles, walls or magic portals around the origin. The area grows with the
+    count, so the density of the geometry around a walker is about the same for every count
+    :param kind: one of GEOMETRY_KINDS, or None for an empty plain
+    :param count: the number of obstacles, walls or magic portals
+    :param seed: the seed of the random geometry
+    :return: a Plain
+    """
+    if kind is None or count == 0:
+        return Plain()
+    if kind not in GEOMETRY_KINDS:
+        raise ValueError(f"kind must be one of {', '.join(GEOMETRY_KINDS)}")
+    generator = random.Random(seed)
+    half_size = max(5, math.ceil(math.sqrt(count)))
+
+    def random_point() -> Tuple[float, float]:
+        # Integer points, so the lattice walkers (movement type 3) actually run into them
+        point = (0, 0)
+        while point == (0, 0):
+            point = (generator.randint(-half_size, half_size), generator.randint(-half_size, half_size))
+        return float(point[0]), float(point[1])
+
+    if kind == 'obstacles':
+        return Plain(obstacles=[random_point() for _ in range(count)])
+    if kind == 'walls':
+        walls = {}
+        while len(walls) < count:
+            start = random_point()
+            walls[start] = (start[0] + generator.uniform(-2, 2), start[1] + generator.uniform(-2, 2))
+        return Plain(walls=walls)
+    magic_portals = {}
+    while len(magic_portals) < count:
+        magic_portals[random_point()] = random_point()
+    return Plain(magic_portals=magic_portals)
+
+
+def make_walker(movement_type: int, reset: float) -> Walker:
+    "The function builds the walker of a benchmark, movement type 4 gets the default weights"
+    return Walker(movement_type=movement_type, reset=reset)
+
+
+def measure(function: Callable[[], None], repeat: int = 1, memory: bool = True) -> Tuple[float, Optional[int]]:
+    """
+    Time a function and measure the peak memory it allocates
+    :param function: the function to measure, it is called repeat times and once more to measure the memory
+    :param repeat: the number of timed calls, the fastest one is reported
+    :param memory: False to skip the memory measurement (tracemalloc slows the function down, so it is never timed)
+    :return: the seconds of the fastest call and the peak of the memory allocated in bytes, or None
+    """
+    seconds = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak
+
+
+def time_walker_move(movement_type: int, reset: float, num_steps: int, repeat: int = 1,
+                     memory: bool = True) -> Dict:
+    "The function times num_steps calls of Walker.move"
+    walker = make_walker(movement_type, reset)
+
+    def run() -> None:
+        walker.set_location((0, 0))
+        for _ in range(num_steps):
+            walker.move()
+
+    seconds, peak = measure(run, repeat, memory)
+    return {'seconds': seconds, 'steps_per_second': num_steps / seconds, 'peak_memory_bytes': peak}
+
+
+def time_move_walker(plain: Plain, movement_type: int, reset: float, num_steps: int, repeat: int = 1,
+                     memory: bool = True) -> Dict:
+    "The function times num_steps calls of Plain.move_walker"
+    walker = make_walker(movement_type, reset)
+
+    def run() -> None:
+        walker.set_location((0, 0))
+        walker.clear_history()
+        plain.set_first_move(True)
+        for _ in range(num_steps):
+            plain.move_walker(walker)
+
+    seconds, peak = measure(run, repeat, memory)
+    return {'seconds': seconds, 'steps_per_second': num_steps / seconds, 'peak_memory_bytes': peak}
+
+
+def time_run_simulations(plain: Plain, movement_type: int, reset: float, num_steps: int, num_simulations: int,
+                         engine: str, repeat: int = 1, memory: bool = True) -> Dict:
+    "The function times Simulation.run_simulations, a new simulation is built for every call"
+
+    def run() -> None:
+        Simulation(plain, make_walker(movement_type, reset), num_steps, num_simulations, engine=engine,
+                   seed=0).run_simulations()
+
+    seconds, peak = measure(run, repeat, memory)
+    return {'seconds': seconds, 'steps_per_second': num_steps * num_simulations / seconds,
+            'peak_memory_bytes': peak}
+
+
+def run_benchmarks(benchmarks: List[str], movement_types: List[int], resets: List[float],
+                   geometry_counts: List[int], steps: List[int], num_simulations: int, engines: List[str],
+                   repeat: int = 1, memory: bool = True, seed: int = 0,
+                   exact_max_steps: int = EXACT_MAX_STEPS) -> Dict:
+    """
+    Run every benchmark over the matrix of the parameters. The walker benchmark does not depend on the plain, so it
+    only runs on the movement types, the resets and the steps. Every kind of geometry is measured on its own. The
+    exact engine is skipped for more than exact_max_steps steps, the skipped points are logged.
+    :return: a JSON friendly dictionary with the environment and a result for every point of the matrix
+    """
+    geometries = [(None, 0)] + [(kind, count) for kind in GEOMETRY_KINDS for count in geometry_counts if count > 0]
+    plains = {}  # The plains are built once, building them is not measured
+    results = []
+    for benchmark in benchmarks:
+        for movement_type in movement_types:
+            for reset in resets:
+                for num_steps in steps:
+                    if benchmark == 'walker_move':
+                        result = {'benchmark': benchmark, 'movement_type': movement_type, 'reset': reset,
+                                  'num_steps': num_steps}
+                        result.update(time_walker_move(movement_type, reset, num_steps, repeat, memory))
+                        results.append(result)
+                        print(json.dumps(result), file=sys.stderr)
+                        continue
+                    for kind, count in geometries:
+                        if (kind, count) not in plains:
+                            plains[(kind, count)] = make_plain(kind, count, seed)
+                        plain = plains[(kind, count)]
+                        for engine in (engines if benchmark == 'run_simulations' else [None]):
+                            if engine == 'exact' and movement_type != 3:
+                                continue  # The exact engine only computes the lattice walker
+                            if engine == 'exact' and num_steps > exact_max_steps:
+                                print(json.dumps({'skipped': 'exact', 'num_steps': num_steps, 'reset': reset,
+                                                  'geometry': kind, 'geometry_count': count,
+                                                  'reason': f'more than {exact_max_steps} steps'}), file=sys.stderr)
+                                continue
+                            result = {'benchmark': benchmark, 'movement_type': movement_type, 'reset': reset,
+                                      'num_steps': num_steps, 'geometry': kind, 'geometry_count': count}
+                            if benchmark == 'move_walker':
+                                result.update(time_move_walker(plain, movement_type, reset, num_steps, repeat,
+                                                               memory))
+                            else:
+                                result.update({'engine': engine, 'num_simulations': num_simulations})
+                                result.update(time_run_simulations(plain, movement_type, reset, num_steps,
+                                                                   num_simulations, engine, repeat, memory))
+                            results.append(result)
+                            print(json.dumps(result), file=sys.stderr)  # Progress, the report goes to the output
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'repeat': repeat, 'results': results}
+
+
+parser = argparse.ArgumentParser(description='Measure the throughput of the walker, the plain and the simulation'
+                                             ' engines and write the results as JSON.')
+parser.add_argument('--benchmarks', choices=BENCHMARKS, nargs='*', default=list(BENCHMARKS),
+                    help='The benchmarks to run, default is all of them')
+parser.add_argument('--movement_types', type=int, choices=[1, 2, 3, 4], nargs='*', default=[1, 2, 3, 4],
+                    help='The movement types of the walker, default is 1 2 3 4')
+parser.add_argument('--resets', type=float, nargs='*', default=[0.0, 0.1],
+                    help='The reset probabilities of the walker, default is 0 0.1')
+parser.add_argument('--geometry_counts', type=int, nargs='*', default=[0, 100, 10000],
+                    help='The numbers of obstacles, walls and magic portals, every kind is measured on its own,'
+                         ' default is 0 100 10000')
+parser.add_argument('--steps', type=int, nargs='*', default=[1000, 10000],
+                    help='The numbers of steps, default is 1000 10000')
+parser.add_argument('--num_simulations', type=int, default=10,
+                    help='The number of simulations of the run_simulations benchmark, default is 10')
+parser.add_argument('--engines', choices=Simulation.ENGINES, nargs='*', default=list(Simulation.ENGINES),
+                    help='The engines of the run_simulations benchmark, default is all of them')
+parser.add_argument('--exact_max_steps', type=int, default=EXACT_MAX_STEPS,
+                    help=f'The most steps the exact engine is measured on, default is {EXACT_MAX_STEPS}')
+parser.add_argument('--repeat', type=int, default=1, help='The number of timed runs, the fastest is reported')
+parser.add_argument('--no_memory', action='store_true', help='Skip the peak memory measurement')
+parser.add_argument('--seed', type=int, default=0, help='The seed of the random geometry, default is 0')
+parser.add_argument('--output', type=str, default=None, help='The JSON file to write, default is the standard output')
+
+
+def main() -> None:
+    "The function that runs the benchmarks from the command line"
+    args = parser.parse_args()
+    report = run_benchmarks(args.benchmarks, args.movement_types, args.resets, args.geometry_counts, args.steps,
+                            args.num_simulations, args.engines, args.repeat, not args.no_memory, args.seed,
+                            args.exact_max_steps)
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
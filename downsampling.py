@@ -0,0 +1,167 @@
+import numpy as np
+from typing import Tuple, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:  # matplotlib is only imported by the code that draws, computing the points does not need it
+    from matplotlib.axes import Axes
+
+DEFAULT_MAX_POINTS: int = 5000  # The points a plot draws at most, about the width of a screen in pixels, twice
+METHODS: Tuple[str, ...] = ('lttb', 'min_max')
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Choose the points that keep the shape of a line with the Largest-Triangle-Three-Buckets algorithm: the first and
+    the last points are kept, the rest are split into buckets and from every bucket the point that makes the largest
+    triangle with the point chosen before it and the average of the next bucket is kept
+    :param x: the x values of the points, in the order they are connected
+    :param y: the y values of the points
+    :param max_points: the number of points to keep, at least 3
+    :return: the sorted indices of the chosen points
+    """
+    count = len(x)
+    if count <= max_points:
+        return np.arange(count)
+    if max_points < 3:
+        raise ValueError("max_points must be at least 3")
+    edges = np.linspace(1, count - 1, max_points - 1).astype(np.int64)  # max_points - 2 buckets between the ends
+    indices = np.empty(max_points, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = count - 1
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_x = x[end:edges[bucket + 2]].mean()
+            next_y = y[end:edges[bucket + 2]].mean()
+        else:
+            next_x, next_y = x[count - 1], y[count - 1]
+        # Twice the area of the triangle of the previous point, a candidate and the average of the next bucket
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        indices[bucket + 1] = previous
+    return indices
+
+
+def min_max_indices(values: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Choose the points of a curve by min/max decimation: the values are split into max_points / 2 bins and the
+    smallest and the largest value of every bin are kept, so the envelope of a noisy curve is never lost
+    :param values: the y values of the curve
+    :param max_points: the number of points to keep at most, at least 4
+    :return: the sorted indices of the chosen points
+    """
+    count = len(values)
+    if count <= max_points:
+        return np.arange(count)
+    if max_points < 4:
+        raise ValueError("max_points must be at least 4")
+    bin_size = -(-count // ((max_points - 2) // 2))
+    bins = -(-count // bin_size)  # Only the last bin is not full
+    padded = np.full(bins * bin_size, np.nan)
+    padded[:count] = values
+    padded = padded.reshape(bins, bin_size)
+    offsets = np.arange(bins) * bin_size
+    chosen = np.concatenate([[0, count - 1], offsets + np.nanargmin(padded, axis=1),
+                             offsets + np.nanargmax(padded, axis=1)])
+    return np.unique(chosen)
+
+
+def downsample_indices(x: np.ndarray, y: np.ndarray, max_points: int, method: str = 'lttb') -> np.ndarray:
+    "The function chooses the points to draw with one of METHODS, min_max only looks at the y values"
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {', '.join(METHODS)}")
+    if method == 'min_max':
+        return min_max_indices(y, max_points)
+    return lttb_indices(x, y, max_points)
+
+
+class DownsampledLine:
+    """
+    A class to represent a line on a matplotlib Axes that draws at most max_points of its points. When the limits of
+    the axes change (zoom or pan in a toolbar) the points inside the new limits are downsampled again, so zooming in
+    shows more detail. A curve (x increasing, like a value after every step) can have a band around it, like a
+    confidence interval, that is downsampled with the same points. A path (like the locations of a walker) is
+    selected by both limits and is broken where it leaves them.
+    """
+
+    def __init__(self, ax: 'Axes', x: np.ndarray, y: np.ndarray, max_points: int = DEFAULT_MAX_POINTS,
+                 method: str = 'lttb', band: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                 band_kwargs: Optional[dict] = None, path: bool = False, **line_kwargs) -> None:
+        if method not in METHODS:
+            raise ValueError(f"method must be one of {', '.join(METHODS)}")
+        self.__ax: 'Axes' = ax
+        self.__x: np.ndarray = np.asarray(x, dtype=float)
+        self.__y: np.ndarray = np.asarray(y, dtype=float)
+        self.__max_points: int = max_points
+        self.__method: str = method
+        self.__band: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        if band is not None:
+            self.__band = (np.asarray(band[0], dtype=float), np.asarray(band[1], dtype=float))
+        self.__band_kwargs: dict = band_kwargs if band_kwargs else {}
+        self.__band_artist = None
+        self.__path: bool = path
+        self.__line_kwargs: dict = line_kwargs
+        self.__line = None
+        self.__refresh(np.arange(len(self.__x)))  # The first points are added to the data limits of the axes
+        # The callbacks hold the line, the registry only keeps a weak reference to bound methods
+        ax.callbacks.connect('xlim_changed', lambda changed_ax: self.refresh())
+        if path:
+            ax.callbacks.connect('ylim_changed', lambda changed_ax: self.refresh())
+
+    def get_line(self):
+        return self.__line
+
+    def __visible(self) -> np.ndarray:
+        "The method returns the indices of the points inside the limits of the axes and their neighbours"
+        low_x, high_x = sorted(self.__ax.get_xlim())
+        if not self.__path:
+            # The x values of a curve are increasing, one point on each side keeps the line to the edges
+            first = max(0, int(np.searchsorted(self.__x, low_x, side='left')) - 1)
+            last = min(len(self.__x), int(np.searchsorted(self.__x, high_x, side='right')) + 1)
+            return np.arange(first, last)
+        low_y, high_y = sorted(self.__ax.get_ylim())
+        inside = (low_x <= self.__x) & (self.__x <= high_x) & (low_y <= self.__y) & (self.__y <= high_y)
+        inside[1:] |= inside[:-1].copy()
+        inside[:-1] |= inside[1:].copy()
+        return np.nonzero(inside)[0]
+
+    def __refresh(self, visible: np.ndarray) -> None:
+        "The method draws the downsampled points among the visible ones"
+        chosen = visible[downsample_indices(self.__x[visible], self.__y[visible], self.__max_points, self.__method)]
+        x = self.__x[chosen]
+        y = self.__y[chosen]
+        if self.__path and len(chosen) > 1:
+            # Break the line between points of different runs of visible points, the path left the limits there
+            run = np.zeros(len(self.__x), dtype=np.int64)
+            run[visible[1:]] = np.cumsum(np.diff(visible) > 1)
+            breaks = np.nonzero(np.diff(run[chosen]) > 0)[0] + 1
+            x = np.insert(x, breaks, np.nan)
+            y = np.insert(y, breaks, np.nan)
+        if self.__line is None:
+            self.__line = self.__ax.plot(x, y, **self.__line_kwargs)[0]
+        else:
+            self.__line.set_data(x, y)
+        if self.__band is not None:
+            low, high = self.__band[0][chosen], self.__band[1][chosen]
+            if self.__band_artist is None:
+                self.__band_artist = self.__ax.fill_between(x, low, high, **self.__band_kwargs)
+            else:
+                # Changing the polygon in place does not ask the axes to autoscale, which would change the limits
+                self.__band_artist.set_verts([np.concatenate([np.column_stack([x, low]),
+                                                              np.column_stack([x[::-1], high[::-1]])])])
+
+    def refresh(self) -> None:
+        "The method downsamples again the points inside the current limits of the axes"
+        self.__refresh(self.__visible())
+
+
+if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+
+    # A random walk of a million steps drawn with a few thousand points
+    steps = np.random.default_rng(0).normal(size=(1_000_000, 2)).cumsum(axis=0)
+    figure, (curve_ax, path_ax) = plt.subplots(1, 2, figsize=(12, 5))
+    DownsampledLine(curve_ax, np.arange(len(steps)), steps[:, 0], method='min_max')
+    DownsampledLine(path_ax, steps[:, 0], steps[:, 1], path=True)
+    plt.show()
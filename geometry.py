@@ -0,0 +1,102 @@
+import numpy as np
+from typing import Tuple
+
+
+def calculate_det(point1: Tuple[float, float], point2: Tuple[float, float], point3: Tuple[float, float]) -> float:
+    "Calculate the determinant of the matrix formed by the vectors from point1 to point2 and point3"
+    x1, y1 = point1
+    x2, y2 = point2
+    x3, y3 = point3
+    return (x2 - x1) * (y3 - y1) - (x3 - x1) * (y2 - y1)
+
+
+def are_collinear(point1: Tuple[float, float], point2: Tuple[float, float], point3: Tuple[float, float]) -> bool:
+    "Check if the points are in the same line, the triangle they form has no area"
+    return calculate_det(point1, point2, point3) == 0
+
+
+def in_box(point1: Tuple[float, float], point2: Tuple[float, float], point3: Tuple[float, float]) -> bool:
+    "Check if point3 is inside the bounding box defined by point1 and point2"
+    return (min(point1[0], point2[0]) <= point3[0] <= max(point1[0], point2[0]) and
+            min(point1[1], point2[1]) <= point3[1] <= max(point1[1], point2[1]))
+
+
+def segments_intersect(p1: Tuple[float, float], p2: Tuple[float, float], q1: Tuple[float, float],
+                       q2: Tuple[float, float]) -> bool:
+    """
+    Check if the segment p1 -> p2 intersects the segment q1 -> q2, touching and overlapping segments included, the
+    same answer as LineString([p1, p2]).intersects(LineString([q1, q2])) without building any object
+    :param p1: the start point of the first segment
+    :param p2: the end point of the first segment
+    :param q1: the start point of the second segment
+    :param q2: the end point of the second segment
+    :return: True if the segments intersect, False otherwise
+    """
+    if p1 == p2 or q1 == q2:
+        # Shapely only lets a segment of zero length touch the end points of a proper segment
+        if p1 == p2 and q1 == q2:
+            return False
+        if p1 == p2:
+            return p1 == q1 or p1 == q2
+        return q1 == p1 or q1 == p2
+    d1 = calculate_det(q1, q2, p1)
+    d2 = calculate_det(q1, q2, p2)
+    d3 = calculate_det(p1, p2, q1)
+    d4 = calculate_det(p1, p2, q2)
+    if ((d1 > 0 > d2) or (d1 < 0 < d2)) and ((d3 > 0 > d4) or (d3 < 0 < d4)):
+        return True
+    # Touching or collinear cases, an end point lies on the other segment
+    return ((d1 == 0 and in_box(q1, q2, p1)) or (d2 == 0 and in_box(q1, q2, p2)) or
+            (d3 == 0 and in_box(p1, p2, q1)) or (d4 == 0 and in_box(p1, p2, q2)))
+
+
+def segments_intersect_many(px1: np.ndarray, py1: np.ndarray, px2: np.ndarray, py2: np.ndarray,
+                            qx1: np.ndarray, qy1: np.ndarray, qx2: np.ndarray, qy2: np.ndarray) -> np.ndarray:
+    """
+    The vectorized version of segments_intersect. The arguments are broadcast together, so it checks one step
+    against the arrays of the walls endpoints, or the steps of many walkers against one wall
+    :param px1, py1, px2, py2: the start and end points of the first segments
+    :param qx1, qy1, qx2, qy2: the start and end points of the second segments
+    :return: a boolean array, True where the segments intersect
+    """
+    px1, py1, px2, py2, qx1, qy1, qx2, qy2 = (np.asarray(value, dtype=float)
+                                              for value in (px1, py1, px2, py2, qx1, qy1, qx2, qy2))
+    d1 = (qx2 - qx1) * (py1 - qy1) - (px1 - qx1) * (qy2 - qy1)
+    d2 = (qx2 - qx1) * (py2 - qy1) - (px2 - qx1) * (qy2 - qy1)
+    d3 = (px2 - px1) * (qy1 - py1) - (qx1 - px1) * (py2 - py1)
+    d4 = (px2 - px1) * (qy2 - py1) - (qx2 - px1) * (py2 - py1)
+    proper = (np.sign(d1) * np.sign(d2) < 0) & (np.sign(d3) * np.sign(d4) < 0)
+
+    # Touching or collinear cases, an end point lies on the other segment
+    p1_on_q = (d1 == 0) & (np.minimum(qx1, qx2) <= px1) & (px1 <= np.maximum(qx1, qx2)) & \
+              (np.minimum(qy1, qy2) <= py1) & (py1 <= np.maximum(qy1, qy2))
+    p2_on_q = (d2 == 0) & (np.minimum(qx1, qx2) <= px2) & (px2 <= np.maximum(qx1, qx2)) & \
+              (np.minimum(qy1, qy2) <= py2) & (py2 <= np.maximum(qy1, qy2))
+    q1_on_p = (d3 == 0) & (np.minimum(px1, px2) <= qx1) & (qx1 <= np.maximum(px1, px2)) & \
+              (np.minimum(py1, py2) <= qy1) & (qy1 <= np.maximum(py1, py2))
+    q2_on_p = (d4 == 0) & (np.minimum(px1, px2) <= qx2) & (qx2 <= np.maximum(px1, px2)) & \
+              (np.minimum(py1, py2) <= qy2) & (qy2 <= np.maximum(py1, py2))
+    # Shapely only lets a segment of zero length touch the end points of a proper segment
+    p_point = (px1 == px2) & (py1 == py2)
+    q_point = (qx1 == qx2) & (qy1 == qy2)
+    p_touches = p_point & ~q_point & (((px1 == qx1) & (py1 == qy1)) | ((px1 == qx2) & (py1 == qy2)))
+    q_touches = q_point & ~p_point & (((qx1 == px1) & (qy1 == py1)) | ((qx1 == px2) & (qy1 == py2)))
+    intersect = (proper | p1_on_q | p2_on_q | q1_on_p | q2_on_p) & ~p_point & ~q_point
+    return intersect | p_touches | q_touches
+
+
+def are_collinear_many(x1: np.ndarray, y1: np.ndarray, x2: np.ndarray, y2: np.ndarray,
+                       x3: np.ndarray, y3: np.ndarray) -> np.ndarray:
+    "The vectorized version of are_collinear"
+    return (x2 - x1) * (y3 - y1) - (x3 - x1) * (y2 - y1) == 0
+
+
+def crossed_points(x: np.ndarray, y: np.ndarray, last_x: np.ndarray, last_y: np.ndarray,
+                   point: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    "The vectorized version of Plain.crossed_point, with the same arithmetic so the results are identical"
+    x3, y3 = point
+    cross_product = (last_x - x) * (y3 - y) - (x3 - x) * (last_y - y)
+    on_line = (np.minimum(x, last_x) <= x3) & (x3 <= np.maximum(x, last_x)) & \
+              (np.minimum(y, last_y) <= y3) & (y3 <= np.maximum(y, last_y))
+    return (cross_product == 0) & on_line
+
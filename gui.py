@@ -1,8 +1,14 @@
+import threading
 import tkinter as tk
 from simulation import *
 from plain import *
 from walker import *
-from tkinter import messagebox, LabelFrame, Label, Entry, Button, Radiobutton, StringVar, IntVar, Toplevel, BooleanVar
+from plain_validator import PlainValidator
+from scene import SCENE_FORMATS, load_scene, save_scene
+from tkinter import filedialog, messagebox, LabelFrame, Label, Entry, Button, Radiobutton, StringVar, IntVar, Toplevel, BooleanVar
+from tkinter import ttk
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 
 
 class Already_Exist(Exception):
@@ -14,32 +20,63 @@ class Already_Exist(Exception):
 
 
 class ResultsDialog:
-    "The class used to represent the results dialog for the simulation results"
+    """The class used to represent the results dialog for the simulation results. The plots are drawn inside the
+    dialog, every plot is built once and kept, so switching between them only shows the one that was built."""
 
     def __init__(self, master, simulation):
         self.top = Toplevel(master)
         self.top.title("Simulation Results")
         self.simulation = simulation
-
-        Button(self.top, text="Average Distance from Start", command=self.show_avg_distance_from_start, width=25).pack(
-            pady=5, padx=5)
-        Button(self.top, text="Average Distance from Axis", command=self.show_avg_distance_from_axis, width=25).pack(
-            pady=5, padx=5)
-        Button(self.top, text="Average Steps to Exit Radius", command=self.show_avg_steps_to_exit_radius,
+        self.views = {}  # The frame of the canvas and the toolbar of every plot that was built
+        self.current_view = None
+
+        buttons_frame = tk.Frame(self.top)
+        buttons_frame.pack(side='left', fill='y')
+        self.plot_frame = tk.Frame(self.top)
+        self.plot_frame.pack(side='right', fill='both', expand=True)
+        Label(buttons_frame, text=f"Simulations run: {simulation.get_num_simulations_run()}").pack(pady=5, padx=5)
+        Button(buttons_frame, text="Average Distance from Start", command=self.show_avg_distance_from_start,
+               width=25).pack(pady=5, padx=5)
+        Button(buttons_frame, text="Average Distance from Axis", command=self.show_avg_distance_from_axis,
+               width=25).pack(pady=5, padx=5)
+        Button(buttons_frame, text="Average Steps to Exit Radius", command=self.show_avg_steps_to_exit_radius,
                width=25).pack(pady=5, padx=5)
-        Button(self.top, text="Axes crossing stats", command=self.show_axes_crossing_stats, width=25).pack(pady=5,
-                                                                                                           padx=5)
-        Button(self.top, text="Show last simulation graph", command=self.show_last_simulation_graph, width=25).pack(
+        Button(buttons_frame, text="Axes crossing stats", command=self.show_axes_crossing_stats, width=25).pack(
             pady=5, padx=5)
+        Button(buttons_frame, text="Show last simulation graph", command=self.show_last_simulation_graph,
+               width=25).pack(pady=5, padx=5)
+        self.show_avg_distance_from_start()
+
+    def show_view(self, name, draw):
+        """
+        Show a plot inside the dialog, it is built the first time it is shown
+        :param name: the name of the plot
+        :param draw: a method of the simulation that draws the plot on a matplotlib Axes
+        :return: None
+        """
+        if name not in self.views:
+            figure = Figure(figsize=(6, 4.5))
+            draw(figure.add_subplot())
+            figure.tight_layout()
+            frame = tk.Frame(self.plot_frame)
+            canvas = FigureCanvasTkAgg(figure, master=frame)
+            canvas.draw()
+            NavigationToolbar2Tk(canvas, frame).update()
+            canvas.get_tk_widget().pack(fill='both', expand=True)
+            self.views[name] = frame
+        if self.current_view is not None:
+            self.views[self.current_view].pack_forget()
+        self.views[name].pack(fill='both', expand=True)
+        self.current_view = name
 
     def show_avg_distance_from_start(self):
-        self.simulation.plot_average_distance_from_start()
+        self.show_view('distance_from_start', self.simulation.draw_average_distance_from_start)
 
     def show_avg_distance_from_axis(self):
-        self.simulation.plot_average_distance_from_axis()
+        self.show_view('distance_from_axis', self.simulation.draw_average_distance_from_axis)
 
     def show_axes_crossing_stats(self):
-        self.simulation.plot_axis_crossings()
+        self.show_view('axis_crossings', self.simulation.draw_axis_crossings)
 
     def show_avg_steps_to_exit_radius(self):
         avg_steps = self.simulation.get_average_steps_to_exit_radius()
@@ -49,11 +86,16 @@ class ResultsDialog:
             tk.messagebox.showinfo("Average Steps to Exit Radius", f"Average steps to exit radius: {avg_steps}")
 
     def show_last_simulation_graph(self):
-        self.simulation.plot_last_sim_location()
+        try:
+            self.show_view('last_simulation', self.simulation.draw_last_sim_location)
+        except ValueError as e:
+            tk.messagebox.showerror("Last Simulation", str(e))
 
 
 class RandomWalkerGUI:
     "The class used to represent the main Random Walker GUI"
+    __POLL_MS = 100  # How often the progress of a running simulation is shown
+    __MAX_LISTED = 20  # The most items of every kind listed, a loaded scene can have many thousands
 
     def __init__(self, master: tk.Tk):
         self.__master = master
@@ -70,21 +112,27 @@ class RandomWalkerGUI:
         # Number of steps and simulations
         self.__num_steps = StringVar(value='100')  # Default number of steps
         self.__num_simulations = StringVar(value='10')  # Default number of simulations
+        self.__engine = StringVar(value='serial')  # Default simulation engine
+        self.__tolerance = StringVar(value='')  # Empty runs all the simulations
+        self.__metric = StringVar(value='distance')  # The metric the tolerance applies to
         self.__create_step_simulation_entries()
 
         # Obstacles and Magic Portals inputs
         self.__obstacles = []
         self.__magic_portals = {}
         self.__walls = {}
+        self.__validator = PlainValidator()  # Checks a new item only against the items near it
+        self.__scene_plain = None  # The plain of a loaded scene, with its prebuilt grids, until an item is added
         self.__create_obstacle_portal_walls_entries()
+        self.__create_scene_frame()
 
         # Obstacles and Portals display
         self.__obstacles_frame = LabelFrame(master, text="Obstacles")
-        self.__obstacles_frame.grid(row=7, column=0, columnspan=5, sticky='ew')
+        self.__obstacles_frame.grid(row=8, column=0, columnspan=5, sticky='ew')
         self.__portals_frame = LabelFrame(master, text="Magic Portals")
-        self.__portals_frame.grid(row=8, column=0, columnspan=5, sticky='ew')
+        self.__portals_frame.grid(row=9, column=0, columnspan=5, sticky='ew')
         self.__walls_frame = LabelFrame(master, text="Walls")
-        self.__walls_frame.grid(row=9, column=0, columnspan=5, sticky='ew')
+        self.__walls_frame.grid(row=10, column=0, columnspan=5, sticky='ew')
 
         # Reset button display
         self.__reset = BooleanVar(value=False)
@@ -93,7 +141,14 @@ class RandomWalkerGUI:
 
         # Submit button
         self.__submit_button = Button(master, text="Run Simulation", command=self.__run_simulation)
-        self.__submit_button.grid(row=10, columnspan=5, sticky='ew')
+        self.__submit_button.grid(row=11, columnspan=5, sticky='ew')
+
+        # Progress of the simulation that runs in the background
+        self.__simulation = None
+        self.__worker = None
+        self.__progress = (0, 1)  # Written by the worker thread, shown by __poll_run
+        self.__run_error = None
+        self.__create_progress_frame()
 
         # Update GUI based on movement type
         self.__update_movement_type()
@@ -106,7 +161,7 @@ class RandomWalkerGUI:
                                  " enter the probability of reseting back to start between 0 and 1.",
                             font=('Helvetica', 10), relief='groove', padx=10, pady=10, width=180)
         explanation.pack()
-        reset_frame.grid(row=3, column=0, columnspan=5, sticky='ew')
+        reset_frame.grid(row=4, column=0, columnspan=5, sticky='ew')
         self.__reset_value_entry = Entry(reset_frame, textvariable=self.__reset_value, width=5, state='disabled')
         button2 = Radiobutton(reset_frame, text="Yes", command=self.__update_reset, value=True, variable=self.__reset)
         button1 = Radiobutton(reset_frame, text="No", command=self.__update_reset, value=False, variable=self.__reset)
@@ -178,6 +233,18 @@ class RandomWalkerGUI:
         Entry(steps_frame, textvariable=self.__num_steps).pack(side='left')
         Label(steps_frame, text="Number of Simulations:").pack(side='left')
         Entry(steps_frame, textvariable=self.__num_simulations).pack(side='left')
+        Label(steps_frame, text="Engine:").pack(side='left')
+        Radiobutton(steps_frame, text="Serial", variable=self.__engine, value='serial').pack(side='left')
+        Radiobutton(steps_frame, text="Batch (NumPy)", variable=self.__engine, value='batch').pack(side='left')
+        Radiobutton(steps_frame, text="Exact (type 3)", variable=self.__engine, value='exact').pack(side='left')
+        tolerance_frame = LabelFrame(self.__master, text="Target Precision")
+        tolerance_frame.grid(row=3, column=0, columnspan=5, sticky='ew')
+        Label(tolerance_frame, text="Stop when the 95% confidence interval half width is at most (empty to run all"
+                                    " the simulations):").pack(side='left')
+        Entry(tolerance_frame, textvariable=self.__tolerance, width=8).pack(side='left')
+        for metric in Simulation.METRICS:
+            Radiobutton(tolerance_frame, text=metric.replace('_', ' ').capitalize(), variable=self.__metric,
+                        value=metric).pack(side='left')
 
     def __create_obstacle_portal_walls_entries(self):
         "The method used to define the obstacles, magic portals and walls entries"
@@ -188,7 +255,7 @@ class RandomWalkerGUI:
                                  " The obstacles you entered will be displayed in the list below.",
                             font=('Helvetica', 10), relief='groove', padx=10, pady=10, width=180)
         explanation.pack()
-        obstacle_frame.grid(row=4, column=0, columnspan=5, sticky='ew')
+        obstacle_frame.grid(row=5, column=0, columnspan=5, sticky='ew')
         self.__obstacle_x = StringVar()
         self.__obstacle_y = StringVar()
         Label(obstacle_frame, text="X:").pack(side='left')
@@ -203,7 +270,7 @@ class RandomWalkerGUI:
                                  "and the x and y coordinates of the destination of the portal and click Add.",
                             font=('Helvetica', 10), relief='groove', padx=10, pady=10, width=180)
         explanation.pack()
-        portal_frame.grid(row=5, column=0, columnspan=5, sticky='ew')
+        portal_frame.grid(row=6, column=0, columnspan=5, sticky='ew')
         self.__portal_x1 = StringVar()
         self.__portal_y1 = StringVar()
         self.__portal_x2 = StringVar()
@@ -219,7 +286,7 @@ class RandomWalkerGUI:
         Button(portal_frame, text="Add", command=self.__add_magic_portal).pack(side='left')
 
         wall_frame = LabelFrame(self.__master, text="Add Wall")
-        wall_frame.grid(row=6, column=0, columnspan=5, sticky='ew')
+        wall_frame.grid(row=7, column=0, columnspan=5, sticky='ew')
         explanation = Label(wall_frame,
                             text="If you want to add a wall, enter the x and y coordinates of the starting point of the wall"
                                  "and the x and y coordinates of the ending point of the wall and click Add.",
@@ -240,14 +307,8 @@ class RandomWalkerGUI:
         Button(wall_frame, text="Add", command=self.__add_wall).pack(side='left')
 
     def __valid_obstacle(self, obstacle: Tuple[float, float]) -> bool:
-        "The method used to check if the obstacle is valid"
-        if obstacle in self.__magic_portals or obstacle in self.__magic_portals.values():
-            return False
-        for wall in self.__walls:
-            if self.__calculate_det(wall, self.__walls[wall], obstacle) == 0:
-                # If the determinant is 0 then the obstacle is on the wall
-                return False
-        return True
+        "The method used to check if the obstacle is valid, it is not a point of a magic portal or on a wall"
+        return self.__validator.valid_obstacle(obstacle)
 
     def __add_obstacle(self):
         "The method used to add an obstacle to the obstacles list"
@@ -255,11 +316,13 @@ class RandomWalkerGUI:
             x = float(self.__obstacle_x.get())
             y = float(self.__obstacle_y.get())
             new_obstacle = (x, y)
-            if new_obstacle in self.__obstacles:
+            if self.__validator.has_obstacle(new_obstacle):
                 raise Already_Exist
             if not self.__valid_obstacle(new_obstacle):
                 raise ValueError
             self.__obstacles.append((x, y))
+            self.__validator.add_obstacle(new_obstacle)
+            self.__scene_plain = None
             self.__update_lists_display()
             # Now we reset the entry fields
             self.__obstacle_x.set('')
@@ -269,28 +332,9 @@ class RandomWalkerGUI:
         except Already_Exist:
             messagebox.showerror("Error", "The obstacle already exists")
 
-    def __calculate_det(self, point1: Tuple[float, float], point2: Tuple[float, float],
-                        point3: Tuple[float, float]) -> float:
-        """The method used to calculate the determinant of the 3 points
-               in order to determine if a point is in the line created by the other two points"""
-
-        x1, y1 = point1
-        x2, y2 = point2
-        x3, y3 = point3
-        return (x2 - x1) * (y3 - y1) - (x3 - x1) * (y2 - y1)
-
     def __valid_magic_portal(self, new_portal: Tuple[Tuple[float, float], Tuple[float, float]]) -> bool:
-        "The method used to check if the magic portal is valid"
-
-        if new_portal[0] == new_portal[1]:
-            return False
-        if new_portal[0] in self.__obstacles or new_portal[1] in self.__obstacles:
-            return False
-        for wall in self.__walls:
-            if (self.__calculate_det(wall, self.__walls[wall], new_portal[0]) == 0 or
-                    self.__calculate_det(wall, self.__walls[wall], new_portal[1]) == 0):
-                return False
-        return True
+        "The method used to check if the magic portal is valid, its points are not obstacles or on a wall"
+        return self.__validator.valid_magic_portal(*new_portal)
 
     def __add_magic_portal(self):
         try:
@@ -304,6 +348,8 @@ class RandomWalkerGUI:
             if new_portal[0] in self.__magic_portals or new_portal[1] in self.__magic_portals:
                 raise Already_Exist
             self.__magic_portals[new_portal[0]] = new_portal[1]
+            self.__validator.add_magic_portal(*new_portal)
+            self.__scene_plain = None
             self.__update_lists_display()
             self.__portal_x1.set('')
             self.__portal_y1.set('')
@@ -315,21 +361,8 @@ class RandomWalkerGUI:
             messagebox.showerror("Error", "The portal already exists")
 
     def __valid_wall(self, new_wall: Tuple[Tuple[float, float], Tuple[float, float]]) -> bool:
-        "The method used to check if the wall is valid"
-
-        if new_wall[0] in self.__obstacles or new_wall[1] in self.__obstacles:
-            return False
-        if (new_wall[0] in self.__magic_portals or new_wall[1] in self.__magic_portals or
-                new_wall[0] in self.__magic_portals.values() or new_wall[1] in self.__magic_portals.values()):
-            return False
-        for obstacles in self.__obstacles:
-            if self.__calculate_det(new_wall[0], new_wall[1], obstacles) == 0:
-                return False
-        for portal in self.__magic_portals:
-            if (self.__calculate_det(new_wall[0], new_wall[1], portal) == 0 or
-                    self.__calculate_det(new_wall[0], new_wall[1], self.__magic_portals[portal]) == 0):
-                return False
-        return True
+        "The method used to check if the wall is valid, no obstacle and no point of a magic portal is on it"
+        return self.__validator.valid_wall(*new_wall)
 
     def __add_wall(self):
         "The method used to add a wall to the walls list"
@@ -345,6 +378,8 @@ class RandomWalkerGUI:
             if new_wall[0] in self.__walls or new_wall[1] in self.__walls:
                 raise Already_Exist
             self.__walls[new_wall[0]] = new_wall[1]
+            self.__validator.add_wall(*new_wall)
+            self.__scene_plain = None
             self.__update_lists_display()
             self.__wall_x1.set('')
             self.__wall_y1.set('')
@@ -365,15 +400,128 @@ class RandomWalkerGUI:
             widget.destroy()
 
         # Update the obstacles frame with the current obstacles list
-        for obstacle in self.__obstacles:
+        for obstacle in self.__obstacles[:self.__MAX_LISTED]:
             Label(self.__obstacles_frame, text=str(obstacle)).pack()
+        self.__list_remaining(self.__obstacles_frame, len(self.__obstacles))
 
         # Update the portals frame with the current magic portals list
-        for portal in self.__magic_portals:
+        for portal in list(self.__magic_portals)[:self.__MAX_LISTED]:
             Label(self.__portals_frame, text=(str(portal) + "," + str(self.__magic_portals[portal]))).pack()
+        self.__list_remaining(self.__portals_frame, len(self.__magic_portals))
 
-        for wall in self.__walls:
+        for wall in list(self.__walls)[:self.__MAX_LISTED]:
             Label(self.__walls_frame, text=(str(wall) + "," + str(self.__walls[wall]))).pack()
+        self.__list_remaining(self.__walls_frame, len(self.__walls))
+
+    def __list_remaining(self, frame: LabelFrame, count: int):
+        "The method shows how many items of a list are not shown in its frame"
+        if count > self.__MAX_LISTED:
+            Label(frame, text=f"... and {count - self.__MAX_LISTED} more").pack()
+
+    def __create_scene_frame(self):
+        "The method used to define the buttons that load and save the obstacles, magic portals and walls"
+        scene_frame = LabelFrame(self.__master, text="Scene")
+        scene_frame.grid(row=13, column=0, columnspan=5, sticky='ew')
+        Label(scene_frame, text="Load the obstacles, magic portals and walls from a scene file, or save the ones you"
+                                " entered (.json for small scenes, .npz for large ones).").pack(side='left')
+        Button(scene_frame, text="Load Scene", command=self.__load_scene).pack(side='left', padx=2)
+        Button(scene_frame, text="Save Scene", command=self.__save_scene).pack(side='left', padx=2)
+
+    def __current_plain(self) -> Plain:
+        "The method returns the plain of the obstacles, magic portals and walls that were entered or loaded"
+        if self.__scene_plain is not None:
+            return self.__scene_plain
+        return Plain(self.__obstacles, dict(self.__magic_portals), dict(self.__walls))
+
+    def __load_scene(self):
+        "The method used to replace the obstacles, magic portals and walls with the ones of a scene file"
+        path = filedialog.askopenfilename(title="Load Scene",
+                                          filetypes=[("Scene files", ' '.join(f'*{f}' for f in SCENE_FORMATS))])
+        if not path:
+            return
+        try:
+            plain = load_scene(path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Can not load the scene: {e}")
+            return
+        self.__obstacles = list(plain.get_obstacles())
+        self.__magic_portals = dict(plain.get_magic_portals())
+        self.__walls = dict(plain.get_walls())
+        self.__validator = PlainValidator(self.__obstacles, self.__magic_portals, self.__walls)
+        self.__scene_plain = plain
+        self.__update_lists_display()
+
+    def __save_scene(self):
+        "The method used to save the obstacles, magic portals and walls to a scene file"
+        path = filedialog.asksaveasfilename(title="Save Scene", defaultextension=SCENE_FORMATS[0],
+                                            filetypes=[(f"{f[1:].upper()} scene", f'*{f}') for f in SCENE_FORMATS])
+        if not path:
+            return
+        try:
+            save_scene(self.__current_plain(), path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Can not save the scene: {e}")
+
+    def __create_progress_frame(self):
+        "The method used to define the progress bar and the cancel button of a running simulation"
+        progress_frame = LabelFrame(self.__master, text="Progress")
+        progress_frame.grid(row=12, column=0, columnspan=5, sticky='ew')
+        self.__progress_bar = ttk.Progressbar(progress_frame, mode='determinate', length=300)
+        self.__progress_bar.pack(side='left', padx=5, pady=5)
+        self.__progress_label = Label(progress_frame, text="")
+        self.__progress_label.pack(side='left', padx=5)
+        self.__cancel_button = Button(progress_frame, text="Cancel", command=self.__cancel_run, state='disabled')
+        self.__cancel_button.pack(side='right', padx=5)
+
+    def __start_run(self, simulation: Simulation):
+        "The method runs the simulation in a background thread so the window keeps responding"
+        self.__simulation = simulation
+        self.__progress = (0, 1)
+        self.__run_error = None
+        simulation.set_progress_callback(self.__on_progress)
+        self.__worker = threading.Thread(target=self.__run_in_background, daemon=True)
+        self.__submit_button.config(state='disabled')
+        self.__cancel_button.config(state='normal')
+        self.__progress_label.config(text="Running...")
+        self.__worker.start()
+        self.__master.after(self.__POLL_MS, self.__poll_run)
+
+    def __run_in_background(self):
+        "The method that runs in the worker thread, it must not touch the widgets"
+        try:
+            self.__simulation.run_simulations()
+        except Exception as e:
+            self.__run_error = e
+
+    def __on_progress(self, completed: int, total: int):
+        "The progress callback of the simulation, called from the worker thread, it only saves the progress"
+        self.__progress = (completed, total)
+
+    def __poll_run(self):
+        "The method shows the progress of the running simulation and opens the results when it finishes"
+        completed, total = self.__progress
+        self.__progress_bar.config(maximum=total, value=completed)
+        self.__progress_label.config(text=f"{completed}/{total} simulations")
+        if self.__worker.is_alive():
+            self.__master.after(self.__POLL_MS, self.__poll_run)
+            return
+        self.__submit_button.config(state='normal')
+        self.__cancel_button.config(state='disabled')
+        if self.__run_error is not None:
+            self.__progress_label.config(text="Failed")
+            messagebox.showerror("Error", str(self.__run_error))
+        elif self.__simulation.is_cancelled():
+            self.__progress_label.config(text=f"Cancelled after {completed} simulations")
+        else:
+            self.__progress_label.config(text=f"Done, {self.__simulation.get_num_simulations_run()} simulations")
+            ResultsDialog(self.__master, self.__simulation)
+
+    def __cancel_run(self):
+        "The method asks the running simulation to stop, __poll_run notices when it did"
+        if self.__simulation is not None:
+            self.__simulation.cancel()
+            self.__cancel_button.config(state='disabled')
+            self.__progress_label.config(text="Cancelling...")
 
     def __run_simulation(self):
         try:
@@ -384,6 +532,14 @@ class RandomWalkerGUI:
                 raise ValueError("Number of steps and simulations must be positive integers.")
             if num_steps <= 0 or num_simulations <= 0:
                 raise ValueError("Number of steps and simulations must be positive integers.")
+            tolerance = None
+            if self.__tolerance.get().strip():
+                try:
+                    tolerance = float(self.__tolerance.get())
+                except ValueError:
+                    raise ValueError("Tolerance must be a positive number.")
+                if tolerance <= 0:
+                    raise ValueError("Tolerance must be a positive number.")
             if self.__reset.get():
                 try:
                     self.__reset_value = float(self.__reset_value_entry.get())
@@ -405,10 +561,9 @@ class RandomWalkerGUI:
                 walker = Walker(movement_type=4, weights_list=weights, reset=self.__reset_value)
             else:
                 walker = Walker(movement_type=self.__movement_type.get(), reset=self.__reset_value)
-            plain = Plain(self.__obstacles, dict(self.__magic_portals), dict(self.__walls))
-            simulation = Simulation(plain, walker, num_steps, num_simulations)
-            simulation.run_simulations()
-            ResultsDialog(self.__master, simulation)
+            simulation = Simulation(self.__current_plain(), walker, num_steps, num_simulations,
+                                    engine=self.__engine.get(), tolerance=tolerance, metric=self.__metric.get())
+            self.__start_run(simulation)
         except ValueError as e:
             messagebox.showerror("Error", str(e))
 
@@ -0,0 +1,381 @@
+import math
+import numpy as np
+from typing import List, Tuple, Dict, Optional
+from plain import Plain
+from walker import Walker
+from spatial_index import segment_cells
+from geometry import segments_intersect_many, crossed_points
+
+
+class LatticeEngine:
+    """
+    A class that computes the statistics of the lattice walker (movement type 3) exactly, without sampling. Instead of
+    moving walkers it moves the probability of every location of an integer grid, one step at a time: a quarter of the
+    probability of every location goes to each of its four neighbours, like a stencil. The moves that an obstacle or a
+    wall blocks, and the ones that enter a magic portal, are found once before the run and corrected after the
+    stencil. A reset takes its share of the probability back to the origin.
+    The walker remembers its first move, so the probability of being at the origin before the first move (after the
+    start or a reset) is kept apart from the grid: the walls in the same line as the origin do not block that move.
+    The time to exit the radius is computed from a second distribution, of the walkers that did not exit yet.
+    The grid is virtual: only a buffer around the part of it where the probability is, is allocated, and the buffer
+    grows when the probability spreads, so the memory follows the spread of the walker and not the number of steps.
+    """
+    __DIRECTIONS: Tuple[Tuple[int, int], ...] = ((0, 1), (0, -1), (1, 0), (-1, 0))  # The order of Walker.step
+    __NEIGHBOURHOOD: np.ndarray = np.arange(-1, 3)  # The integer points near a cell whose steps may touch it
+    # The probability of a row or a column of the grid that is dropped, far below the precision of the results
+    NEGLIGIBLE: float = 1e-30
+    __MIN_MARGIN: int = 16  # The cells a buffer is grown by at least on every side, so it is not grown every step
+
+    def __init__(self, plain: Plain, walker: Walker, num_steps: int, exit_radius: float) -> None:
+        if walker.get_movement_type() != 3:
+            raise ValueError("The exact engine only supports movement type 3, the lattice walker")
+        destinations = list(plain.get_magic_portals().values())
+        if any(coordinate != math.floor(coordinate) for destination in destinations for coordinate in destination):
+            raise ValueError("The exact engine needs the destinations of the magic portals on integer points")
+        self.__num_steps: int = num_steps
+        self.__exit_radius: float = exit_radius
+        self.__reset: float = walker.get_reset()
+        # The grid covers every location the walker can reach: num_steps around the origin and the destinations
+        points = np.array([(0, 0)] + destinations, dtype=np.int64).reshape(-1, 2)
+        self.__low: np.ndarray = points.min(axis=0) - (num_steps + 1)  # The location of the cell (0, 0)
+        self.__shape: Tuple[int, int] = tuple(int(size) for size in points.max(axis=0) + (num_steps + 2) - self.__low)
+        self.__origin: Tuple[int, int] = (int(-self.__low[0]), int(-self.__low[1]))
+        # The origin and the destinations, where the walker can be after a step whatever happened before
+        self.__reach: Tuple[int, int, int, int] = (int(points[:, 0].min() - self.__low[0]),
+                                                   int(points[:, 0].max() - self.__low[0] + 1),
+                                                   int(points[:, 1].min() - self.__low[1]),
+                                                   int(points[:, 1].max() - self.__low[1] + 1))
+        self.__x: np.ndarray = (np.arange(self.__shape[0]) + self.__low[0]).astype(float)
+        self.__y: np.ndarray = (np.arange(self.__shape[1]) + self.__low[1]).astype(float)
+        # The cells of the grid (not the locations) the moves start and end on
+        self.__first_moves: List[Optional[Tuple[int, int]]] = self.__find_first_moves(plain)
+        self.__sources, self.__naive, self.__destinations, self.__crossings = self.__find_special_moves(plain)
+
+    def __cell(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        "The method returns the cells of the grid of locations, as an array of shape (locations, 2)"
+        return np.stack([np.asarray(x, dtype=np.int64) - self.__low[0],
+                         np.asarray(y, dtype=np.int64) - self.__low[1]], axis=-1).reshape(-1, 2)
+
+    @staticmethod
+    def __crossed(last_x: np.ndarray, last_y: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        "The method returns the crossings of the y-axis and of the x-axis of steps, like Simulation.__cross_axis"
+        y_axis = ((last_x <= 0) & (0 < x)) | ((last_x >= 0) & (0 > x))
+        x_axis = ((last_y <= 0) & (0 < y)) | ((last_y >= 0) & (0 > y))
+        return np.stack([y_axis, x_axis]).astype(float)
+
+    def __find_first_moves(self, plain: Plain) -> List[Optional[Tuple[int, int]]]:
+        "The method finds where every first move from the origin ends, None when it is blocked, with Plain itself"
+        walker = Walker(movement_type=3, history='off')
+        first_move = plain.get_first_move()
+        plain.set_first_move(True)
+        moves = []
+        try:
+            for dx, dy in self.__DIRECTIONS:
+                walker.set_location((dx, dy))
+                if plain.is_obstacle(walker, (0, 0)) or plain.hit_walls(walker, (0, 0)):
+                    moves.append(None)
+                    continue
+                plain.magic_portal(walker, (0, 0))
+                moves.append(tuple(int(value) for value in self.__cell(*walker.get_location())[0]))
+        finally:
+            plain.set_first_move(first_move)
+        return moves
+
+    def __find_special_moves(self, plain: Plain) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Find the moves that do not end on the neighbour in their direction: the ones an obstacle or a wall blocks and
+        the ones that enter a magic portal. Only the moves from the integer points near an obstacle, a wall or a
+        magic portal are checked.
+        :return: for every such move the cell of its start, of the neighbour and of where it ends, as arrays of shape
+        (moves, 2), and how its crossings of the y-axis and of the x-axis differ from the ones of a move to the neighbour
+        """
+        obstacles = np.array(plain.get_obstacles(), dtype=float).reshape(-1, 2)
+        portals = np.array(list(plain.get_magic_portals()), dtype=float).reshape(-1, 2)
+        walls = plain.get_walls_array()
+        offsets = np.stack(np.meshgrid(self.__NEIGHBOURHOOD, self.__NEIGHBOURHOOD, indexing='ij'), -1).reshape(-1, 2)
+
+        def near(cells: np.ndarray) -> np.ndarray:
+            "The integer points whose steps may touch the cells, as an array of shape (cells, points, 2)"
+            return np.floor(cells)[:, None, :].astype(np.int64) + offsets[None, :, :]
+
+        # The pairs of a start point and the feature its steps may touch
+        obstacle_pairs = near(obstacles)
+        portal_pairs = near(portals)
+        wall_cells = [np.array(segment_cells(tuple(wall[:2]), tuple(wall[2:]), 1.0), dtype=float).reshape(-1, 2)
+                      for wall in walls]
+        wall_index = np.concatenate([np.full(len(cells), index) for index, cells in enumerate(wall_cells)] +
+                                    [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+        wall_pairs = near(np.concatenate(wall_cells + [np.zeros((0, 2))]))
+
+        walker = Walker(movement_type=3, history='off')
+        sources, naive, destinations = [], [], []
+        for dx, dy in self.__DIRECTIONS:
+            blocked = []
+            # The obstacles on the step
+            start = obstacle_pairs.reshape(-1, 2)
+            feature = np.repeat(np.arange(len(obstacles)), len(offsets))
+            hit = crossed_points(start[:, 0] + dx, start[:, 1] + dy, start[:, 0], start[:, 1],
+                                 (obstacles[feature, 0], obstacles[feature, 1]))
+            blocked.append(start[hit])
+            # The walls across the step, the first move from the origin is handled apart
+            start = wall_pairs.reshape(-1, 2)
+            feature = wall_index.repeat(len(offsets))
+            hit = segments_intersect_many(start[:, 0], start[:, 1], start[:, 0] + dx, start[:, 1] + dy,
+                                          walls[feature, 0], walls[feature, 1], walls[feature, 2], walls[feature, 3])
+            blocked.append(start[hit])
+            blocked = self.__inside(np.unique(np.concatenate(blocked), axis=0), dx, dy)
+            # The magic portals on the step, where the step ends is found with Plain itself, since entering a portal
+            # checks the portals after it against the path to the destination
+            start = portal_pairs.reshape(-1, 2)
+            feature = np.repeat(np.arange(len(portals)), len(offsets))
+            hit = crossed_points(start[:, 0] + dx, start[:, 1] + dy, start[:, 0], start[:, 1],
+                                 (portals[feature, 0], portals[feature, 1]))
+            entering = self.__inside(np.unique(start[hit], axis=0), dx, dy)
+            if len(blocked) and len(entering):
+                blocked_keys = set(map(tuple, blocked.tolist()))
+                entering = entering[[tuple(point) not in blocked_keys for point in entering.tolist()]]
+            ends = []
+            for x, y in entering.tolist():
+                walker.set_location((x + dx, y + dy))
+                plain.magic_portal(walker, (x, y))
+                ends.append(walker.get_location())
+            ends = np.array(ends, dtype=np.int64).reshape(-1, 2)
+            moved = np.any(ends != entering + (dx, dy), axis=1)
+            start = np.concatenate([blocked, entering[moved]])
+            end = np.concatenate([blocked, ends[moved]])
+            sources.append(start)
+            naive.append(start + (dx, dy))
+            destinations.append(end)
+        sources, naive, destinations = (np.concatenate(points) for points in (sources, naive, destinations))
+        crossings = (self.__crossed(sources[:, 0], sources[:, 1], destinations[:, 0], destinations[:, 1]) -
+                     self.__crossed(sources[:, 0], sources[:, 1], naive[:, 0], naive[:, 1]))
+        return (self.__cell(sources[:, 0], sources[:, 1]), self.__cell(naive[:, 0], naive[:, 1]),
+                self.__cell(destinations[:, 0], destinations[:, 1]), crossings)
+
+    def __inside(self, points: np.ndarray, dx: int, dy: int) -> np.ndarray:
+        "The method keeps the start points whose step stays inside the grid, the others are never reached"
+        points = points.reshape(-1, 2)
+        low = self.__low
+        high = self.__low + self.__shape
+        inside = np.all((points >= low) & (points < high) & (points + (dx, dy) >= low) & (points + (dx, dy) < high),
+                        axis=1)
+        return points[inside]
+
+    @staticmethod
+    def __grow(window: Tuple[int, int, int, int], other: Tuple[int, int, int, int],
+               cells: int = 0) -> Tuple[int, int, int, int]:
+        "The method returns the bounds around window grown by cells on every side and other"
+        return (min(window[0] - cells, other[0]), max(window[1] + cells, other[1]),
+                min(window[2] - cells, other[2]), max(window[3] + cells, other[3]))
+
+    @staticmethod
+    def __clip(window: Tuple[int, int, int, int], other: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+        "The method returns the bounds of the part of window inside other"
+        return max(window[0], other[0]), min(window[1], other[1]), max(window[2], other[2]), min(window[3], other[3])
+
+    @staticmethod
+    def __contains(window: Tuple[int, int, int, int], other: Tuple[int, int, int, int]) -> bool:
+        "The method checks if other is inside window"
+        return window[0] <= other[0] and other[1] <= window[1] and window[2] <= other[2] and other[3] <= window[3]
+
+    @staticmethod
+    def __shift(window: Tuple[int, int, int, int], buffer: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+        "The method returns the bounds of window in the cells of a buffer"
+        return window[0] - buffer[0], window[1] - buffer[0], window[2] - buffer[2], window[3] - buffer[2]
+
+    def __buffer_moves(self, buffer: Tuple[int, int, int, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray,
+                                                                          np.ndarray, List[Optional[int]]]:
+        """
+        Find the special moves and the first moves in the cells of a buffer
+        :param buffer: the bounds of the buffer in the grid
+        :return: the indices in the flattened buffer of the start, the neighbour and the end of the special moves that
+        are inside the buffer (the others start where there is no probability), their crossings, and the index of the
+        end of every first move, or None
+        """
+        low = np.array([buffer[0], buffer[2]])
+        high = np.array([buffer[1], buffer[3]])
+        width = buffer[3] - buffer[2]
+        inside = np.ones(len(self.__sources), dtype=bool)
+        for cells in (self.__sources, self.__naive, self.__destinations):
+            inside &= np.all((cells >= low) & (cells < high), axis=1)
+
+        def flat(cells: np.ndarray) -> np.ndarray:
+            return (cells[:, 0] - low[0]) * width + (cells[:, 1] - low[1])
+
+        first_moves = [None if end is None else int((end[0] - low[0]) * width + end[1] - low[1])
+                       for end in self.__first_moves]
+        return (flat(self.__sources[inside]), flat(self.__naive[inside]), flat(self.__destinations[inside]),
+                self.__crossings[:, inside], first_moves)
+
+    def __advance(self, mass: np.ndarray, first: float, support: Tuple[int, int, int, int],
+                  window: Tuple[int, int, int, int], moved: np.ndarray, origin: Tuple[int, int],
+                  moves: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, List[Optional[int]]]) -> \
+            Tuple[float, np.ndarray]:
+        """
+        Move the probability one step, without the resets
+        :param mass: the probability of every location of a buffer before the step, it is 0 outside support and it
+        is all 0 after the step, so the buffers can be swapped
+        :param first: the probability of being at the origin before the first move
+        :param support: the bounds in the buffer of the part where the probability is before the step
+        :param window: the bounds in the buffer of the part where the probability can be after the step, support
+        grown by one cell on every side, the ends of the special moves and of the first moves must be inside
+        :param moved: the buffer to add the probability after the step to, all 0
+        :param origin: the cell of the origin in the buffer
+        :param moves: the special moves and the first moves in the buffer, see __buffer_moves
+        :return: the probability of staying at the origin before the first move (the first move was blocked), and the
+        expected crossings of the y-axis and of the x-axis in the step
+        """
+        low_x, high_x, low_y, high_y = window
+        share = 0.25 * (1 - self.__reset)
+        region = moved[low_x:high_x, low_y:high_y]
+        for dx, dy in self.__DIRECTIONS:
+            region[max(dx, 0):high_x - low_x + min(dx, 0), max(dy, 0):high_y - low_y + min(dy, 0)] += \
+                mass[low_x - min(dx, 0):high_x - max(dx, 0), low_y - min(dy, 0):high_y - max(dy, 0)]
+        region *= share
+        # A step off an axis crosses it, only the walkers on the axes cross them
+        origin_x, origin_y = origin
+        crossings = np.array([2 * mass[origin_x, low_y:high_y].sum(), 2 * mass[low_x:high_x, origin_y].sum()]) * share
+        sources, naive, destinations, special_crossings, first_moves = moves
+        flat = moved.reshape(-1)
+        amounts = share * mass.reshape(-1)[sources]
+        np.subtract.at(flat, naive, amounts)
+        np.add.at(flat, destinations, amounts)
+        crossings += special_crossings @ amounts
+        staying = 0.0
+        for end in first_moves:
+            if end is None:
+                staying += share * first
+                continue
+            flat[end] += share * first
+            end_x, end_y = divmod(end, moved.shape[1])
+            crossings += share * first * self.__crossed(0, 0, end_x - origin_x, end_y - origin_y)
+        mass[support[0]:support[1], support[2]:support[3]] = 0
+        return staying, crossings
+
+    def run(self) -> Dict:
+        """
+        Compute the statistics of the walker after every step
+        :return: a dictionary with the mean and the variance of the distance from the start and of the distances from
+        the axes ('x' is the distance from the x-axis, like in Simulation) after every step, the probability that the
+        walker exits the radius for the first time after every step and the expected crossings of every axis
+        """
+        num_steps = self.__num_steps
+        grid = (0, self.__shape[0], 0, self.__shape[1])
+        # The origin, the destinations and the cells next to them, where the first moves and the special moves end
+        reach = self.__clip(self.__grow(self.__reach, self.__reach, 1), grid)
+        origin_x, origin_y = self.__origin
+        mass_support = (origin_x, origin_x + 1, origin_y, origin_y + 1)  # Nothing is on the grid before the first move
+        first = 1.0
+        # The walkers that did not exit yet are inside the radius, or on the ends of the special moves for a step
+        staying_first = 1.0
+        radius = math.ceil(self.__exit_radius) + 1
+        staying_box = self.__clip((origin_x - radius, origin_x + radius + 1, origin_y - radius, origin_y + radius + 1),
+                                  grid)
+        staying_support = mass_support
+        # The ends of the moves outside the radius, the walkers that reach them exited
+        ends = np.unique(np.concatenate([self.__destinations, np.array([end for end in self.__first_moves
+                                                                        if end is not None]).reshape(-1, 2)]), axis=0)
+        ends = ends[np.hypot(self.__x[ends[:, 0]], self.__y[ends[:, 1]]) > self.__exit_radius]
+        # Only a buffer of the grid is allocated, it holds the probability, the walkers that did not exit and the
+        # grids they move to
+        buffer = (0, 0, 0, 0)
+        mass = moved = staying = moved_staying = distances = np.zeros((0, 0))
+        distance = np.zeros((2, num_steps + 1))  # The mean and the mean of the square
+        axis_distance = {'x': np.zeros((2, num_steps + 1)), 'y': np.zeros((2, num_steps + 1))}
+        exit_probabilities = np.zeros(num_steps + 1)
+        axis_crossings = np.zeros(2)
+        for step in range(1, num_steps + 1):
+            window = self.__clip(self.__grow(mass_support, reach, 1), grid)
+            staying_window = self.__clip(self.__grow(staying_support, reach, 1), staying_box)
+            needed = self.__grow(window, self.__grow(staying_window, reach))
+            if not self.__contains(buffer, needed):
+                # Grow the buffer by half its size, so it is grown a number of times that is only logarithmic
+                margin = max(self.__MIN_MARGIN, (needed[1] - needed[0] + needed[3] - needed[2]) // 4)
+                new_buffer = self.__clip(self.__grow(needed, needed, margin), grid)
+                mass, staying = (self.__move_buffer(values, buffer, new_buffer, support) for values, support in
+                                 ((mass, mass_support), (staying, staying_support)))
+                buffer = new_buffer
+                shape = (buffer[1] - buffer[0], buffer[3] - buffer[2])
+                moved, moved_staying = np.zeros(shape), np.zeros(shape)
+                distances = np.hypot(self.__x[buffer[0]:buffer[1], None], self.__y[None, buffer[2]:buffer[3]])
+                moves = self.__buffer_moves(buffer)
+                outside_ends = (ends[:, 0] - buffer[0]) * shape[1] + ends[:, 1] - buffer[2]
+                origin = (origin_x - buffer[0], origin_y - buffer[2])
+
+            first_staying, crossings = self.__advance(mass, first, self.__shift(mass_support, buffer),
+                                                      self.__shift(window, buffer), moved, origin, moves)
+            first = first_staying + self.__reset  # The resets take a share of all the probability, which is 1
+            mass, moved = moved, mass
+            axis_crossings += crossings
+
+            low_x, high_x, low_y, high_y = self.__shift(window, buffer)
+            region = mass[low_x:high_x, low_y:high_y]
+            along_x = region.sum(axis=1)  # The probability of every x
+            along_y = region.sum(axis=0)
+            x = self.__x[window[0]:window[1]]
+            y = self.__y[window[2]:window[3]]
+            axis_distance['y'][:, step] = along_x @ np.abs(x), along_x @ x ** 2
+            axis_distance['x'][:, step] = along_y @ np.abs(y), along_y @ y ** 2
+            distance[0, step] = (region * distances[low_x:high_x, low_y:high_y]).sum()
+            distance[1, step] = axis_distance['x'][1, step] + axis_distance['y'][1, step]
+            mass_support = self.__trim(mass, window, along_x, along_y, reach, buffer)
+
+            low_x, high_x, low_y, high_y = self.__shift(staying_support, buffer)
+            total = staying[low_x:high_x, low_y:high_y].sum()
+            first_staying, _ = self.__advance(staying, staying_first, self.__shift(staying_support, buffer),
+                                              self.__shift(staying_window, buffer), moved_staying, origin, moves)
+            staying_first = first_staying + self.__reset * (total + staying_first)
+            staying, moved_staying = moved_staying, staying
+            low_x, high_x, low_y, high_y = self.__shift(staying_window, buffer)
+            region = staying[low_x:high_x, low_y:high_y]
+            exited = distances[low_x:high_x, low_y:high_y] > self.__exit_radius
+            exit_probabilities[step] = region[exited].sum()
+            region[exited] = 0
+            flat = staying.reshape(-1)
+            exit_probabilities[step] += flat[outside_ends].sum()
+            flat[outside_ends] = 0
+            staying_support = staying_window
+
+        means = {'distance': distance[0], 'x': axis_distance['x'][0], 'y': axis_distance['y'][0]}
+        variances = {'distance': distance[1] - distance[0] ** 2, 'x': axis_distance['x'][1] - axis_distance['x'][0] ** 2,
+                     'y': axis_distance['y'][1] - axis_distance['y'][0] ** 2}
+        return {'distance_mean': means['distance'], 'distance_variance': np.maximum(variances['distance'], 0),
+                'axis_distance_mean': {axis: means[axis] for axis in ['x', 'y']},
+                'axis_distance_variance': {axis: np.maximum(variances[axis], 0) for axis in ['x', 'y']},
+                'exit_probabilities': exit_probabilities,
+                'axis_crossings': {'y': float(axis_crossings[0]), 'x': float(axis_crossings[1])}}
+
+    def __move_buffer(self, values: np.ndarray, buffer: Tuple[int, int, int, int],
+                      new_buffer: Tuple[int, int, int, int], support: Tuple[int, int, int, int]) -> np.ndarray:
+        "The method copies the part of a buffer where the probability is (support, in the grid) to a bigger buffer"
+        moved = np.zeros((new_buffer[1] - new_buffer[0], new_buffer[3] - new_buffer[2]))
+        support = self.__clip(support, buffer)  # Before the first buffer there is no probability on the grid
+        if support[0] < support[1] and support[2] < support[3]:
+            old = self.__shift(support, buffer)
+            new = self.__shift(support, new_buffer)
+            moved[new[0]:new[1], new[2]:new[3]] = values[old[0]:old[1], old[2]:old[3]]
+        return moved
+
+    def __trim(self, mass: np.ndarray, window: Tuple[int, int, int, int], along_x: np.ndarray, along_y: np.ndarray,
+               reach: Tuple[int, int, int, int], buffer: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+        """
+        Find the part of the window where the probability is not negligible and set the rest to 0. The far tails of
+        the distribution are below NEGLIGIBLE, so the buffer only grows with the spread of the walker and not with
+        the number of steps.
+        :return: the bounds in the grid of the part where the probability is, always with reach inside
+        """
+        low_x, high_x, low_y, high_y = window
+        kept_x = np.nonzero(along_x > self.NEGLIGIBLE)[0]
+        kept_y = np.nonzero(along_y > self.NEGLIGIBLE)[0]
+        if len(kept_x) == 0 or len(kept_y) == 0:
+            support = reach
+        else:
+            support = self.__grow((low_x + int(kept_x[0]), low_x + int(kept_x[-1]) + 1,
+                                   low_y + int(kept_y[0]), low_y + int(kept_y[-1]) + 1), reach)
+        low_x, high_x, low_y, high_y = self.__shift(window, buffer)
+        kept = self.__shift(support, buffer)
+        mass[low_x:kept[0], low_y:high_y] = 0
+        mass[kept[1]:high_x, low_y:high_y] = 0
+        mass[low_x:high_x, low_y:kept[2]] = 0
+        mass[low_x:high_x, kept[3]:high_y] = 0
+        return support
@@ -1,14 +1,14 @@
 import random
 import math
-import matplotlib.pyplot as plt
 from plain import *
 from walker import *
-from matplotlib.animation import FuncAnimation
 from simulation import *
+from scene import SCENE_FORMATS, load_scene, save_scene
 import argparse
 import re
 import subprocess
 import sys
+import os
 
 
 
@@ -72,6 +72,62 @@ def valid_num_simulations(value: str) -> int:
             f"{value} is not a valid integer. Number of simulations must be a positive integer.")
 
 
+def valid_batch_size(value: str) -> int:
+    "The function to validate the batch size input"
+    try:
+        ivalue = int(value)
+        if ivalue <= 0:
+            raise argparse.ArgumentTypeError(f"{value} is an invalid batch size. Must be a positive integer.")
+        return ivalue
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a valid integer. Batch size must be a positive integer.")
+
+
+def valid_workers(value: str) -> int:
+    "The function to validate the number of workers input"
+    try:
+        ivalue = int(value)
+        if ivalue <= 0:
+            raise argparse.ArgumentTypeError(f"{value} is an invalid number of workers. Must be a positive integer.")
+        return ivalue
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"{value} is not a valid integer. Number of workers must be a positive integer.")
+
+
+def valid_tolerance(value: str) -> float:
+    "The function to validate the tolerance input"
+    try:
+        fvalue = float(value)
+        if fvalue <= 0:
+            raise argparse.ArgumentTypeError(f"{value} is an invalid tolerance. Must be a positive number.")
+        return fvalue
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a valid number. Tolerance must be a positive number.")
+
+
+def valid_weight(value: str) -> float:
+    "The function to validate the weight of a direction of movement type 4"
+    try:
+        fvalue = float(value)
+        if fvalue < 0 or fvalue > 1:
+            raise argparse.ArgumentTypeError(f"{value} is an invalid weight. Must be a float between 0 and 1.")
+        return fvalue
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a valid float. Weight must be a float between 0 and 1.")
+
+
+def valid_max_plot_points(value: str) -> int:
+    "The function to validate the most points a graph draws"
+    try:
+        ivalue = int(value)
+        if ivalue < 4:
+            raise argparse.ArgumentTypeError(f"{value} is an invalid number of points. Must be at least 4.")
+        return ivalue
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a valid integer. Number of points must be at least 4.")
+
+
 # Parse command line arguments
 parser = argparse.ArgumentParser(description='Welcome to the Random Walker Simulation! Its best to run the program through the GUI.'
                                              ' In order to use the GUI run python gui.py or python main.py --gui.')
@@ -80,6 +136,10 @@ parser.add_argument('--movement', type=valid_movement_type, help='The movement t
                                                                  ' 3 for one step at 1 of 4 general directions and 4 for one step of 4 at general direction'
                                                                  ' or to start point direction with different probabilities, set default to 1',
                     default=1)
+parser.add_argument('--weights', type=valid_weight, nargs=5, default=None,
+                    help='The weights of the directions of movement type 4 (up, down, right, left and to the start'
+                         ' point), five floats between 0 and 1 that sum to 1. Without it they are asked for, or all'
+                         ' 0.2 with --headless')
 parser.add_argument('--obstacles', type=valid_obstacle, nargs='*', help='List of obstacles as "(x,y)"', default=[])
 parser.add_argument('--walls', type=valid_magic_portal_or_wall, nargs='*', help='List of walls as "((x1,y1),(x2,y2))"'
                                                                                 ' where first tuple is the starting point of the wall and second tuple is the ending point of the wall',
@@ -87,72 +147,219 @@ parser.add_argument('--walls', type=valid_magic_portal_or_wall, nargs='*', help=
 parser.add_argument('--magic_portals', type=valid_magic_portal_or_wall, nargs='*', help='List of magic portals,'
                                                                                         ' first tuple is the portal and the second is the destination as "((x1,y1),(x2,y2))" ',
                     default=[])
+parser.add_argument('--scene', type=str, default=None,
+                    help='A scene file (%s) to take the obstacles, walls and magic portals from instead of'
+                         ' --obstacles, --walls and --magic_portals, .npz scenes of many items load much faster,'
+                         ' set default to none' % ', '.join(SCENE_FORMATS))
+parser.add_argument('--save_scene', type=str, default=None,
+                    help='A scene file (%s) to save the obstacles, walls and magic portals of the run to, set default'
+                         ' to none' % ', '.join(SCENE_FORMATS))
 parser.add_argument('--num_steps', type=valid_num_steps, help='Number of steps per simulation(a natural number), set default to 100',
                     default=100)
 parser.add_argument('--num_simulations', type=valid_num_simulations,
-                    help='Number of simulations to run(a natural number), set default to 10', default=10)
+                    help='Number of simulations to run(a natural number), with --tolerance it is the most simulations'
+                         ' to run, set default to 10', default=10)
 parser.add_argument('--reset', type=float,
                     help='The probability between 0-1 of the walker to reset to the start point after each step,'
                          ' default is 0', default=0)
+parser.add_argument('--engine', choices=Simulation.ENGINES, default='serial',
+                    help='The engine that runs the simulations, serial runs them one after the other and batch runs'
+                         ' all of them together as NumPy arrays (much faster for many simulations), exact computes'
+                         ' the statistics of movement type 3 without sampling, default is serial')
+parser.add_argument('--workers', type=valid_workers, default=1,
+                    help='Number of processes to split the simulations between, set default to 1')
+parser.add_argument('--seed', type=int, default=None,
+                    help='The base seed of the random numbers, the results are reproducible for the same seed and'
+                         ' number of workers')
+parser.add_argument('--history', choices=Walker.HISTORY_MODES, default='last',
+                    help='Which locations of the walker to keep, off keeps none, last keeps the last simulation'
+                         ' (needed for its graph) and all keeps every simulation, default is last')
+parser.add_argument('--trajectories', type=str, default=None,
+                    help='A .npy file to save the location after every step of every simulation to (memory-mapped,'
+                         ' with a .json file of the configuration next to it), set default to none')
+parser.add_argument('--tolerance', type=valid_tolerance, default=None,
+                    help='Run the simulations in batches until the half width of the 95%% confidence interval of the'
+                         ' metric is at most the tolerance (or --num_simulations ran), set default to none')
+parser.add_argument('--metric', choices=Simulation.METRICS, default='distance',
+                    help='The metric --tolerance applies to, the distances are the ones after the last step,'
+                         ' default is distance')
+parser.add_argument('--batch_size', type=valid_batch_size, default=100,
+                    help='Number of simulations to run between the checks of --tolerance, set default to 100')
+parser.add_argument('--checkpoint', type=str, default=None,
+                    help='A .npz file to save the state of the run to after every --batch_size simulations, so a'
+                         ' killed run can be continued with --resume, set default to none')
+parser.add_argument('--resume', action='store_true',
+                    help='Continue the run saved in --checkpoint, its configuration is taken from the checkpoint and'
+                         ' the results are the same as the ones of an uninterrupted run')
+parser.add_argument('--profile', action='store_true',
+                    help='Measure the time of every phase of the steps (moving, the reset draw, the obstacles, the'
+                         ' walls, the magic portals and the history) and count the collisions, teleports and resets')
+parser.add_argument('--max_plot_points', type=valid_max_plot_points, default=DEFAULT_MAX_POINTS,
+                    help='The most points a graph draws, longer curves and paths are downsampled (zooming in shows'
+                         f' more detail), set default to {DEFAULT_MAX_POINTS}')
+parser.add_argument('--headless', action='store_true',
+                    help='Run without asking anything and without opening windows: the statistics are written to'
+                         ' --output (the standard output by default) and the graphs are saved to --plots if asked for')
+parser.add_argument('--output', type=str, default=None,
+                    help='A file to write the statistics to, as JSON, CSV or .npz by its extension, - for the'
+                         ' standard output, set default to none (the standard output with --headless)')
+parser.add_argument('--output_format', choices=Simulation.RESULT_FORMATS, default=None,
+                    help='The format of --output, by default the extension of the file (JSON for the standard output)')
+parser.add_argument('--plots', type=str, default=None,
+                    help='A directory to save the graphs to as image files, set default to none (no files)')
+parser.add_argument('--plot_format', type=str, default='png',
+                    help='The image format of the graphs in --plots (png, svg, pdf...), default is png')
 parser.add_argument('--gui', action='store_true', help='Run the program through the GUI.')
 
-args = parser.parse_args()
 
-if args.gui:
-    print("Running GUI...")
-    python_executable = 'C:\\Users\\idodo\\Desktop\\לימודים\\אינטרו\\RandomWalker\\.venv\\Scripts\\python.exe'
-    subprocess.run([python_executable, 'gui.py'])
-    sys.exit()  # Exit after running the GUI
+def main() -> None:
+    "The function that runs the simulation from the command line"
+    args = parser.parse_args()
+
+    if args.gui:
+        print("Running GUI...")
+        python_executable = 'C:\\Users\\idodo\\Desktop\\לימודים\\אינטרו\\RandomWalker\\.venv\\Scripts\\python.exe'
+        subprocess.run([python_executable, 'gui.py'])
+        sys.exit()  # Exit after running the GUI
 
-if args.movement == 4:
-    print("You chose movement type 4, please enter the weights for each direction")
-    weights = []
-    i = 1
-    total_1 = False
-    while not total_1:
+    if args.output is None and args.headless:
+        args.output = '-'
+    if args.output is not None:
+        # Checked before the run, so a bad file name does not throw away the simulations that ran
+        try:
+            args.output_format = Simulation.result_format(args.output, args.output_format)
+        except ValueError:
+            parser.error(f"Can not tell the format of --output {args.output}, give it an extension of one of"
+                         f" {', '.join(Simulation.RESULT_FORMATS)} or use --output_format")
+    if args.resume and args.checkpoint is None:
+        parser.error("--resume needs the --checkpoint file to continue from")
+    if args.resume and not os.path.exists(args.checkpoint):
+        parser.error(f"There is no checkpoint {args.checkpoint} to resume from")
+    if args.resume:
+        simulation = Simulation.from_checkpoint(args.checkpoint, profile=args.profile)
+        print(f"Resuming from {args.checkpoint} after {simulation.get_num_simulations_run()} simulations",
+              file=sys.stderr if args.headless else sys.stdout)
+        run_and_report(simulation, args.max_plot_points, **report_options(args))
+        return
+
+    # Create a plain with obstacles and magic portals
+    if args.scene is not None:
+        if args.obstacles or args.walls or args.magic_portals:
+            parser.error("--scene can not be used with --obstacles, --walls or --magic_portals")
+        try:
+            plain = load_scene(args.scene)
+        except (OSError, ValueError) as e:
+            parser.error(f"Can not load the scene {args.scene}: {e}")
+    else:
+        plain = Plain(obstacles=args.obstacles, magic_portals=dict(args.magic_portals), walls=dict(args.walls))
+    if args.save_scene is not None:
+        try:
+            save_scene(plain, args.save_scene)
+        except (OSError, ValueError) as e:
+            parser.error(f"Can not save the scene {args.save_scene}: {e}")
+    if args.tolerance is not None and args.trajectories is not None:
+        parser.error("--trajectories needs a fixed number of simulations, it can not be used with --tolerance")
+    if args.engine == 'exact' and args.movement != 3:
+        parser.error("--engine exact only supports --movement 3, the lattice walker")
+    if args.engine == 'exact' and args.trajectories is not None:
+        parser.error("--engine exact has no trajectories, it can not be used with --trajectories")
+    if args.weights is not None and not math.isclose(sum(args.weights), 1):
+        parser.error("The sum of the weights must be 1")
+    if args.movement == 4 and args.weights is None and not args.headless:
+        print("You chose movement type 4, please enter the weights for each direction")
+        weights = []
         i = 1
-        while len(weights) < 5:
-            try:
-                weight = float(input(f"Enter the weight for direction {i}: "))
-                if weight < 0 or weight > 1:
-                    raise argparse.ArgumentTypeError(
-                        f"{weight} is an invalid weight. Must be a positive float between 0 and 1.")
-                else:
-                    weights.append(weight)
-                    i += 1
-            except ValueError:
-                raise argparse.ArgumentTypeError("Not a valid float. Weight must be a float between 0 and 1.")
-        if sum(weights) == 1:
-            total_1 = True
-        else:
-            print("The sum of the weights must be 1, please enter the weights again")
-            weights = []
-    args.weights = weights
-# Create a plain with obstacles and magic portals
-plain = Plain(obstacles=args.obstacles, magic_portals=dict(args.magic_portals), walls=dict(args.walls))
-walker = Walker(movement_type=args.movement, reset=args.reset,
-                weights_list=args.weights if args.movement == 4 else None)
-simulation = Simulation(plain, walker, args.num_steps, args.num_simulations)
-simulation.run_simulations()
-print("Done! all simulations are finished.")
-graph_of_distances = input(
-    "Do you want to see the graph of the distances? enter yes if you want to see it and anything else otherwise:")
-if graph_of_distances == "yes":
-    simulation.plot_average_distance_from_start()
-avg_time_out_of_radius = input(
-    "Do you want to see the average time the walker was out of the radius? enter yes if you want to see it and anything else otherwise:")
-if avg_time_out_of_radius == "yes":
-    print(simulation.get_average_steps_to_exit_radius())
-graph_of_distance_from_axis = input(
-    "Do you want to see the graph of the distance from the axisis? enter yes if you want to see it and anything else otherwise:")
-if graph_of_distance_from_axis == "yes":
-    simulation.plot_average_distance_from_axis()
-graph_of_cross_axis = input(
-    "Do you want to see the graph of the number of times the walker crossed the axis? enter yes if you want to see it and anything else otherwise:")
-if graph_of_cross_axis == "yes":
-    simulation.plot_axis_crossings()
-graph_of_last_simulation = input(
-    "Do you want to see the graph of the last simulation? enter yes if you want to see it and anything else otherwise:")
-if graph_of_last_simulation == "yes":
-    simulation.plot_last_sim_location()
+        total_1 = False
+        while not total_1:
+            i = 1
+            while len(weights) < 5:
+                try:
+                    weight = float(input(f"Enter the weight for direction {i}: "))
+                    if weight < 0 or weight > 1:
+                        raise argparse.ArgumentTypeError(
+                            f"{weight} is an invalid weight. Must be a positive float between 0 and 1.")
+                    else:
+                        weights.append(weight)
+                        i += 1
+                except ValueError:
+                    raise argparse.ArgumentTypeError("Not a valid float. Weight must be a float between 0 and 1.")
+            if sum(weights) == 1:
+                total_1 = True
+            else:
+                print("The sum of the weights must be 1, please enter the weights again")
+                weights = []
+        args.weights = weights
+    walker = Walker(movement_type=args.movement, reset=args.reset,
+                    weights_list=args.weights if args.movement == 4 else None, history=args.history)
+    simulation = Simulation(plain, walker, args.num_steps, args.num_simulations, engine=args.engine,
+                            workers=args.workers, seed=args.seed, trajectory_path=args.trajectories,
+                            tolerance=args.tolerance, metric=args.metric, batch_size=args.batch_size,
+                            checkpoint_path=args.checkpoint, profile=args.profile)
+    run_and_report(simulation, args.max_plot_points, **report_options(args))
+
+
+def report_options(args: argparse.Namespace) -> Dict:
+    "The function returns the arguments of run_and_report about the files to save the results to"
+    return {'headless': args.headless, 'output': args.output, 'output_format': args.output_format,
+            'plots': args.plots, 'plot_format': args.plot_format}
+
+
+def run_and_report(simulation: Simulation, max_plot_points: int = DEFAULT_MAX_POINTS, headless: bool = False,
+                   output: Optional[str] = None, output_format: Optional[str] = None, plots: Optional[str] = None,
+                   plot_format: str = 'png') -> None:
+    """
+    Run the simulations, save the results to files if asked for, and ask the user which results to show
+    :param simulation: the simulation to run
+    :param max_plot_points: the most points a graph draws
+    :param headless: True to ask nothing and show nothing, the messages go to the standard error so the standard
+    output only has the statistics
+    :param output: a file to write the statistics to, see Simulation.save_results, '-' for the standard output (the
+    default when headless)
+    :param output_format: the format of output, by default its extension
+    :param plots: a directory to save the graphs to, None for no files
+    :param plot_format: the image format of the saved graphs
+    :return: None
+    """
+    metadata = simulation.get_metadata()
+    messages = sys.stderr if headless else sys.stdout
+    simulation.run_simulations()
+    print("Done! all simulations are finished.", file=messages)
+    if metadata['tolerance'] is not None:
+        print(f"Ran {simulation.get_num_simulations_run()} simulations, the 95% confidence interval half width of the"
+              f" {metadata['metric']} is {simulation.get_half_width()}", file=messages)
+    if simulation.get_profiler() is not None:
+        print(simulation.get_profiler().report(), file=messages)
+    if output is None and headless:
+        output = '-'
+    if output is not None:
+        simulation.save_results(output, output_format)
+    if plots is not None:
+        for path in simulation.save_plots(plots, max_points=max_plot_points, image_format=plot_format):
+            print(f"Saved {path}", file=messages)
+    if headless:
+        return
+    graph_of_distances = input(
+        "Do you want to see the graph of the distances? enter yes if you want to see it and anything else otherwise:")
+    if graph_of_distances == "yes":
+        simulation.plot_average_distance_from_start(max_plot_points)
+    avg_time_out_of_radius = input(
+        "Do you want to see the average time the walker was out of the radius? enter yes if you want to see it and anything else otherwise:")
+    if avg_time_out_of_radius == "yes":
+        print(simulation.get_average_steps_to_exit_radius())
+    graph_of_distance_from_axis = input(
+        "Do you want to see the graph of the distance from the axisis? enter yes if you want to see it and anything else otherwise:")
+    if graph_of_distance_from_axis == "yes":
+        simulation.plot_average_distance_from_axis(max_plot_points)
+    graph_of_cross_axis = input(
+        "Do you want to see the graph of the number of times the walker crossed the axis? enter yes if you want to see it and anything else otherwise:")
+    if graph_of_cross_axis == "yes":
+        simulation.plot_axis_crossings()
+    if metadata['walker']['history'] != 'off' and metadata['engine'] != 'exact':
+        graph_of_last_simulation = input(
+            "Do you want to see the graph of the last simulation? enter yes if you want to see it and anything else otherwise:")
+        if graph_of_last_simulation == "yes":
+            simulation.plot_last_sim_location(max_plot_points)
+
 
+if __name__ == '__main__':
+    main()
@@ -1,61 +1,176 @@
 import random
+import time
+import numpy as np
 from typing import List, Tuple, Dict, Optional
 from walker import Walker
-from shapely.geometry import LineString, Polygon
+from spatial_index import SegmentGrid, PointGrid
+from geometry import calculate_det, are_collinear, segments_intersect, segments_intersect_many, are_collinear_many
+from profiler import PhaseProfiler
 
 
 class Plain:
     """
-    A class to represent a plain where the walker moves. the plain can have obstacles, walls and magic portals
+    A class to represent a plain where the walker moves. the plain can have obstacles, walls and magic portals.
+    A grid of the walls that was already built over them, in their order (like the one a scene file keeps), can be
+    given as walls_index so it is not built again
     """
+    __VECTORIZED_WALLS: int = 16  # From this many walls near a step, they are checked together with NumPy
 
     def __init__(self, obstacles: Optional[List[Tuple[float, float]]] = None,
                  magic_portals: Optional[Dict[Tuple[float, float], Tuple[float, float]]] = None,
-                 walls: Optional[Dict[Tuple[int, int], Tuple[int, int]]] = None) -> None:
+                 walls: Optional[Dict[Tuple[int, int], Tuple[int, int]]] = None,
+                 walls_index: Optional[SegmentGrid] = None) -> None:
         self.__obstacles: List[Tuple[float, float]] = list(set(obstacles)) if obstacles else []
         self.__magic_portals: Dict[Tuple[float, float], Tuple[float, float]] = magic_portals if magic_portals else {}
         self.__walls: Dict[Tuple[float, float], Tuple[float, float]] = walls if walls else {}
+        self.__walls_index: SegmentGrid = SegmentGrid()
+        self.__walls_array: np.ndarray = np.zeros((0, 4))
+        self.__walls_collinear: np.ndarray = np.zeros(0, dtype=bool)
+        self.__walls_collinear_list: List[bool] = []
+        self.__build_walls_index(walls_index)
         self.__magic_portals = self.filter_magic_portals()
+        self.__obstacles_index: PointGrid = PointGrid(self.__obstacles)
+        self.__portals_index: PointGrid = PointGrid(list(self.__magic_portals))
+        self.__portal_ends: List[Tuple[float, float]] = []  # Where entering every portal ends, see __build_portal_table
+        self.__portal_chain_lengths: List[int] = []
+        self.__build_portal_table()
         self.__first_move = True
+        self.__profiler: Optional[PhaseProfiler] = None  # Set only while a run is profiled, see move_walker
+
+    def to_dict(self) -> Dict:
+        "The method returns the obstacles, magic portals and walls of the plain as a JSON friendly dictionary"
+        return {'obstacles': [list(obstacle) for obstacle in self.__obstacles],
+                'magic_portals': [[list(portal), list(destination)] for portal, destination in
+                                  self.__magic_portals.items()],
+                'walls': [[list(start), list(end)] for start, end in self.__walls.items()]}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Plain':
+        "The method builds a plain from a dictionary made by to_dict"
+        return cls(obstacles=[tuple(obstacle) for obstacle in data.get('obstacles', [])],
+                   magic_portals={tuple(portal): tuple(destination) for portal, destination in
+                                  data.get('magic_portals', [])},
+                   walls={tuple(start): tuple(end) for start, end in data.get('walls', [])})
 
     def filter_magic_portals(self) -> Dict[Tuple[float, float], Tuple[float, float]]:
         """
-        returns a filtered dictionary of magic portals so that they are not in the same line as any wall or obstacle and
-        they are not in the same line as any other magic portal
+        returns a filtered dictionary of magic portals without the ones whose entrance or destination is an obstacle
         :return: a dictionary of filtered magic portals
         """
-        new_magic_portals = {}
-        for portal in self.__magic_portals:
-            if portal in self.__obstacles or self.__magic_portals[portal] in self.__obstacles:
-                continue
-            else:
-                for wall in self.__walls:
-                    if self.calculate_det(wall, self.__walls[wall], portal) == 0:
-                        continue
-                for other_portal in self.__magic_portals:
-                    if portal == self.__magic_portals[other_portal] or portal == other_portal:
-                        continue
-            new_magic_portals[portal] = self.__magic_portals[portal]
-        return new_magic_portals
+        obstacles = set(self.__obstacles)  # Hashed, so filtering does not scan the obstacles for every portal
+        return {portal: destination for portal, destination in self.__magic_portals.items()
+                if portal not in obstacles and destination not in obstacles}
 
     def get_obstacles(self) -> List[Tuple[float, float]]:
         return self.__obstacles
 
     def set_obstacles(self, obstacles: List[Tuple[float, float]]) -> None:
         self.__obstacles = list(set(obstacles)) if obstacles else []
+        self.__obstacles_index = PointGrid(self.__obstacles)
+
+    def get_obstacles_index(self) -> PointGrid:
+        return self.__obstacles_index
 
     def get_walls(self) -> Dict[Tuple[float, float], Tuple[float, float]]:
         return self.__walls
 
     def set_walls(self, walls: Dict[Tuple[float, float], Tuple[float, float]]) -> None:
         self.__walls = walls if walls else {}
+        self.__build_walls_index()
+
+    def __build_walls_index(self, walls_index: Optional[SegmentGrid] = None) -> None:
+        """The method builds everything about the walls that does not depend on the walker, in the order of the walls:
+         the grid of the walls (unless a grid of the same walls is given), the array of their end points and whether
+         they are in the same line as the origin"""
+        walls = list(self.__walls.items())
+        if walls_index is not None and walls_index.get_segments() != walls:
+            raise ValueError("walls_index must be built over the walls, in their order")
+        self.__walls_index = walls_index if walls_index is not None else SegmentGrid(walls)
+        self.__walls_array = np.array([(start[0], start[1], end[0], end[1]) for start, end in walls],
+                                      dtype=float).reshape(-1, 4)
+        x1, y1, x2, y2 = self.__walls_array.T
+        self.__walls_collinear = are_collinear_many(x1, y1, x2, y2, 0.0, 0.0)
+        self.__walls_collinear_list = self.__walls_collinear.tolist()
+
+    def get_walls_index(self) -> SegmentGrid:
+        return self.__walls_index
+
+    def get_walls_array(self) -> np.ndarray:
+        "The end points of the walls as an array of shape (walls, 4): x1, y1, x2, y2, in the order of get_walls"
+        return self.__walls_array
+
+    def get_walls_collinear(self) -> np.ndarray:
+        "Whether every wall is in the same line as the origin, so it does not stop the first move, in the same order"
+        return self.__walls_collinear
 
     def get_magic_portals(self) -> Dict[Tuple[float, float], Tuple[float, float]]:
         return self.__magic_portals
 
     def set_magic_portals(self, magic_portals: Dict[Tuple[float, float], Tuple[float, float]]) -> None:
         self.__magic_portals = magic_portals if magic_portals else {}
-        self.filter_magic_portals()
+        self.__magic_portals = self.filter_magic_portals()
+        self.__portals_index = PointGrid(list(self.__magic_portals))
+        self.__build_portal_table()
+
+    def __build_portal_table(self) -> None:
+        """The method resolves the chains of magic portals: a walker sent to the entrance of another portal goes on
+         through it, so entering a portal ends at the destination of the last portal of its chain. A chain that comes
+         back to a portal it already went through (a cycle) ends at the entrance of that portal. Every chain is
+         followed once, the portals after a resolved portal reuse its end."""
+        entrances = self.__portals_index.get_points()
+        index_of = {entrance: index for index, entrance in enumerate(entrances)}
+        following = [index_of.get(self.__magic_portals[entrance]) for entrance in entrances]  # The next portal
+        ends: List[Optional[Tuple[float, float]]] = [None] * len(entrances)
+        lengths = [0] * len(entrances)
+        for start in range(len(entrances)):
+            path = []
+            position = {}
+            current = start
+            while current is not None and ends[current] is None and current not in position:
+                position[current] = len(path)
+                path.append(current)
+                current = following[current]
+            if current is None:  # The chain leaves the portals at the destination of its last portal
+                end, length = self.__magic_portals[entrances[path[-1]]], 0
+            elif ends[current] is not None:  # The chain goes on like a chain that was resolved
+                end, length = ends[current], lengths[current]
+            else:  # A cycle, every portal of it ends at its own entrance after going around it
+                cycle = path[position[current]:]
+                for index in cycle:
+                    ends[index], lengths[index] = entrances[index], len(cycle)
+                path = path[:position[current]]
+                end, length = entrances[current], len(cycle)
+            for index in reversed(path):
+                length += 1
+                ends[index], lengths[index] = end, length
+        self.__portal_ends = ends
+        self.__portal_chain_lengths = lengths
+
+    def get_portals_index(self) -> PointGrid:
+        return self.__portals_index
+
+    def get_portal_table(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The resolved magic portals as arrays, in the order of the portals index, for the batched engines
+        :return: the entrances of the portals and where entering them ends, as arrays of shape (portals, 2), and the
+        number of portals every chain goes through
+        """
+        return (np.array(self.__portals_index.get_points(), dtype=float).reshape(-1, 2),
+                np.array(self.__portal_ends, dtype=float).reshape(-1, 2),
+                np.array(self.__portal_chain_lengths, dtype=np.int64))
+
+    def get_first_move(self) -> bool:
+        return self.__first_move
+
+    def set_first_move(self, first_move: bool) -> None:
+        self.__first_move = first_move
+
+    def get_profiler(self) -> Optional[PhaseProfiler]:
+        return self.__profiler
+
+    def set_profiler(self, profiler: Optional[PhaseProfiler]) -> None:
+        "The method sets the profiler move_walker adds the time of its phases to, None stops profiling"
+        self.__profiler = profiler
 
     def crossed_point(self, walker: Walker, last_location: Tuple[float, float], point: Tuple[float, float]) -> bool:
         """
@@ -87,38 +202,40 @@ class Plain:
         :param last_location: The last location of the walker
         :return: True if the walker has collided with an obstacle, False otherwise
         """
-        for obstacle in self.__obstacles:
-            if self.crossed_point(walker, last_location, obstacle):
+        if not self.__obstacles:
+            return False
+        # Only the obstacles in the cells the step passes through can be on it
+        for index in self.__obstacles_index.query(last_location, walker.get_location()):
+            if self.crossed_point(walker, last_location, self.__obstacles[index]):
                 return True
         return False
 
-    def magic_portal(self, walker: Walker, last_location: Tuple[float, float]) -> None:
+    def magic_portal(self, walker: Walker, last_location: Tuple[float, float]) -> int:
         """
-        Check if the walker has entered a magic portal and if yes moves it to the destination portal
+        Check if the walker has entered a magic portal and if yes moves it to the end of the chain of the portal
         :param walker: a walker object
         :param last_location: the last location of the walker
-        :return: None
+        :return: the number of magic portals the walker went through
         """
-        for portal in self.__magic_portals:
-            if self.crossed_point(walker, last_location, portal):
-                destination = self.__magic_portals[portal]
-                walker.set_location(destination)
+        if not self.__portal_ends:
+            return 0
+        # The first portal on the step is entered, the table already knows where its chain ends
+        portals = self.__portals_index.get_points()
+        for index in self.__portals_index.query(last_location, walker.get_location()):
+            if self.crossed_point(walker, last_location, portals[index]):
+                walker.set_location(self.__portal_ends[index])
+                return self.__portal_chain_lengths[index]
+        return 0
 
     def calculate_det(self, point1: Tuple[float, float], point2: Tuple[float, float],
                       point3: Tuple[float, float]) -> float:
         "Calculate the determinant of the matrix formed by the vectors from point1 to point2 and point3"
 
-        x1, y1 = point1
-        x2, y2 = point2
-        x3, y3 = point3
-        return (x2 - x1) * (y3 - y1) - (x3 - x1) * (y2 - y1)
+        return calculate_det(point1, point2, point3)
 
     def are_collinear(self, p1: Tuple[float, float], p2: Tuple[float, float], p3: Tuple[float, float]) -> bool:
         "The function to check if the points are in the same line"
-
-        poly = Polygon([p1, p2, p3])
-        # Check if the area of the polygon is zero
-        return poly.area == 0
+        return are_collinear(p1, p2, p3)
 
     def hit_walls(self, walker: Walker, last_location: Tuple[float, float]) -> bool:
         """
@@ -129,20 +246,28 @@ class Plain:
         :param last_location: tuple representing the last recorded location of the walker
         :return: True if the walker intersects any wall, False otherwise
         """
+        if not self.__walls:
+            return False
         # Get the current location of the walker
         current_location = walker.get_location()
 
-        # Create a LineString from the last location to the current location
-        walker_path = LineString([last_location, current_location])
-
-        # Check each wall to see if it intersects with the walker's path
-        for (wall_start, wall_end) in self.__walls.items():
-            wall_line = LineString([wall_start, wall_end])
-            if walker_path.intersects(wall_line):
-                if self.are_collinear(wall_start, wall_end, (0, 0)) and self.__first_move:
-                    pass
-                else:
-                    return True
+        # Check each wall near the walker's path to see if it intersects with the path
+        candidates = self.__walls_index.query(last_location, current_location)
+        if len(candidates) >= self.__VECTORIZED_WALLS:
+            x1, y1, x2, y2 = self.__walls_array[candidates].T
+            hits = segments_intersect_many(last_location[0], last_location[1], current_location[0],
+                                           current_location[1], x1, y1, x2, y2)
+            if self.__first_move:
+                # The walls in the same line as the origin don't stop the first move
+                hits &= ~self.__walls_collinear[candidates]
+            return bool(hits.any())
+        walls = self.__walls_index.get_segments()
+        for index in candidates:
+            if self.__first_move and self.__walls_collinear_list[index]:
+                continue  # The walls in the same line as the origin don't stop the first move
+            wall_start, wall_end = walls[index]
+            if segments_intersect(last_location, current_location, wall_start, wall_end):
+                return True
         return False
 
     def move_walker(self, walker: Walker) -> None:
@@ -151,6 +276,9 @@ class Plain:
         :param walker: the walker to move
         :return: None
         """
+        if self.__profiler is not None:
+            self.__profiled_move_walker(walker)
+            return
         last_location = walker.get_location()
         reset = walker.move()
         if reset:
@@ -168,6 +296,40 @@ class Plain:
             if self.__first_move:
                 self.__first_move = False
 
+    def __profiled_move_walker(self, walker: Walker) -> None:
+        "The same as move_walker, with the time of every phase and the events added to the profiler"
+        profiler = self.__profiler
+        profiler.count('steps')
+        last_location = walker.get_location()
+        start = time.perf_counter()
+        reset = walker.reset()  # Walker.move is the reset draw and then the step
+        start = profiler.lap('reset_draw', start)
+        if reset:
+            walker.set_x(0)
+            walker.set_y(0)
+            self.__first_move = True
+            walker.add_to_history((0,0))
+            profiler.lap('history', start)
+            profiler.count('resets')
+            return
+        walker.step()
+        start = profiler.lap('move', start)
+        collided = self.is_obstacle(walker, last_location)
+        start = profiler.lap('is_obstacle', start)
+        if not collided:
+            collided = self.hit_walls(walker, last_location)
+            start = profiler.lap('hit_walls', start)
+        if collided:
+            walker.set_location(last_location)
+            profiler.count('collisions')
+            return
+        profiler.count('teleports', self.magic_portal(walker, last_location))
+        start = profiler.lap('magic_portal', start)
+        walker.add_to_history(walker.get_location())
+        profiler.lap('history', start)
+        if self.__first_move:
+            self.__first_move = False
+
 
 if __name__ == '__main__':
 
@@ -0,0 +1,79 @@
+from typing import List, Tuple, Dict, Optional, Set
+from spatial_index import SegmentGrid, PointGrid
+from geometry import calculate_det, in_box
+
+
+class PlainValidator:
+    """
+    A class to check that the obstacles, magic portals and walls of a plain do not overlap, one item at a time, as
+    they are added. An obstacle or a magic portal can not be on a wall, the points of a magic portal can not be
+    obstacles and the end points of a wall can not be obstacles or points of a magic portal. The points are kept in
+    sets and the walls and the points in spatial grids, so checking an item only looks at the items near it and a
+    plain with many items is checked in about linear time.
+    """
+
+    def __init__(self, obstacles: Optional[List[Tuple[float, float]]] = None,
+                 magic_portals: Optional[Dict[Tuple[float, float], Tuple[float, float]]] = None,
+                 walls: Optional[Dict[Tuple[float, float], Tuple[float, float]]] = None) -> None:
+        self.__obstacles: Set[Tuple[float, float]] = set()
+        self.__portal_points: Set[Tuple[float, float]] = set()  # The entrances and the destinations
+        self.__obstacles_index: PointGrid = PointGrid()
+        self.__portal_points_index: PointGrid = PointGrid()
+        self.__walls_index: SegmentGrid = SegmentGrid(cell_size=1.0)
+        for obstacle in obstacles if obstacles else []:
+            self.add_obstacle(obstacle)
+        for portal, destination in (magic_portals if magic_portals else {}).items():
+            self.add_magic_portal(portal, destination)
+        for start, end in (walls if walls else {}).items():
+            self.add_wall(start, end)
+
+    @staticmethod
+    def on_segment(start: Tuple[float, float], end: Tuple[float, float], point: Tuple[float, float]) -> bool:
+        "The method checks if the point is on the segment from start to end"
+        return calculate_det(start, end, point) == 0 and in_box(start, end, point)
+
+    def on_wall(self, point: Tuple[float, float]) -> bool:
+        "The method checks if the point is on one of the walls"
+        walls = self.__walls_index.get_segments()
+        return any(self.on_segment(*walls[index], point) for index in self.__walls_index.query(point, point))
+
+    @staticmethod
+    def __points_on_segment(index: PointGrid, start: Tuple[float, float], end: Tuple[float, float]) -> bool:
+        "The method checks if one of the points of a grid is on the segment from start to end"
+        points = index.get_points()
+        return any(PlainValidator.on_segment(start, end, points[i]) for i in index.query(start, end))
+
+    def has_obstacle(self, point: Tuple[float, float]) -> bool:
+        return point in self.__obstacles
+
+    def valid_obstacle(self, obstacle: Tuple[float, float]) -> bool:
+        "The method checks that the obstacle is not a point of a magic portal and is not on a wall"
+        return obstacle not in self.__portal_points and not self.on_wall(obstacle)
+
+    def valid_magic_portal(self, portal: Tuple[float, float], destination: Tuple[float, float]) -> bool:
+        "The method checks that the magic portal leads somewhere else and its points are not obstacles or on a wall"
+        if portal == destination:
+            return False
+        return all(point not in self.__obstacles and not self.on_wall(point) for point in (portal, destination))
+
+    def valid_wall(self, start: Tuple[float, float], end: Tuple[float, float]) -> bool:
+        "The method checks that no obstacle and no point of a magic portal is on the wall"
+        return not (self.__points_on_segment(self.__obstacles_index, start, end) or
+                    self.__points_on_segment(self.__portal_points_index, start, end))
+
+    def add_obstacle(self, obstacle: Tuple[float, float]) -> None:
+        "The method adds an obstacle, without checking it"
+        if obstacle not in self.__obstacles:
+            self.__obstacles.add(obstacle)
+            self.__obstacles_index.insert(obstacle)
+
+    def add_magic_portal(self, portal: Tuple[float, float], destination: Tuple[float, float]) -> None:
+        "The method adds a magic portal, without checking it"
+        for point in (portal, destination):
+            if point not in self.__portal_points:
+                self.__portal_points.add(point)
+                self.__portal_points_index.insert(point)
+
+    def add_wall(self, start: Tuple[float, float], end: Tuple[float, float]) -> None:
+        "The method adds a wall, without checking it"
+        self.__walls_index.insert(start, end)
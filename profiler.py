@@ -0,0 +1,76 @@
+import time
+from typing import Tuple, Dict
+
+
+class PhaseProfiler:
+    """
+    A class to represent the time spent in every phase of a step of the walker and the number of times every event
+    happened (steps, collisions, teleports and resets). A plain or a batch engine only fills it when it was given
+    one, so a run without a profiler does not pay for the timing.
+    """
+    PHASES: Tuple[str, ...] = ('reset_draw', 'move', 'is_obstacle', 'hit_walls', 'magic_portal', 'history')
+    EVENTS: Tuple[str, ...] = ('steps', 'collisions', 'teleports', 'resets')
+
+    def __init__(self) -> None:
+        self.__seconds: Dict[str, float] = {phase: 0.0 for phase in self.PHASES}
+        self.__calls: Dict[str, int] = {phase: 0 for phase in self.PHASES}
+        self.__events: Dict[str, int] = {event: 0 for event in self.EVENTS}
+        self.__total_seconds: float = 0.0  # The time of the whole run, the phases are a part of it
+
+    def lap(self, phase: str, start: float) -> float:
+        """
+        Add the time since start to a phase
+        :param phase: one of PHASES
+        :param start: the time the phase started, from time.perf_counter
+        :return: the current time, the start of the next phase
+        """
+        now = time.perf_counter()
+        self.__seconds[phase] += now - start
+        self.__calls[phase] += 1
+        return now
+
+    def count(self, event: str, times: int = 1) -> None:
+        "The method adds the times an event happened"
+        self.__events[event] += times
+
+    def add_total(self, seconds: float) -> None:
+        "The method adds the time of a whole run"
+        self.__total_seconds += seconds
+
+    def merge(self, other: 'PhaseProfiler') -> None:
+        "The method adds the times and the events of other, a profiler of simulations that ran in another process"
+        for phase in self.PHASES:
+            self.__seconds[phase] += other.__seconds[phase]
+            self.__calls[phase] += other.__calls[phase]
+        for event in self.EVENTS:
+            self.__events[event] += other.__events[event]
+
+    def get_seconds(self, phase: str) -> float:
+        return self.__seconds[phase]
+
+    def get_calls(self, phase: str) -> int:
+        return self.__calls[phase]
+
+    def get_events(self, event: str) -> int:
+        return self.__events[event]
+
+    def get_total_seconds(self) -> float:
+        return self.__total_seconds
+
+    def to_dict(self) -> Dict:
+        "The method returns the times, the calls and the events as a JSON friendly dictionary"
+        return {'total_seconds': self.__total_seconds,
+                'phases': {phase: {'seconds': self.__seconds[phase], 'calls': self.__calls[phase]}
+                           for phase in self.PHASES},
+                'events': dict(self.__events)}
+
+    def report(self) -> str:
+        "The method returns the times and the events as a table to print"
+        lines = [f"{'phase':<14}{'calls':>12}{'seconds':>12}{'us/call':>10}"]
+        for phase in self.PHASES:
+            calls = self.__calls[phase]
+            per_call = self.__seconds[phase] / calls * 1e6 if calls else 0.0
+            lines.append(f"{phase:<14}{calls:>12}{self.__seconds[phase]:>12.4f}{per_call:>10.2f}")
+        lines.append(f"{'total':<14}{'':>12}{self.__total_seconds:>12.4f}")
+        lines.append(', '.join(f"{event}: {self.__events[event]}" for event in self.EVENTS))
+        return '\n'.join(lines)
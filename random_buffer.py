@@ -0,0 +1,79 @@
+import numpy as np
+from typing import List, Dict, Optional
+
+
+class RandomBuffer:
+    """
+    A class to represent a stream of rows of uniform random numbers in [0, 1), drawn from a NumPy Generator in
+    blocks of many rows and handed out one row at a time, so a caller that needs a few numbers per step does not pay
+    for a call to the generator every step. The rows handed out one by one and the rows taken as an array are the
+    same stream: for a fixed seed, next_row() n times gives the same numbers as next_rows(n).
+    """
+
+    def __init__(self, width: int, seed: Optional[int] = None, block_rows: int = 1024) -> None:
+        if not isinstance(width, int) or width < 1 or not isinstance(block_rows, int) or block_rows < 1:
+            raise ValueError("width and block_rows must be integers greater than 0")
+        self.__width: int = width
+        self.__block_rows: int = block_rows
+        self.__generator: np.random.Generator = np.random.default_rng(seed)
+        self.__block: List[List[float]] = []  # Python floats, indexing them is faster than indexing an array
+        self.__position: int = 0  # The next row of the block
+        self.__block_state: Optional[Dict] = None  # The state of the generator before the block was drawn
+
+    def seed(self, seed: Optional[int]) -> None:
+        "The method starts the stream again from a seed, None for a seed from the operating system"
+        self.__generator = np.random.default_rng(seed)
+        self.__block = []
+        self.__position = 0
+        self.__block_state = None
+
+    def get_width(self) -> int:
+        return self.__width
+
+    def __refill(self) -> None:
+        "The method draws the next block of rows"
+        self.__block_state = self.__generator.bit_generator.state
+        self.__block = self.__generator.random((self.__block_rows, self.__width)).tolist()
+        self.__position = 0
+
+    def next_row(self) -> List[float]:
+        "The method returns the next row of random numbers as a list of floats"
+        if self.__position == len(self.__block):
+            self.__refill()
+        row = self.__block[self.__position]
+        self.__position += 1
+        return row
+
+    def next_rows(self, count: int) -> np.ndarray:
+        """
+        Take the next count rows at once, for a batched consumer
+        :param count: the number of rows
+        :return: an array of shape (count, width), the rows next_row would have returned
+        """
+        remaining = np.array(self.__block[self.__position:self.__position + count],
+                             dtype=float).reshape(-1, self.__width)
+        self.__position += len(remaining)
+        if len(remaining) == count:
+            return remaining
+        # The block is used up, the rest comes straight from the generator, which continues the same stream
+        self.__block = []
+        self.__position = 0
+        self.__block_state = None
+        return np.concatenate([remaining, self.__generator.random((count - len(remaining), self.__width))])
+
+    def get_state(self) -> Dict:
+        "The method returns the position in the stream as a JSON friendly dictionary, see set_state"
+        if self.__block_state is None:
+            return {'generator': self.__generator.bit_generator.state, 'position': 0, 'rows': 0}
+        return {'generator': self.__block_state, 'position': self.__position, 'rows': len(self.__block)}
+
+    def set_state(self, state: Dict) -> None:
+        "The method moves the stream to a position returned by get_state, the block is drawn again"
+        self.__generator.bit_generator.state = state['generator']
+        self.__block = []
+        self.__position = 0
+        self.__block_state = None
+        if state['rows'] > 0:
+            self.__block_state = self.__generator.bit_generator.state
+            self.__block = self.__generator.random((state['rows'], self.__width)).tolist()
+            self.__position = state['position']
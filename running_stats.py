@@ -0,0 +1,102 @@
+import math
+import numpy as np
+from typing import Tuple, Union
+
+
+class RunningStats:
+    """
+    A class to represent streaming statistics of a metric (Welford's algorithm). The metric can be a single number
+    per simulation or a vector, like the distance after every step. Only the count, the mean and the sum of squared
+    differences from the mean are kept, so the memory does not grow with the number of simulations, and two
+    RunningStats can be merged (Chan's algorithm) for simulations that ran in other processes.
+    """
+    Z_95: float = 1.959963984540054  # The normal quantile of a 95% confidence interval
+
+    def __init__(self, size: Union[int, Tuple[int, ...]] = ()) -> None:
+        self.__count: int = 0
+        self.__mean: np.ndarray = np.zeros(size)
+        self.__m2: np.ndarray = np.zeros(size)
+
+    @classmethod
+    def from_moments(cls, count: int, mean: np.ndarray, m2: np.ndarray) -> 'RunningStats':
+        """
+        Build the statistics of a group of samples from its moments
+        :param count: the number of samples
+        :param mean: the mean of the samples
+        :param m2: the sum of the squared differences of the samples from their mean
+        :return: a RunningStats object
+        """
+        stats = cls(np.shape(mean))
+        stats.__count = count
+        stats.__mean = np.array(mean, dtype=float)
+        stats.__m2 = np.array(m2, dtype=float)
+        return stats
+
+    def add(self, value: Union[float, np.ndarray]) -> None:
+        """
+        Add the value of a single simulation
+        :param value: a number or an array of the shape of the metric
+        :return: None
+        """
+        self.__count += 1
+        delta = value - self.__mean
+        self.__mean = self.__mean + delta / self.__count
+        self.__m2 = self.__m2 + delta * (value - self.__mean)
+
+    def add_many(self, values: np.ndarray) -> None:
+        """
+        Add the values of many simulations at once
+        :param values: an array with a row for every simulation
+        :return: None
+        """
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        mean = values.mean(axis=0)
+        self.merge(RunningStats.from_moments(len(values), mean, ((values - mean) ** 2).sum(axis=0)))
+
+    def merge(self, other: 'RunningStats') -> None:
+        """
+        Add the samples of other RunningStats to these ones
+        :param other: the statistics to merge
+        :return: None
+        """
+        if other.__count == 0:
+            return
+        if self.__count == 0:
+            self.__count, self.__mean, self.__m2 = other.__count, other.__mean.copy(), other.__m2.copy()
+            return
+        count = self.__count + other.__count
+        delta = other.__mean - self.__mean
+        self.__mean = self.__mean + delta * (other.__count / count)
+        self.__m2 = self.__m2 + other.__m2 + delta ** 2 * (self.__count * other.__count / count)
+        self.__count = count
+
+    def get_count(self) -> int:
+        return self.__count
+
+    def get_mean(self) -> np.ndarray:
+        return self.__mean
+
+    def get_m2(self) -> np.ndarray:
+        return self.__m2
+
+    def get_variance(self) -> np.ndarray:
+        "The sample variance, 0 while there are less than two samples"
+        if self.__count < 2:
+            return np.zeros_like(self.__mean)
+        return self.__m2 / (self.__count - 1)
+
+    def get_std(self) -> np.ndarray:
+        return np.sqrt(self.get_variance())
+
+    def get_half_width(self, z: float = Z_95) -> np.ndarray:
+        "The half width of the confidence interval of the mean (95% by default)"
+        if self.__count == 0:
+            return np.zeros_like(self.__mean)
+        return z * self.get_std() / math.sqrt(self.__count)
+
+    def get_confidence_interval(self, z: float = Z_95) -> Tuple[np.ndarray, np.ndarray]:
+        "The confidence interval of the mean (95% by default) as a (low, high) tuple"
+        half_width = self.get_half_width(z)
+        return self.__mean - half_width, self.__mean + half_width
@@ -0,0 +1,117 @@
+import os
+import json
+import zipfile
+import numpy as np
+from typing import List, Tuple, Dict
+from plain import Plain
+from spatial_index import SegmentGrid
+
+SCENE_FORMATS: Tuple[str, ...] = ('.json', '.npz')
+SCENE_VERSION: int = 1
+
+
+def scene_format(path: str) -> str:
+    "The function returns the format of a scene file from its extension, one of SCENE_FORMATS"
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SCENE_FORMATS:
+        raise ValueError(f"A scene file must end with one of {', '.join(SCENE_FORMATS)}")
+    return extension
+
+
+def save_scene(plain: Plain, path: str) -> None:
+    """
+    Save the obstacles, magic portals and walls of a plain to a scene file. A .json scene is the dictionary of
+    Plain.to_dict, easy to read and write by hand. A .npz scene keeps every kind of item as an array, and the grid of
+    the walls too, it is stored uncompressed so load_scene can memory-map it
+    :param plain: the plain to save
+    :param path: the path of the scene file, its extension chooses the format
+    :return: None
+    """
+    if scene_format(path) == '.json':
+        with open(path, 'w') as file:
+            json.dump({'version': SCENE_VERSION, **plain.to_dict()}, file, indent=2)
+        return
+    magic_portals = plain.get_magic_portals()
+    walls_index = plain.get_walls_index()
+    np.savez(path, version=np.array(SCENE_VERSION),
+             obstacles=np.array(plain.get_obstacles(), dtype=float).reshape(-1, 2),
+             portal_entrances=np.array(list(magic_portals.keys()), dtype=float).reshape(-1, 2),
+             portal_destinations=np.array(list(magic_portals.values()), dtype=float).reshape(-1, 2),
+             walls=plain.get_walls_array(), walls_cell_size=np.array(walls_index.get_cell_size()),
+             walls_cells=walls_index.get_cell_table())
+
+
+def load_npz(path: str) -> Dict[str, np.ndarray]:
+    """
+    Open the arrays of a .npz file, the ones stored uncompressed (like the ones of save_scene) are memory-mapped
+    straight from the file, so nothing is read until they are used, the compressed ones are read
+    :param path: the path of the .npz file
+    :return: a dictionary from the name of every array to the array
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as file:
+        for member in archive.infolist():
+            name = member.filename[:-len('.npy')] if member.filename.endswith('.npy') else member.filename
+            if member.compress_type != zipfile.ZIP_STORED:
+                with archive.open(member) as array_file:
+                    arrays[name] = np.lib.format.read_array(array_file)
+                continue
+            # The data of a member starts after its local header, whose name and extra field lengths can differ
+            # from the ones in the central directory
+            file.seek(member.header_offset + 26)
+            name_length, extra_length = np.frombuffer(file.read(4), dtype='<u2')
+            file.seek(member.header_offset + 30 + int(name_length) + int(extra_length))
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+            if dtype.hasobject:
+                raise ValueError(f"The array {name} of {path} holds Python objects")
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(file.name, dtype=dtype, mode='r', offset=file.tell(), shape=shape,
+                                         order='F' if fortran_order else 'C')
+    return arrays
+
+
+def as_points(array: np.ndarray, name: str) -> List[Tuple[float, float]]:
+    "The function turns an array of shape (points, 2) of a scene file into a list of points"
+    array = np.asarray(array, dtype=float)
+    if array.ndim != 2 or array.shape[1] != 2:
+        raise ValueError(f"{name} must be an array of shape (points, 2)")
+    return list(map(tuple, array.tolist()))
+
+
+def load_scene(path: str) -> Plain:
+    """
+    Load a scene file made by save_scene into a plain, the grid of the walls of a .npz scene is used as it is
+    :param path: the path of the scene file, its extension chooses the format
+    :return: a Plain with the obstacles, magic portals and walls of the scene
+    """
+    if scene_format(path) == '.json':
+        with open(path) as file:
+            data = json.load(file)
+        if data.get('version', SCENE_VERSION) > SCENE_VERSION:
+            raise ValueError(f"{path} was saved by a newer version of the scene format")
+        return Plain.from_dict(data)
+    arrays = load_npz(path)
+    missing = {'version', 'obstacles', 'portal_entrances', 'portal_destinations', 'walls'} - set(arrays)
+    if missing:
+        raise ValueError(f"{path} is not a scene file, it has no {', '.join(sorted(missing))}")
+    if int(arrays['version']) > SCENE_VERSION:
+        raise ValueError(f"{path} was saved by a newer version of the scene format")
+    entrances = as_points(arrays['portal_entrances'], 'portal_entrances')
+    destinations = as_points(arrays['portal_destinations'], 'portal_destinations')
+    if len(entrances) != len(destinations):
+        raise ValueError("Every magic portal must have an entrance and a destination")
+    walls_array = np.asarray(arrays['walls'], dtype=float)
+    if walls_array.ndim != 2 or walls_array.shape[1] != 4:
+        raise ValueError("walls must be an array of shape (walls, 4)")
+    walls = list(zip(as_points(walls_array[:, :2], 'walls'), as_points(walls_array[:, 2:], 'walls')))
+    walls_index = None
+    if 'walls_cells' in arrays and len(dict(walls)) == len(walls):
+        walls_index = SegmentGrid.from_cell_table(walls, float(arrays['walls_cell_size']), arrays['walls_cells'])
+    return Plain(obstacles=as_points(arrays['obstacles'], 'obstacles'),
+                 magic_portals=dict(zip(entrances, destinations)), walls=dict(walls), walls_index=walls_index)
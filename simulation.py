@@ -1,9 +1,25 @@
-import random
+import io
+import os
+import sys
+import json
 import math
-import matplotlib.pyplot as plt
+import time
+from typing import Callable, TYPE_CHECKING
+import numpy as np
 from plain import *
 from walker import *
-from matplotlib.animation import FuncAnimation
+from batch_engine import BatchEngine
+from lattice_engine import LatticeEngine
+from running_stats import RunningStats
+from trajectory_store import TrajectoryStore
+from profiler import PhaseProfiler
+from downsampling import DownsampledLine, DEFAULT_MAX_POINTS
+
+if TYPE_CHECKING:  # matplotlib is imported when something is drawn, a run that only computes never imports it
+    from matplotlib.axes import Axes
+    from concurrent.futures import Executor
+
+shard_plain: Optional[Plain] = None  # The plain of the shards of a worker process, see start_shard_worker
 
 
 class Simulation:
@@ -14,22 +30,83 @@ class Simulation:
     number of steps.
     """
     __EXIT_RADIUS: int = 10
+    # The exact engine computes the statistics of movement type 3 without sampling, see LatticeEngine
+    ENGINES: Tuple[str, ...] = ('serial', 'batch', 'exact')
+    # The metrics an adaptive run can stop on, the distances are the ones after the last step and the axis metrics
+    # stop when both axes reached the tolerance
+    METRICS: Tuple[str, ...] = ('distance', 'axis_distance', 'steps_to_exit', 'axis_crossings')
+    RESULT_FORMATS: Tuple[str, ...] = ('json', 'csv', 'npz')
+    PLOTS: Tuple[str, ...] = ('distance_from_start', 'distance_from_axis', 'axis_crossings', 'last_simulation')
 
-    def __init__(self, plain: Plain, walker: Walker, num_steps: int, num_simulations: int) -> None:
+    def __init__(self, plain: Plain, walker: Walker, num_steps: int, num_simulations: int,
+                 engine: str = 'serial', workers: int = 1, seed: Optional[int] = None,
+                 trajectory_path: Optional[str] = None, tolerance: Optional[float] = None,
+                 metric: str = 'distance', batch_size: int = 100, checkpoint_path: Optional[str] = None,
+                 profile: bool = False) -> None:
         if not isinstance(num_steps, int) or not isinstance(num_simulations,
                                                             int) or num_steps < 1 or num_simulations < 1:
             raise ValueError("num_steps and num_simulations must be integers and greater than 0")
+        if engine not in self.ENGINES:
+            raise ValueError(f"engine must be one of {', '.join(self.ENGINES)}")
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError("workers must be an integer greater than 0")
+        if tolerance is not None and (not isinstance(tolerance, (int, float)) or tolerance <= 0):
+            raise ValueError("tolerance must be a number greater than 0")
+        if metric not in self.METRICS:
+            raise ValueError(f"metric must be one of {', '.join(self.METRICS)}")
+        if not isinstance(batch_size, int) or batch_size < 1:
+            raise ValueError("batch_size must be an integer greater than 0")
+        if tolerance is not None and trajectory_path is not None:
+            raise ValueError("trajectory_path needs a fixed number of simulations, it can not be used with a tolerance")
+        if engine == 'exact' and walker.get_movement_type() != 3:
+            raise ValueError("The exact engine only supports movement type 3, the lattice walker")
+        if engine == 'exact' and trajectory_path is not None:
+            raise ValueError("The exact engine has no trajectories, it can not be used with a trajectory_path")
 
         self.__walker: Walker = walker
         self.__num_steps: int = num_steps
         self.__num_simulations: int = num_simulations
         self.__plain: Plain = plain
-        self.__avg_distances_from_start: List[float] = [0.0] * (num_steps + 1)
-        self.__total_steps_to_exit: int = 0
-        self.__exit_count: int = 0
-        self.__avg_distances_from_axis: Dict[str, List[float]] = {'x': [0.0] * (num_steps + 1),
-                                                                  'y': [0.0] * (num_steps + 1)}
+        self.__engine: str = engine
+        self.__workers: int = min(workers, num_simulations) if engine != 'exact' else 1
+        self.__seed: Optional[int] = seed
+        # With a tolerance the simulations run in batches until the confidence interval of the metric is narrow
+        # enough, num_simulations is then the most simulations to run
+        self.__tolerance: Optional[float] = tolerance
+        self.__metric: str = metric
+        self.__batch_size: int = batch_size
+        # Where to save the state of the run after every batch of simulations, see save_checkpoint
+        self.__checkpoint_path: Optional[str] = checkpoint_path
+        # The time of every phase of the steps and the events of the run, only when it is profiled
+        self.__profiler: Optional[PhaseProfiler] = PhaseProfiler() if profile else None
+        # Called with the number of simulations that ran and num_simulations, a run is stopped early with cancel
+        self.__progress_callback: Optional[Callable[[int, int], None]] = None
+        self.__cancelled: bool = False
+        # The random state of a run, kept between its batches, see __start_run
+        self.__rng: Optional[np.random.Generator] = None
+        self.__seed_sequence: Optional[np.random.SeedSequence] = None
+        self.__exact_results: Optional[Dict] = None  # The statistics of the exact engine, computed once
+        # Where to keep the location after every step of every simulation, see TrajectoryStore
+        self.__trajectory_path: Optional[str] = trajectory_path
+        self.__trajectory_store: Optional[TrajectoryStore] = None
+        self.__first_simulation: int = 0  # The index in the trajectory store of the first simulation run here
+        self.__run_positions: Optional[np.ndarray] = None
+        # Streaming statistics of every metric, their size does not depend on the number of simulations
+        self.__distance_stats: RunningStats = RunningStats(num_steps + 1)
+        self.__axis_distance_stats: Dict[str, RunningStats] = {'x': RunningStats(num_steps + 1),
+                                                               'y': RunningStats(num_steps + 1)}
+        self.__exit_stats: RunningStats = RunningStats()  # Only the simulations where the walker exited the radius
+        self.__crossing_stats: Dict[str, RunningStats] = {'x': RunningStats(), 'y': RunningStats()}
+        # The buffers of a single simulation, reused by all the simulations
+        self.__run_distances: np.ndarray = np.zeros(num_steps + 1)
+        self.__run_distances_from_axis: Dict[str, np.ndarray] = {'x': np.zeros(num_steps + 1),
+                                                                 'y': np.zeros(num_steps + 1)}
+        self.__avg_distances_from_start: np.ndarray = np.zeros(num_steps + 1)  # Computed in __finalize_averages
+        self.__avg_distances_from_axis: Dict[str, np.ndarray] = {'x': np.zeros(num_steps + 1),
+                                                                 'y': np.zeros(num_steps + 1)}
         self.__total_axis_crossings: Dict[str, int] = {'x': 0, 'y': 0}
+        # The crossings total without clamping at 0, needed to merge the totals of simulations run in other processes
+        self.__axis_crossings_shift: Dict[str, int] = {'x': 0, 'y': 0}
         self.__avg_steps_to_exit: float = 0.0  # Initialized here for clarity, will be computed in __finalize_averages
         self.__avg_axis_crossings: Dict[str, float] = {'x': 0.0, 'y': 0.0}  # Initialized here for clarity
 
@@ -48,19 +125,23 @@ class Simulation:
         # No axis crossing
         return y_axis, x_axis
 
-    def __run_simulation(self) -> Tuple[List[float], int, Dict[str, List[float]], Dict[str, int]]:
+    def __run_simulation(self) -> Tuple[np.ndarray, int, Dict[str, np.ndarray], Dict[str, int]]:
         """The method that runs a single simulation of the walker on the plain and returns
-         all the statistics of the simulation"""
-        distances = [0.0]
+         all the statistics of the simulation, the arrays are reused by the next simulation"""
+        distances = self.__run_distances
         steps_to_exit = 0
-        distances_from_axis = {'x': [0.0], 'y': [0.0]}
+        distances_from_axis = self.__run_distances_from_axis
         axis_crossings = {'x': 0, 'y': 0}
         self.__walker.set_x(0)
         self.__walker.set_y(0)
         self.__walker.clear_history()
+        self.__plain.set_first_move(True)  # Every simulation starts with a fresh walker at the origin
+        positions = self.__run_positions
         for i in range(1, self.__num_steps + 1):
             last_location = self.__walker.get_location()
             self.__plain.move_walker(self.__walker)
+            if positions is not None:
+                positions[i] = self.__walker.get_location()
             # Check for axis crossings in a single call
             y_axis_crossed, x_axis_crossed = self.__cross_axis(last_location)
             # Increment the counters based on the results
@@ -69,28 +150,28 @@ class Simulation:
             if y_axis_crossed:
                 axis_crossings['y'] += 1
             # Calculate distances from axis
-            distances_from_axis['y'].append(abs(self.__walker.get_x()))
-            distances_from_axis['x'].append(abs(self.__walker.get_y()))
+            distances_from_axis['y'][i] = abs(self.__walker.get_x())
+            distances_from_axis['x'][i] = abs(self.__walker.get_y())
             # Calculate overall distance from the starting point
             distance = math.sqrt(self.__walker.get_x() ** 2 + self.__walker.get_y() ** 2)
-            distances.append(distance)
+            distances[i] = distance
             if distance > self.__EXIT_RADIUS and steps_to_exit == 0:
                 steps_to_exit = i
         return distances, steps_to_exit, distances_from_axis, axis_crossings
 
-    def __update_averages(self, distances: List[float], steps_to_exit: int, distances_from_axis: Dict[str, List[float]],
+    def __update_averages(self, distances: np.ndarray, steps_to_exit: int, distances_from_axis: Dict[str, np.ndarray],
                           axis_crossings: Dict[str, int]) -> None:
         """The function updates the average distances from the starting point, the average number of steps to exit the radius,
          the average distances from the x and y axes, and the average times the walker crossed the x and y axes."""
 
-        for i in range(self.__num_steps + 1):
-            self.__avg_distances_from_start[i] += distances[i]
-            self.__avg_distances_from_axis['x'][i] += distances_from_axis['x'][i]
-            self.__avg_distances_from_axis['y'][i] += distances_from_axis['y'][i]
+        self.__distance_stats.add(distances)
+        self.__axis_distance_stats['x'].add(distances_from_axis['x'])
+        self.__axis_distance_stats['y'].add(distances_from_axis['y'])
 
         if steps_to_exit > 0:
-            self.__total_steps_to_exit += steps_to_exit
-            self.__exit_count += 1
+            self.__exit_stats.add(steps_to_exit)
+        self.__crossing_stats['x'].add(axis_crossings['x'] - 1)
+        self.__crossing_stats['y'].add(axis_crossings['y'] - 1)
 
         self.__total_axis_crossings['x'] += axis_crossings['x'] - 1
         if self.__total_axis_crossings['x'] < 0:
@@ -98,89 +179,693 @@ class Simulation:
         self.__total_axis_crossings['y'] += axis_crossings['y'] - 1
         if self.__total_axis_crossings['y'] < 0:
             self.__total_axis_crossings['y'] = 0
+        self.__axis_crossings_shift['x'] += axis_crossings['x'] - 1
+        self.__axis_crossings_shift['y'] += axis_crossings['y'] - 1
+
+    def __update_batch_averages(self, distances: RunningStats, distances_from_axis: Dict[str, RunningStats],
+                                steps_to_exit: np.ndarray, axis_crossings: Dict[str, np.ndarray]) -> None:
+        """The function adds the statistics of a batch of simulations, the same way __update_averages
+         does for the simulations of the batch one after the other."""
+
+        self.__distance_stats.merge(distances)
+        self.__axis_distance_stats['x'].merge(distances_from_axis['x'])
+        self.__axis_distance_stats['y'].merge(distances_from_axis['y'])
+        self.__exit_stats.add_many(steps_to_exit[steps_to_exit > 0])
+
+        for axis in ['x', 'y']:
+            self.__crossing_stats[axis].add_many(axis_crossings[axis] - 1)
+            for crossings in axis_crossings[axis].tolist():
+                self.__total_axis_crossings[axis] = max(0, self.__total_axis_crossings[axis] + crossings - 1)
+            self.__axis_crossings_shift[axis] += int(axis_crossings[axis].sum()) - len(axis_crossings[axis])
+
+    def __reset_history(self) -> None:
+        "The method clears the walker's history and makes room for the runs it keeps"
+        self.__walker.reset_history()
+        runs = self.__num_simulations if self.__walker.get_history_mode() == 'all' else 1
+        self.__walker.reserve_history((self.__num_steps + 1) * runs)
+
+    def __set_histories(self, histories: List[np.ndarray]) -> None:
+        "The method puts the histories of simulations that ran elsewhere in the walker, for plot_last_sim_location"
+        if self.__walker.get_history_mode() == 'last':
+            histories = histories[-1:]
+        self.__walker.set_location((0, 0))
+        for history in histories:
+            self.__walker.clear_history()
+            self.__walker.extend_history(history[1:])
+        if histories and len(histories[-1]):  # The exact engine has no histories
+            self.__walker.set_location((float(histories[-1][-1][0]), float(histories[-1][-1][1])))
+
+    def __start_run(self) -> None:
+        "The method seeds the random numbers and clears the walker's history before the first simulation of a run"
+        self.__reset_history()
+        if self.__seed is not None:
+            self.__walker.set_seed(self.__seed)
+        self.__rng = np.random.default_rng(self.__seed)
+        self.__seed_sequence = np.random.SeedSequence(self.__seed)
+
+    def __run_batch(self, num_simulations: int) -> None:
+        "The method runs the next num_simulations simulations together with the NumPy batch engine"
+        engine = BatchEngine(self.__plain, self.__walker, self.__num_steps, self.__EXIT_RADIUS, self.__rng,
+                             self.__profiler)
+        distances, distances_from_axis, steps_to_exit, axis_crossings, histories = engine.run(
+            num_simulations, self.__trajectory_store, self.__first_simulation + self.get_num_simulations_run())
+        self.__update_batch_averages(distances, distances_from_axis, steps_to_exit, axis_crossings)
+        self.__set_histories(histories)
+        self.__report_progress()
+
+    def __run_exact(self, num_simulations: int) -> None:
+        """The method adds the exact statistics of the walker as num_simulations simulations: the means and the standard
+         deviations are the exact ones, the confidence intervals are the ones of num_simulations simulations"""
+        if self.__exact_results is None:
+            self.__exact_results = LatticeEngine(self.__plain, self.__walker, self.__num_steps,
+                                                 self.__EXIT_RADIUS).run()
+        results = self.__exact_results
+
+        def exact_stats(count: int, mean: np.ndarray, variance: np.ndarray) -> RunningStats:
+            # The sum of squared differences that gives the exact variance as the sample variance
+            return RunningStats.from_moments(count, mean, variance * max(count - 1, 0))
+
+        self.__distance_stats.merge(exact_stats(num_simulations, results['distance_mean'],
+                                                results['distance_variance']))
+        for axis in ['x', 'y']:
+            self.__axis_distance_stats[axis].merge(exact_stats(num_simulations, results['axis_distance_mean'][axis],
+                                                               results['axis_distance_variance'][axis]))
+        # The walkers that exited are their expected share of the simulations
+        probabilities = results['exit_probabilities']
+        exit_probability = float(probabilities.sum())
+        exited = round(num_simulations * exit_probability)
+        if exited > 0:
+            steps = np.arange(len(probabilities))
+            mean = float(steps @ probabilities) / exit_probability
+            self.__exit_stats.merge(exact_stats(exited, mean, float(steps ** 2 @ probabilities) / exit_probability -
+                                                mean ** 2))
+        for axis in ['x', 'y']:
+            # Only the expected crossings are known, not their spread
+            crossings = results['axis_crossings'][axis] - 1
+            self.__crossing_stats[axis].merge(RunningStats.from_moments(num_simulations, crossings, 0.0))
+            self.__total_axis_crossings[axis] = max(0.0, self.__total_axis_crossings[axis] +
+                                                    num_simulations * crossings)
+            self.__axis_crossings_shift[axis] += num_simulations * crossings
+        self.__report_progress()
+
+    def __run_serial(self, num_simulations: int) -> None:
+        "The method runs the next num_simulations simulations one after the other in this process"
+        if self.__engine == 'batch':
+            self.__run_batch(num_simulations)
+        elif self.__engine == 'exact':
+            self.__run_exact(num_simulations)
+        else:
+            first_simulation = self.__first_simulation + self.get_num_simulations_run()
+            if self.__trajectory_store is not None:
+                self.__run_positions = np.zeros((self.__num_steps + 1, 2))
+            if self.__profiler is not None:
+                self.__plain.set_profiler(self.__profiler)
+            try:
+                for simulation in range(num_simulations):
+                    if self.__cancelled:
+                        break
+                    distances, steps_to_exit, distances_from_axis, axis_crossings = self.__run_simulation()
+                    self.__update_averages(distances, steps_to_exit, distances_from_axis, axis_crossings)
+                    if self.__trajectory_store is not None:
+                        self.__trajectory_store.write(first_simulation + simulation, 0, self.__run_positions[None])
+                    self.__report_progress()
+            finally:
+                if self.__profiler is not None:
+                    self.__plain.set_profiler(None)
+            if self.__trajectory_store is not None:
+                self.__trajectory_store.flush()
+
+    def run_partial(self) -> Dict:
+        """
+        Run the simulations without finalizing the averages. Used by the parallel workers, each one runs its shard of
+        the simulations and sends back the totals so they can be merged.
+        :return: a dictionary with the statistics of the simulations and the histories the walker kept
+        """
+        self.__start_run()
+        self.__run_serial(self.__num_simulations)
+        return {'distance_stats': self.__distance_stats,
+                'axis_distance_stats': self.__axis_distance_stats,
+                'exit_stats': self.__exit_stats,
+                'crossing_stats': self.__crossing_stats,
+                'axis_crossings': self.__total_axis_crossings,
+                'axis_crossings_shift': self.__axis_crossings_shift,
+                'histories': self.__walker.get_all_histories(),
+                'profiler': self.__profiler}
+
+    def __merge_partial_results(self, partial: Dict) -> None:
+        """The method adds the totals of a shard of simulations to the totals, as if the simulations of the shard ran
+         here right after the ones that were already merged."""
+
+        self.__distance_stats.merge(partial['distance_stats'])
+        self.__exit_stats.merge(partial['exit_stats'])
+        for axis in ['x', 'y']:
+            self.__axis_distance_stats[axis].merge(partial['axis_distance_stats'][axis])
+            self.__crossing_stats[axis].merge(partial['crossing_stats'][axis])
+            # Replaying the shard on top of the current total only goes below its own total if it hits 0 on the way
+            self.__total_axis_crossings[axis] = max(partial['axis_crossings'][axis],
+                                                    self.__total_axis_crossings[axis] +
+                                                    partial['axis_crossings_shift'][axis])
+            self.__axis_crossings_shift[axis] += partial['axis_crossings_shift'][axis]
+        if self.__profiler is not None and partial['profiler'] is not None:
+            self.__profiler.merge(partial['profiler'])
+
+    def __shards(self, num_simulations: int) -> List[Dict]:
+        "The method splits the next num_simulations simulations between the workers, every shard gets its own seed"
+        workers = min(self.__workers, num_simulations)
+        seeds = self.__seed_sequence.spawn(workers)
+        size, extra = divmod(num_simulations, workers)
+        shards = []
+        first_simulation = self.__first_simulation + self.get_num_simulations_run()
+        for i in range(workers):
+            num_simulations = size + (1 if i < extra else 0)
+            shards.append({'walker': self.__walker.to_dict(),
+                           'num_steps': self.__num_steps, 'num_simulations': num_simulations,
+                           'engine': self.__engine, 'seed': int(seeds[i].generate_state(1)[0]),
+                           'trajectory_path': self.__trajectory_store.get_path() if self.__trajectory_store else None,
+                           'first_simulation': first_simulation, 'profile': self.__profiler is not None})
+            first_simulation += num_simulations
+        return shards
+
+    def __start_pool(self) -> 'Executor':
+        """The method starts the pool of processes of a run with more than one worker, the plain is sent to every
+         process once, when it starts, instead of with every shard"""
+        from concurrent.futures import ProcessPoolExecutor  # Only a run with workers pays for importing it
+
+        return ProcessPoolExecutor(max_workers=self.__workers, initializer=start_shard_worker,
+                                   initargs=(self.__plain,))
+
+    def __run_parallel(self, num_simulations: int, executor: 'Executor') -> None:
+        "The method runs the shards of the next simulations in the pool of processes and merges their totals in order"
+        histories = []
+        for partial in executor.map(run_simulation_shard, self.__shards(num_simulations)):
+            self.__merge_partial_results(partial)
+            histories.extend(partial['histories'])
+            self.__report_progress()
+        self.__set_histories(histories)
 
     def __finalize_averages(self) -> None:
         """The function finalizes the average distances from the starting point, the average number of steps to exit the radius,
          the average distances from the x and y axes, and the average times the walker crossed the x and y axes."""
 
-        divisor = self.__num_simulations
-        for i in range(self.__num_steps + 1):
-            self.__avg_distances_from_start[i] /= divisor
-            self.__avg_distances_from_axis['x'][i] /= divisor
-            self.__avg_distances_from_axis['y'][i] /= divisor
+        divisor = self.get_num_simulations_run()
+        self.__avg_distances_from_start = self.__distance_stats.get_mean()
+        self.__avg_distances_from_axis = {axis: self.__axis_distance_stats[axis].get_mean() for axis in ['x', 'y']}
 
-        self.__avg_steps_to_exit = (self.__total_steps_to_exit / self.__exit_count) if self.__exit_count > 0 else None
+        self.__avg_steps_to_exit = float(self.__exit_stats.get_mean()) if self.__exit_stats.get_count() > 0 else None
         self.__avg_axis_crossings = {axis: self.__total_axis_crossings[axis] / divisor for axis in ['x', 'y']}
 
+    def set_trajectory_store(self, store: TrajectoryStore, first_simulation: int = 0) -> None:
+        "The method sets the store the simulations write their locations to, starting at the given simulation index"
+        self.__trajectory_store = store
+        self.__first_simulation = first_simulation
+
+    def get_metadata(self) -> Dict:
+        "The method returns the configuration of the simulations as a JSON friendly dictionary"
+        return {'plain': self.__plain.to_dict(), 'walker': self.__walker.to_dict(), 'num_steps': self.__num_steps,
+                'num_simulations': self.__num_simulations, 'engine': self.__engine, 'workers': self.__workers,
+                'seed': self.__seed, 'exit_radius': self.__EXIT_RADIUS, 'tolerance': self.__tolerance,
+                'metric': self.__metric, 'batch_size': self.__batch_size}
+
+    def __add_trajectories(self, positions: np.ndarray) -> None:
+        """The method adds the statistics of simulations from their locations after every step, an array of shape
+         (simulations, num_steps + 1, 2), the same way the batch engine computes them."""
+        x = positions[:, :, 0]
+        y = positions[:, :, 1]
+        distances = np.sqrt(x ** 2 + y ** 2)
+        distance_stats = RunningStats(self.__num_steps + 1)
+        distance_stats.add_many(distances)
+        axis_distance_stats = {'x': RunningStats(self.__num_steps + 1), 'y': RunningStats(self.__num_steps + 1)}
+        axis_distance_stats['x'].add_many(np.abs(y))
+        axis_distance_stats['y'].add_many(np.abs(x))
+        outside = distances > self.__EXIT_RADIUS
+        steps_to_exit = np.where(outside.any(axis=1), outside.argmax(axis=1), 0)
+        # Crossing the y-axis is a change in the x-coordinate sign and crossing the x-axis a change in the y sign
+        axis_crossings = {}
+        for axis, values in [('y', x), ('x', y)]:
+            last, current = values[:, :-1], values[:, 1:]
+            axis_crossings[axis] = (((last <= 0) & (0 < current)) | ((last >= 0) & (0 > current))).sum(axis=1)
+        self.__update_batch_averages(distance_stats, axis_distance_stats, steps_to_exit, axis_crossings)
+
+    @classmethod
+    def from_trajectory_store(cls, path: str, chunk_points: int = 2 ** 22) -> 'Simulation':
+        """
+        Recompute the statistics of a run from its trajectory file, without running anything again
+        :param path: the path of the .npy trajectory file
+        :param chunk_points: how many locations to read from the file at once
+        :return: a Simulation with the statistics of the run, its getters and plots work like after run_simulations
+        """
+        store = TrajectoryStore.open(path)
+        metadata = store.get_metadata()
+        simulation = cls(Plain.from_dict(metadata['plain']), Walker(**metadata['walker']), store.get_num_steps(),
+                         store.get_num_simulations(), engine=metadata.get('engine', 'serial'),
+                         seed=metadata.get('seed'))
+        positions = store.get_positions()
+        chunk = max(1, chunk_points // (store.get_num_steps() + 1))
+        for first in range(0, store.get_num_simulations(), chunk):
+            simulation.__add_trajectories(np.asarray(positions[first:first + chunk]))
+        simulation.__reset_history()
+        simulation.__set_histories([np.asarray(positions[-1])])
+        simulation.__finalize_averages()
+        return simulation
+
+    def __named_stats(self) -> Dict[str, RunningStats]:
+        "The method returns the statistics of every metric by the name they are saved under in a checkpoint"
+        return {'distance': self.__distance_stats, 'exit': self.__exit_stats,
+                'axis_distance_x': self.__axis_distance_stats['x'], 'axis_distance_y': self.__axis_distance_stats['y'],
+                'crossings_x': self.__crossing_stats['x'], 'crossings_y': self.__crossing_stats['y']}
+
+    def save_checkpoint(self, path: str) -> None:
+        """
+        Save the state of a run to a .npz file: the statistics of the simulations that ran, the random state and the
+        walker's history. A run restored with from_checkpoint continues exactly like this run would have.
+        The file is replaced atomically, so a run killed while saving keeps its previous checkpoint.
+        :param path: the path of the checkpoint file
+        :return: None
+        """
+        if self.__rng is None:
+            raise ValueError("There is no run to checkpoint, run_simulations did not start")
+        state = {'metadata': self.get_metadata(), 'trajectory_path': self.__trajectory_path,
+                 'first_simulation': self.__first_simulation,
+                 'axis_crossings': self.__total_axis_crossings, 'axis_crossings_shift': self.__axis_crossings_shift,
+                 'walker_random_state': self.__walker.get_random_state(),
+                 'rng_state': self.__rng.bit_generator.state,
+                 'seed_sequence': {'entropy': self.__seed_sequence.entropy,
+                                   'n_children_spawned': self.__seed_sequence.n_children_spawned}}
+        arrays = {}
+        for name, stats in self.__named_stats().items():
+            arrays[f'{name}_count'] = np.array(stats.get_count())
+            arrays[f'{name}_mean'] = stats.get_mean()
+            arrays[f'{name}_m2'] = stats.get_m2()
+        histories = self.__walker.get_all_histories()
+        arrays['history_lengths'] = np.array([len(history) for history in histories], dtype=np.int64)
+        arrays['histories'] = np.concatenate(histories) if histories else np.zeros((0, 2))
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as file:
+            np.savez(file, state=np.array(json.dumps(state)), **arrays)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def from_checkpoint(cls, path: str, profile: bool = False) -> 'Simulation':
+        """
+        Restore a run from its checkpoint, run_simulations continues it from the last saved batch and keeps saving
+        checkpoints to the same file
+        :param path: the path of the checkpoint file, see save_checkpoint
+        :param profile: True to profile the rest of the run
+        :return: a Simulation with the state of the run
+        """
+        with np.load(path) as checkpoint:
+            state = json.loads(str(checkpoint['state']))
+            arrays = {name: checkpoint[name] for name in checkpoint.files if name != 'state'}
+        metadata = state['metadata']
+        simulation = cls(Plain.from_dict(metadata['plain']), Walker(**metadata['walker']), metadata['num_steps'],
+                         metadata['num_simulations'], engine=metadata['engine'], workers=metadata['workers'],
+                         seed=metadata['seed'], trajectory_path=state['trajectory_path'],
+                         tolerance=metadata['tolerance'], metric=metadata['metric'],
+                         batch_size=metadata['batch_size'], checkpoint_path=path, profile=profile)
+        for name, stats in simulation.__named_stats().items():
+            stats.merge(RunningStats.from_moments(int(arrays[f'{name}_count']), arrays[f'{name}_mean'],
+                                                  arrays[f'{name}_m2']))
+        simulation.__total_axis_crossings = state['axis_crossings']
+        simulation.__axis_crossings_shift = state['axis_crossings_shift']
+        simulation.__walker.set_random_state(state['walker_random_state'])
+        simulation.__rng = np.random.default_rng()
+        simulation.__rng.bit_generator.state = state['rng_state']
+        simulation.__seed_sequence = np.random.SeedSequence(state['seed_sequence']['entropy'],
+                                                            n_children_spawned=state['seed_sequence'][
+                                                                'n_children_spawned'])
+        if state['trajectory_path'] is not None:
+            simulation.set_trajectory_store(TrajectoryStore.open(state['trajectory_path'], mode='r+'),
+                                            state['first_simulation'])
+        simulation.__reset_history()
+        lengths = arrays['history_lengths']
+        simulation.__set_histories(np.split(arrays['histories'], np.cumsum(lengths)[:-1]) if len(lengths) else [])
+        return simulation
+
     def run_simulations(self) -> None:
         """The function runs the specified number of simulations and calculates the average distances from the starting point,
          the average number of steps to exit the radius, the average distances from the x and y axes, and the average times the walker crossed the x and y axis."""
-        for _ in range(self.__num_simulations):
-            distances, steps_to_exit, distances_from_axis, axis_crossings = self.__run_simulation()
-            self.__update_averages(distances, steps_to_exit, distances_from_axis, axis_crossings)
-        self.__finalize_averages()
+        if self.__trajectory_path is not None and self.__trajectory_store is None:
+            self.__trajectory_store = TrajectoryStore.create(self.__trajectory_path, self.__num_simulations,
+                                                             self.__num_steps, self.get_metadata())
+        run_start = time.perf_counter()
+        self.__cancelled = False
+        if self.__rng is None:  # A run restored from a checkpoint already has its random state
+            self.__start_run()
+        # The simulations run in batches only when something happens between them
+        if self.__tolerance is None and self.__checkpoint_path is None and self.__progress_callback is None:
+            batch_size = self.__num_simulations
+        else:
+            batch_size = self.__batch_size
+        # Every batch of a run with more than one worker goes to the same pool of processes
+        executor = self.__start_pool() if self.__workers > 1 else None
+        try:
+            while self.get_num_simulations_run() < self.__num_simulations and not self.__cancelled:
+                if self.__tolerance is not None and self.get_half_width() <= self.__tolerance:
+                    break
+                self.__run_next(min(batch_size, self.__num_simulations - self.get_num_simulations_run()), executor)
+                if self.__checkpoint_path is not None:
+                    self.save_checkpoint(self.__checkpoint_path)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        if self.get_num_simulations_run() > 0:  # A run cancelled before its first simulation has nothing to average
+            self.__finalize_averages()
+        if self.__profiler is not None:
+            self.__profiler.add_total(time.perf_counter() - run_start)
+
+    def set_progress_callback(self, callback: Optional[Callable[[int, int], None]]) -> None:
+        """
+        Set a function run_simulations calls after every simulation (every batch with the batch engine or with more
+        than one worker) with the number of simulations that ran and num_simulations. With a callback the batch
+        engine runs batch_size simulations at a time, so its results depend on batch_size.
+        :param callback: the function to call, it runs in the thread of run_simulations, or None
+        :return: None
+        """
+        self.__progress_callback = callback
+
+    def __report_progress(self) -> None:
+        "The method calls the progress callback, if there is one"
+        if self.__progress_callback is not None:
+            self.__progress_callback(self.get_num_simulations_run(), self.__num_simulations)
+
+    def cancel(self) -> None:
+        """The method asks a run_simulations that is running in another thread to stop after the current simulation
+         (the current batch with the batch engine or with more than one worker). The averages are the ones of the
+         simulations that finished."""
+        self.__cancelled = True
+
+    def is_cancelled(self) -> bool:
+        return self.__cancelled
+
+    def __run_next(self, num_simulations: int, executor: Optional['Executor'] = None) -> None:
+        "The method runs the next num_simulations simulations, in the pool of processes of a run with workers"
+        if executor is not None:
+            self.__run_parallel(num_simulations, executor)
+        else:
+            self.__run_serial(num_simulations)
+
+    def get_profiler(self) -> Optional[PhaseProfiler]:
+        return self.__profiler
+
+    def get_profile(self) -> Optional[Dict]:
+        "The time of every phase of the steps and the events of the run as a dictionary, None if it was not profiled"
+        return self.__profiler.to_dict() if self.__profiler is not None else None
+
+    def get_num_simulations_run(self) -> int:
+        "The number of simulations that ran, less than num_simulations if an adaptive run reached its tolerance"
+        return self.__distance_stats.get_count()
+
+    def get_half_width(self, metric: Optional[str] = None) -> float:
+        """
+        The half width of the 95% confidence interval of a metric over the simulations that ran so far
+        :param metric: one of METRICS, the metric of the simulation by default
+        :return: the half width, infinity while there are not enough simulations to estimate it
+        """
+        metric = metric if metric else self.__metric
+        if metric not in self.METRICS:
+            raise ValueError(f"metric must be one of {', '.join(self.METRICS)}")
+        if metric == 'distance':
+            stats = [self.__distance_stats]
+        elif metric == 'axis_distance':
+            stats = [self.__axis_distance_stats['x'], self.__axis_distance_stats['y']]
+        elif metric == 'steps_to_exit':
+            stats = [self.__exit_stats]
+        else:
+            stats = [self.__crossing_stats['x'], self.__crossing_stats['y']]
+        if any(single_stats.get_count() < 2 for single_stats in stats):
+            return math.inf
+        # The distances have a value after every step, only the one after the last step counts
+        return max(float(np.ravel(single_stats.get_half_width())[-1]) for single_stats in stats)
 
     def get_average_distance_after_steps(self, steps: int) -> float:
-        return self.__avg_distances_from_start[steps]
+        return float(self.__avg_distances_from_start[steps])
 
     def get_average_steps_to_exit_radius(self) -> float:
         return self.__avg_steps_to_exit
 
     def get_average_distance_from_axis_after_steps(self, steps: int, axis: str) -> float:
 
-        return self.__avg_distances_from_axis[axis][steps]
+        return float(self.__avg_distances_from_axis[axis][steps])
 
     def get_average_times_crossed_axis(self, axis: str) -> float:
 
         return self.__avg_axis_crossings[axis]
 
-    def plot_average_distance_from_start(self) -> None:
+    def get_std_distance_after_steps(self, steps: int) -> float:
+        return float(self.__distance_stats.get_std()[steps])
+
+    def get_confidence_interval_distance_after_steps(self, steps: int) -> Tuple[float, float]:
+        "The 95% confidence interval of the average distance from the starting point after the given steps"
+        low, high = self.__distance_stats.get_confidence_interval()
+        return float(low[steps]), float(high[steps])
+
+    def get_std_distance_from_axis_after_steps(self, steps: int, axis: str) -> float:
+        return float(self.__axis_distance_stats[axis].get_std()[steps])
+
+    def get_confidence_interval_distance_from_axis_after_steps(self, steps: int, axis: str) -> Tuple[float, float]:
+        "The 95% confidence interval of the average distance from the axis after the given steps"
+        low, high = self.__axis_distance_stats[axis].get_confidence_interval()
+        return float(low[steps]), float(high[steps])
+
+    def get_std_steps_to_exit_radius(self) -> Optional[float]:
+        "The standard deviation of the steps to exit the radius, None if the walker never exited"
+        if self.__exit_stats.get_count() == 0:
+            return None
+        return float(self.__exit_stats.get_std())
+
+    def get_confidence_interval_steps_to_exit_radius(self) -> Optional[Tuple[float, float]]:
+        "The 95% confidence interval of the average steps to exit the radius, None if the walker never exited"
+        if self.__exit_stats.get_count() == 0:
+            return None
+        low, high = self.__exit_stats.get_confidence_interval()
+        return float(low), float(high)
+
+    def get_std_times_crossed_axis(self, axis: str) -> float:
+        return float(self.__crossing_stats[axis].get_std())
+
+    def get_confidence_interval_times_crossed_axis(self, axis: str) -> Tuple[float, float]:
+        "The 95% confidence interval of the average times the walker crossed the axis"
+        half_width = float(self.__crossing_stats[axis].get_half_width())
+        return self.__avg_axis_crossings[axis] - half_width, self.__avg_axis_crossings[axis] + half_width
+
+    @staticmethod
+    def __summary(stats: RunningStats, mean: Optional[float] = None) -> Dict:
+        """The method returns the count, the mean, the standard deviation and the 95% confidence interval of a metric,
+         arrays for a metric with a value after every step, the mean can be given when the stats keep shifted values"""
+        mean = stats.get_mean() if mean is None else mean
+        half_width = stats.get_half_width()
+        return {'count': stats.get_count(), 'mean': mean, 'std': stats.get_std(), 'ci_low': mean - half_width,
+                'ci_high': mean + half_width}
+
+    def get_results(self) -> Dict:
+        """
+        The statistics of the simulations that ran, for a caller that saves them instead of showing them
+        :return: a dictionary of the configuration of the run, the number of simulations that ran, the summary of
+        every metric (see __named_stats for the names) and the profile of the run (or None)
+        """
+        statistics = {name: self.__summary(stats) for name, stats in self.__named_stats().items()}
+        for axis in ['x', 'y']:
+            # The crossing statistics keep the crossings minus one, the average is kept apart
+            statistics[f'crossings_{axis}'] = self.__summary(self.__crossing_stats[axis],
+                                                             self.__avg_axis_crossings[axis])
+        return {'metadata': self.get_metadata(), 'num_simulations_run': self.get_num_simulations_run(),
+                'statistics': statistics, 'profile': self.get_profile()}
+
+    @classmethod
+    def result_format(cls, path: str, result_format: Optional[str] = None) -> str:
+        """
+        The format save_results writes a file in, so a caller can check it before running the simulations
+        :param path: the path of the file, or '-' for the standard output
+        :param result_format: one of RESULT_FORMATS, by default the extension of the path (JSON for the output)
+        :return: one of RESULT_FORMATS
+        """
+        if result_format is None:
+            result_format = 'json' if path == '-' else os.path.splitext(path)[1][1:].lower()
+        if result_format not in cls.RESULT_FORMATS:
+            raise ValueError(f"The format of the results must be one of {', '.join(cls.RESULT_FORMATS)}")
+        return result_format
+
+    def save_results(self, path: str, result_format: Optional[str] = None) -> None:
+        """
+        Save the statistics of get_results. JSON keeps everything, a .npz file keeps every summary as arrays named
+        <metric>_<summary> and the rest as JSON in its 'results' array, and a CSV file is a table with a row for every
+        metric and step (an empty step for the metrics of a whole simulation): metric, step, count, mean, std, ci_low,
+        ci_high
+        :param path: the path of the file, or '-' to write to the standard output
+        :param result_format: one of RESULT_FORMATS, by default the extension of the path (JSON for the output)
+        :return: None
+        """
+        result_format = self.result_format(path, result_format)
+        results = self.get_results()
+        statistics = results.pop('statistics')
+        if result_format == 'json':
+            results['statistics'] = {name: {key: np.asarray(value).tolist() for key, value in summary.items()}
+                                     for name, summary in statistics.items()}
+            content = json.dumps(results, indent=2)
+        elif result_format == 'csv':
+            lines = ['metric,step,count,mean,std,ci_low,ci_high']
+            for name, summary in statistics.items():
+                columns = [np.atleast_1d(summary[key]) for key in ['mean', 'std', 'ci_low', 'ci_high']]
+                steps = range(len(columns[0])) if np.ndim(summary['mean']) else ['']
+                for step, values in zip(steps, zip(*columns)):
+                    lines.append(','.join([name, str(step), str(summary['count'])] + [repr(float(v)) for v in values]))
+            content = '\n'.join(lines) + '\n'
+        else:
+            arrays = {f'{name}_{key}': np.asarray(value) for name, summary in statistics.items()
+                      for key, value in summary.items()}
+            buffer = io.BytesIO()
+            np.savez(buffer, results=np.array(json.dumps(results)), **arrays)
+            content = buffer.getvalue()
+        if path == '-':
+            if isinstance(content, bytes):
+                sys.stdout.buffer.write(content)
+            else:
+                sys.stdout.write(content)
+            sys.stdout.flush()
+            return
+        with open(path, 'wb' if isinstance(content, bytes) else 'w') as file:
+            file.write(content)
+
+    def save_plots(self, directory: str, plots: Optional[List[str]] = None, max_points: int = DEFAULT_MAX_POINTS,
+                   image_format: str = 'png') -> List[str]:
+        """
+        Save plots to image files without opening any window
+        :param directory: the directory of the files, it is created if needed
+        :param plots: some of PLOTS, all of them by default (the last simulation only if there is one to draw)
+        :param max_points: the most points a curve or a path draws
+        :param image_format: the format of the images, like png, svg or pdf
+        :return: the paths of the files that were saved
+        """
+        drawings = {'distance_from_start': lambda ax: self.draw_average_distance_from_start(ax, max_points),
+                    'distance_from_axis': lambda ax: self.draw_average_distance_from_axis(ax, max_points),
+                    'axis_crossings': self.draw_axis_crossings,
+                    'last_simulation': lambda ax: self.draw_last_sim_location(ax, max_points)}
+        if plots is None:
+            plots = list(self.PLOTS)
+            if self.__walker.get_history_mode() == 'off' or self.__engine == 'exact':
+                plots.remove('last_simulation')
+        for plot in plots:
+            if plot not in self.PLOTS:
+                raise ValueError(f"plots must be some of {', '.join(self.PLOTS)}")
+        from matplotlib.figure import Figure  # Not pyplot, so no backend of a window is chosen
+
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for plot in plots:
+            figure = Figure(figsize=(8, 6))  # Nothing is shown and nothing is kept
+            drawings[plot](figure.add_subplot())
+            figure.tight_layout()
+            path = os.path.join(directory, f'{plot}.{image_format}')
+            figure.savefig(path)
+            paths.append(path)
+        return paths
+
+    def draw_average_distance_from_start(self, ax: 'Axes', max_points: int = DEFAULT_MAX_POINTS) -> None:
+        """The method draws the average distance from the starting point over the number of steps on the given axes,
+         with at most max_points points (more when zooming in), see DownsampledLine"""
+        low, high = self.__distance_stats.get_confidence_interval()
+        DownsampledLine(ax, np.arange(self.__num_steps + 1), self.__avg_distances_from_start, max_points, 'min_max',
+                        band=(low, high), band_kwargs={'alpha': 0.3, 'label': '95% Confidence Interval'})
+        ax.set_xlabel('Number of Steps')
+        ax.set_ylabel('Average Distance from Starting Point')
+        ax.set_title('Average Distance from Starting Point Over Steps')
+        ax.grid(True)
+
+    def plot_average_distance_from_start(self, max_points: int = DEFAULT_MAX_POINTS) -> None:
         """
         Plot the average distance of the walker from the starting point over the number of steps.
         """
-        plt.plot(range(self.__num_steps + 1), self.__avg_distances_from_start)
-        plt.xlabel('Number of Steps')
-        plt.ylabel('Average Distance from Starting Point')
-        plt.title('Average Distance from Starting Point Over Steps')
-        plt.grid(True)
+        import matplotlib.pyplot as plt
+
+        self.draw_average_distance_from_start(plt.gca(), max_points)
         plt.show()
 
-    def plot_average_distance_from_axis(self) -> None:
+    def draw_average_distance_from_axis(self, ax: 'Axes', max_points: int = DEFAULT_MAX_POINTS) -> None:
+        """The method draws the average distance from the x and y axes over the number of steps on the given axes,
+         with at most max_points points for every axis"""
+        for axis in ['x', 'y']:
+            low, high = self.__axis_distance_stats[axis].get_confidence_interval()
+            DownsampledLine(ax, np.arange(self.__num_steps + 1), self.__avg_distances_from_axis[axis], max_points,
+                            'min_max', band=(low, high), band_kwargs={'alpha': 0.3}, label=f'{axis.upper()} Axis')
+        ax.set_xlabel('Number of Steps')
+        ax.set_ylabel('Average Distance from Axis')
+        ax.set_title('Average Distance from Axis Over Steps')
+        ax.legend()
+        ax.grid(True)
+
+    def plot_average_distance_from_axis(self, max_points: int = DEFAULT_MAX_POINTS) -> None:
         """
         Plot the average distance of the walker from the x and y axes over the number of steps.
         """
-        plt.plot(range(self.__num_steps + 1), self.__avg_distances_from_axis['x'], label='X Axis')
-        plt.plot(range(self.__num_steps + 1), self.__avg_distances_from_axis['y'], label='Y Axis')
-        plt.xlabel('Number of Steps')
-        plt.ylabel('Average Distance from Axis')
-        plt.title('Average Distance from Axis Over Steps')
-        plt.legend()
-        plt.grid(True)
+        import matplotlib.pyplot as plt
+
+        self.draw_average_distance_from_axis(plt.gca(), max_points)
         plt.show()
 
+    def draw_axis_crossings(self, ax: 'Axes') -> None:
+        "The method draws the average times the walker crossed the x and y axes on the given axes"
+        ax.bar(['X Axis', 'Y Axis'], [self.__avg_axis_crossings['x'], self.__avg_axis_crossings['y']])
+        ax.set_xlabel('Axis')
+        ax.set_ylabel('Average Crossings')
+        ax.set_title('Average Crossings of Axis')
+        ax.grid(True)
+
     def plot_axis_crossings(self) -> None:
         """
         Plot the average times the walker crossed the x and y axes.
         """
-        plt.bar(['X Axis', 'Y Axis'], [self.__avg_axis_crossings['x'], self.__avg_axis_crossings['y']])
-        plt.xlabel('Axis')
-        plt.ylabel('Average Crossings')
-        plt.title('Average Crossings of Axis')
-        plt.grid(True)
+        import matplotlib.pyplot as plt
+
+        self.draw_axis_crossings(plt.gca())
         plt.show()
 
-    def plot_last_sim_location(self):
+    def __check_history(self) -> None:
+        "The method raises a ValueError if the walker did not keep the history the last simulation plot needs"
+        if self.__walker.get_history_mode() == 'off':
+            raise ValueError("The walker did not keep its history, set its history mode to 'last' or 'all'")
+        if self.__engine == 'exact':
+            raise ValueError("The exact engine does not move walkers, there is no last simulation to draw")
+
+    def draw_last_sim_location(self, ax: 'Axes', max_points: int = DEFAULT_MAX_POINTS) -> None:
+        """The method draws the locations of the last simulation of the walker on the given axes, with at most
+         max_points points (more when zooming in)"""
+        self.__check_history()
+        history = self.__walker.get_history_array()
+        DownsampledLine(ax, history[:, 0], history[:, 1], max_points, path=True, marker='o', linestyle='-')
+        ax.set_title("Random Walker Movement")
+        ax.set_xlabel("X-coordinate")
+        ax.set_ylabel("Y-coordinate")
+        ax.grid(True)
+
+    def plot_last_sim_location(self, max_points: int = DEFAULT_MAX_POINTS):
         "The method that plots the last simulation of the walker."
+        import matplotlib.pyplot as plt
 
-        x_coords = [pos[0] for pos in self.__walker.get_history()]
-        y_coords = [pos[1] for pos in self.__walker.get_history()]
-        plt.plot(x_coords, y_coords, marker='o', linestyle='-')
-        plt.title("Random Walker Movement")
-        plt.xlabel("X-coordinate")
-        plt.ylabel("Y-coordinate")
-        plt.grid(True)
+        self.__check_history()
+        self.draw_last_sim_location(plt.gca(), max_points)
         plt.show()
 
+def start_shard_worker(plain: Plain) -> None:
+    "The function keeps the plain of a run in a worker process when its pool starts, for all the shards it runs"
+    global shard_plain
+    shard_plain = plain
+
+
+def run_simulation_shard(shard: Dict) -> Dict:
+    """
+    Run a shard of the simulations in a worker process with its own walker, on the plain of start_shard_worker
+    :param shard: the configuration of the walker, the number of steps and simulations, the engine and the seed of the
+    shard
+    :return: the totals of the shard, see Simulation.run_partial
+    """
+    walker = Walker(**shard['walker'])
+    simulation = Simulation(shard_plain, walker, shard['num_steps'], shard['num_simulations'], engine=shard['engine'],
+                            seed=shard['seed'], profile=shard['profile'])
+    if shard['trajectory_path'] is not None:
+        simulation.set_trajectory_store(TrajectoryStore.open(shard['trajectory_path'], mode='r+'),
+                                        shard['first_simulation'])
+    return simulation.run_partial()
+
 
 if __name__ == '__main__':
     walker1 = Walker(2)
@@ -0,0 +1,322 @@
+import math
+import numpy as np
+from typing import List, Tuple, Dict, Optional, Set
+
+
+CELL_KEY_OFFSET: int = 2 ** 31  # Added to the rows, so the keys of the cells sort by column and then by row
+MAX_SEGMENT_CELLS: int = 256  # A segment crossing more cells than this is checked linearly instead of by its cells
+
+
+def cell_keys(columns: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    "The function packs the columns and the rows of cells into single sortable integers"
+    return np.asarray(columns).astype(np.int64) * (2 * CELL_KEY_OFFSET) + (
+            np.asarray(rows).astype(np.int64) + CELL_KEY_OFFSET)
+
+
+def cells_of_keys(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    "The function unpacks the keys of cell_keys into the columns and the rows of the cells"
+    return keys // (2 * CELL_KEY_OFFSET), keys % (2 * CELL_KEY_OFFSET) - CELL_KEY_OFFSET
+
+
+def gather_candidates(sorted_keys: np.ndarray, sorted_indices: np.ndarray, cell_size: float, x1: np.ndarray,
+                      y1: np.ndarray, x2: np.ndarray, y2: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the items of a grid in the cells of the bounding box of every query segment at once, the vectorized query of
+    the grids
+    :param sorted_keys: the keys (see cell_keys) of the cells of the items of the grid, sorted
+    :param sorted_indices: the index of the item of every key
+    :param cell_size: the size of the cells of the grid
+    :param x1, y1: arrays of the start points of the query segments
+    :param x2, y2: arrays of the end points of the query segments
+    :return: two arrays of the same length, the index of a query segment and the index of a candidate item for it, an
+    item in more than one cell of a bounding box is there more than once
+    """
+    low_column = np.floor(np.minimum(x1, x2) / cell_size)
+    high_column = np.floor(np.maximum(x1, x2) / cell_size)
+    low_row = np.floor(np.minimum(y1, y2) / cell_size)
+    high_row = np.floor(np.maximum(y1, y2) / cell_size)
+    queries = [np.zeros(0, dtype=np.int64)]
+    candidates = [np.zeros(0, dtype=np.int64)]
+    if len(x1) == 0 or len(sorted_keys) == 0:
+        return queries[0], candidates[0]
+    for column_offset in range(int((high_column - low_column).max()) + 1):
+        for row_offset in range(int((high_row - low_row).max()) + 1):
+            inside = (low_column + column_offset <= high_column) & (low_row + row_offset <= high_row)
+            keys = cell_keys(low_column + column_offset, low_row + row_offset)
+            first = np.searchsorted(sorted_keys, keys, side='left')
+            last = np.searchsorted(sorted_keys, keys, side='right')
+            count = np.where(inside, last - first, 0)
+            for slot in range(int(count.max())):
+                has_slot = np.nonzero(count > slot)[0]
+                queries.append(has_slot)
+                candidates.append(sorted_indices[first[has_slot] + slot])
+    return np.concatenate(queries), np.concatenate(candidates)
+
+
+def cell_span(start: Tuple[float, float], end: Tuple[float, float], cell_size: float) -> int:
+    "The function returns the number of columns plus the number of rows of the cells of a segment, a bound on its cells"
+    return (abs(math.floor(end[0] / cell_size) - math.floor(start[0] / cell_size)) +
+            abs(math.floor(end[1] / cell_size) - math.floor(start[1] / cell_size)) + 2)
+
+
+def in_bounding_box(start: Tuple[float, float], end: Tuple[float, float], point1: Tuple[float, float],
+                    point2: Tuple[float, float]) -> bool:
+    "The function checks if the bounding boxes of the segments start-end and point1-point2 meet"
+    return (min(start[0], end[0]) <= max(point1[0], point2[0]) and min(point1[0], point2[0]) <= max(start[0], end[0])
+            and min(start[1], end[1]) <= max(point1[1], point2[1])
+            and min(point1[1], point2[1]) <= max(start[1], end[1]))
+
+
+def segment_cells(start: Tuple[float, float], end: Tuple[float, float], cell_size: float) -> List[Tuple[int, int]]:
+    """
+    Find the cells of a uniform grid that a segment passes through, column by column
+    :param start: the start point of the segment
+    :param end: the end point of the segment
+    :param cell_size: the size of the cells of the grid
+    :return: a list of (column, row) cells
+    """
+    (x1, y1), (x2, y2) = sorted([start, end])
+    padding = cell_size * 1e-9  # Keeps cells on the border of a column when the y value is rounded
+    cells = []
+    for column in range(math.floor(x1 / cell_size), math.floor(x2 / cell_size) + 1):
+        if x1 == x2:
+            low_y, high_y = min(y1, y2), max(y1, y2)
+        else:
+            # The part of the segment inside this column
+            left = max(x1, column * cell_size)
+            right = min(x2, (column + 1) * cell_size)
+            slope = (y2 - y1) / (x2 - x1)
+            left_y = y1 + slope * (left - x1)
+            right_y = y1 + slope * (right - x1)
+            low_y, high_y = min(left_y, right_y), max(left_y, right_y)
+        for row in range(math.floor((low_y - padding) / cell_size), math.floor((high_y + padding) / cell_size) + 1):
+            cells.append((column, row))
+    return cells
+
+
+class SegmentGrid:
+    """
+    A uniform grid over segments (the walls of a plain). Every segment is registered in the cells it passes
+    through, so the segments near a short walker step can be found without scanning all of them. A segment crossing
+    more than MAX_SEGMENT_CELLS cells is kept in a list of long segments instead, checked by every query.
+    """
+    def __init__(self, segments: Optional[List[Tuple[Tuple[float, float], Tuple[float, float]]]] = None,
+                 cell_size: Optional[float] = None) -> None:
+        segments = segments if segments else []
+        self.__cell_size: float = cell_size if cell_size else self.default_cell_size(segments)
+        self.__segments: List[Tuple[Tuple[float, float], Tuple[float, float]]] = []
+        self.__cells: Dict[Tuple[int, int], List[int]] = {}
+        self.__long_segments: List[int] = []
+        self.__sorted_keys: Optional[np.ndarray] = None  # Built lazily for query_many
+        self.__sorted_indices: Optional[np.ndarray] = None
+        for start, end in segments:
+            self.insert(start, end)
+
+    @staticmethod
+    def default_cell_size(segments: List[Tuple[Tuple[float, float], Tuple[float, float]]]) -> float:
+        """
+        Choose the size of the cells as the median extent of the segments, and at least the size of a walker step,
+        so a typical segment covers only a few cells and a step only a few segments
+        :param segments: a list of (start, end) segments
+        :return: the size of a cell
+        """
+        if not segments:
+            return 1.0
+        extents = sorted(max(abs(end[0] - start[0]), abs(end[1] - start[1])) for start, end in segments)
+        return max(1.0, extents[len(extents) // 2])
+
+    def get_cell_size(self) -> float:
+        return self.__cell_size
+
+    def get_segments(self) -> List[Tuple[Tuple[float, float], Tuple[float, float]]]:
+        return self.__segments
+
+    def get_long_segments(self) -> List[int]:
+        return self.__long_segments
+
+    def __cell(self, value: float) -> int:
+        return math.floor(value / self.__cell_size)
+
+    def insert(self, start: Tuple[float, float], end: Tuple[float, float]) -> None:
+        """
+        Add a segment to the grid
+        :param start: the start point of the segment
+        :param end: the end point of the segment
+        :return: None
+        """
+        index = len(self.__segments)
+        self.__segments.append((start, end))
+        if cell_span(start, end, self.__cell_size) > MAX_SEGMENT_CELLS:
+            self.__long_segments.append(index)
+            return
+        for cell in segment_cells(start, end, self.__cell_size):
+            self.__cells.setdefault(cell, []).append(index)
+        self.__sorted_keys = None
+
+    def query(self, point1: Tuple[float, float], point2: Tuple[float, float]) -> List[int]:
+        """
+        Find the segments that may intersect the segment from point1 to point2
+        :param point1: the start point of the segment to check
+        :param point2: the end point of the segment to check
+        :return: the indices of the candidate segments, in insertion order
+        """
+        if not self.__segments:
+            return []
+        candidates: Set[int] = set()
+        for column in range(self.__cell(min(point1[0], point2[0])), self.__cell(max(point1[0], point2[0])) + 1):
+            for row in range(self.__cell(min(point1[1], point2[1])), self.__cell(max(point1[1], point2[1])) + 1):
+                candidates.update(self.__cells.get((column, row), ()))
+        candidates.update(index for index in self.__long_segments
+                          if in_bounding_box(*self.__segments[index], point1, point2))
+        return sorted(candidates)
+
+    def get_cell_table(self) -> np.ndarray:
+        """
+        The (cell, segment) pairs of the grid as an array of shape (pairs, 3): column, row, index, sorted by cell. The
+        long segments are in no cell, so they are the segments missing from the table
+        """
+        if self.__sorted_keys is None:
+            self.__build_sorted_keys()
+        columns, rows = cells_of_keys(self.__sorted_keys)
+        return np.column_stack([columns, rows, self.__sorted_indices])
+
+    @classmethod
+    def from_cell_table(cls, segments: List[Tuple[Tuple[float, float], Tuple[float, float]]], cell_size: float,
+                        table: np.ndarray) -> 'SegmentGrid':
+        """
+        Build a grid from a table made by get_cell_table, without finding the cells of every segment again
+        :param segments: the segments of the grid, in the order of their indices in the table
+        :param cell_size: the size of the cells of the grid the table was made by
+        :param table: an array of shape (pairs, 3): column, row, index, sorted by cell
+        :return: a SegmentGrid
+        """
+        table = np.asarray(table, dtype=np.int64).reshape(-1, 3)
+        if len(table) and (table[:, 2].min() < 0 or table[:, 2].max() >= len(segments)):
+            raise ValueError("the cell table refers to segments that are not in the grid")
+        grid = cls(cell_size=cell_size)
+        grid.__segments = list(segments)
+        keys = cell_keys(table[:, 0], table[:, 1])
+        if np.any(keys[1:] < keys[:-1]):
+            raise ValueError("the cell table must be sorted by cell")
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+        indices = table[:, 2].tolist()
+        bounds = starts.tolist() + [len(indices)]
+        cells = zip(table[starts, 0].tolist(), table[starts, 1].tolist())
+        grid.__cells = {cell: indices[bounds[i]:bounds[i + 1]] for i, cell in enumerate(cells)}
+        grid.__long_segments = np.setdiff1d(np.arange(len(segments)), table[:, 2]).tolist()
+        grid.__sorted_keys = keys
+        grid.__sorted_indices = table[:, 2].copy()
+        return grid
+
+    def __build_sorted_keys(self) -> None:
+        "The method sorts the (cell, segment) pairs of the grid by their cell for the vectorized query"
+        cells = np.array(list(self.__cells), dtype=np.int64).reshape(-1, 2)
+        counts = np.array([len(indices) for indices in self.__cells.values()], dtype=np.int64)
+        keys = cell_keys(cells[:, 0], cells[:, 1]).repeat(counts)
+        indices = np.array([index for indices in self.__cells.values() for index in indices], dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        self.__sorted_keys = keys[order]
+        self.__sorted_indices = indices[order]
+
+    def query_many(self, x1: np.ndarray, y1: np.ndarray, x2: np.ndarray,
+                   y2: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The vectorized query for many segments at once, like query for every one of them
+        :param x1, y1: arrays of the start points of the segments to check
+        :param x2, y2: arrays of the end points of the segments to check
+        :return: two arrays of the same length, the index of a segment to check and the index of a candidate segment
+        of the grid for it, every pair once
+        """
+        if len(self.__segments) == 0 or len(x1) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        if self.__sorted_keys is None:
+            self.__build_sorted_keys()
+        queries, candidates = gather_candidates(self.__sorted_keys, self.__sorted_indices, self.__cell_size,
+                                                x1, y1, x2, y2)
+        queries, candidates = [queries], [candidates]
+        for index in self.__long_segments:
+            (start_x, start_y), (end_x, end_y) = self.__segments[index]
+            meets = np.nonzero((min(start_x, end_x) <= np.maximum(x1, x2)) & (np.minimum(x1, x2) <= max(start_x, end_x))
+                               & (min(start_y, end_y) <= np.maximum(y1, y2))
+                               & (np.minimum(y1, y2) <= max(start_y, end_y)))[0]
+            queries.append(meets)
+            candidates.append(np.full(len(meets), index, dtype=np.int64))
+        queries, candidates = np.concatenate(queries), np.concatenate(candidates)
+        # A segment of the grid can be in more than one cell of the bounding box of a query
+        pairs = np.unique(queries * len(self.__segments) + candidates)
+        return pairs // len(self.__segments), pairs % len(self.__segments)
+
+
+class PointGrid:
+    """
+    A spatial hash over points (the obstacles or the magic portals of a plain). The points are bucketed by the cell
+    they fall in, so only the points in the cells a walker step passes through need to be checked.
+    """
+    def __init__(self, points: Optional[List[Tuple[float, float]]] = None, cell_size: float = 1.0) -> None:
+        self.__cell_size: float = cell_size
+        self.__points: List[Tuple[float, float]] = []
+        self.__cells: Dict[Tuple[int, int], List[int]] = {}
+        self.__sorted_keys: Optional[np.ndarray] = None  # Built lazily for query_many
+        self.__sorted_indices: Optional[np.ndarray] = None
+        for point in points if points else []:
+            self.insert(point)
+
+    def get_cell_size(self) -> float:
+        return self.__cell_size
+
+    def get_points(self) -> List[Tuple[float, float]]:
+        return self.__points
+
+    def __len__(self) -> int:
+        return len(self.__points)
+
+    def insert(self, point: Tuple[float, float]) -> None:
+        """
+        Add a point to the grid
+        :param point: the point to add
+        :return: None
+        """
+        index = len(self.__points)
+        self.__points.append(point)
+        cell = (math.floor(point[0] / self.__cell_size), math.floor(point[1] / self.__cell_size))
+        self.__cells.setdefault(cell, []).append(index)
+        self.__sorted_keys = None
+
+    def query(self, point1: Tuple[float, float], point2: Tuple[float, float]) -> List[int]:
+        """
+        Find the points that may lie on the segment from point1 to point2
+        :param point1: the start point of the segment
+        :param point2: the end point of the segment
+        :return: the indices of the candidate points, in insertion order
+        """
+        if not self.__points:
+            return []
+        if cell_span(point1, point2, self.__cell_size) > MAX_SEGMENT_CELLS:
+            # Checking every point is cheaper than walking the cells of a long segment
+            return [index for index, point in enumerate(self.__points) if in_bounding_box(point, point, point1, point2)]
+        candidates: Set[int] = set()
+        for cell in segment_cells(point1, point2, self.__cell_size):
+            candidates.update(self.__cells.get(cell, ()))
+        return sorted(candidates)
+
+    def __build_sorted_keys(self) -> None:
+        "The method sorts the points by their cell for the vectorized query"
+        points = np.array(self.__points, dtype=float).reshape(-1, 2)
+        keys = cell_keys(np.floor(points[:, 0] / self.__cell_size), np.floor(points[:, 1] / self.__cell_size))
+        self.__sorted_indices = np.argsort(keys, kind='stable')
+        self.__sorted_keys = keys[self.__sorted_indices]
+
+    def query_many(self, x1: np.ndarray, y1: np.ndarray, x2: np.ndarray,
+                   y2: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The vectorized query for many segments at once, every segment is checked against the points in the cells of
+        its bounding box
+        :param x1, y1: arrays of the start points of the segments
+        :param x2, y2: arrays of the end points of the segments
+        :return: two arrays of the same length, the index of a segment and the index of a candidate point for it
+        """
+        if len(self.__points) == 0 or len(x1) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        if self.__sorted_keys is None:
+            self.__build_sorted_keys()
+        return gather_candidates(self.__sorted_keys, self.__sorted_indices, self.__cell_size, x1, y1, x2, y2)
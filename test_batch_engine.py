@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from plain import Plain
+from walker import Walker
+from simulation import Simulation
+
+NUM_STEPS: int = 40
+NUM_SIMULATIONS: int = 1500
+MAX_Z: float = 4.5  # The most standard errors apart the two engines may be at any step
+
+
+def make_plain() -> Plain:
+    "A plain with every kind of item near the origin, on lattice points so the walkers of movement type 3 meet them"
+    return Plain(obstacles=[(1, 1), (-2, 0), (0, 3)], magic_portals={(2, 0): (-4, 4), (0, -2): (5, -1)},
+                 walls={(-3, -1): (3, -1), (3, -3): (3, 3), (-1, 2): (-1, 6)})
+
+
+def distances(engine: str, movement_type: int, seed: int) -> np.ndarray:
+    """
+    Run the simulations with an engine and return the mean and the standard error of the distance after every step
+    :param engine: serial or batch
+    :param movement_type: the movement type of the walker
+    :param seed: the seed of the run
+    :return: an array of shape (2, NUM_STEPS + 1): the means and the standard errors
+    """
+    walker = Walker(movement_type, weights_list=[0.1, 0.2, 0.3, 0.1, 0.3] if movement_type == 4 else None,
+                    reset=0.05, history='off')
+    simulation = Simulation(make_plain(), walker, NUM_STEPS, NUM_SIMULATIONS, engine=engine, seed=seed)
+    simulation.run_simulations()
+    steps = range(NUM_STEPS + 1)
+    means = [simulation.get_average_distance_after_steps(step) for step in steps]
+    errors = [simulation.get_std_distance_after_steps(step) / np.sqrt(NUM_SIMULATIONS) for step in steps]
+    return np.array([means, errors])
+
+
+@pytest.mark.parametrize('movement_type', [1, 2, 3, 4])
+def test_batch_engine_matches_serial(movement_type: int) -> None:
+    serial_means, serial_errors = distances('serial', movement_type, 1)
+    batch_means, batch_errors = distances('batch', movement_type, 2)
+    # The distance after the first steps can have no spread at all, like the one after no step
+    error = np.hypot(serial_errors, batch_errors)
+    spread = error > 0
+    assert np.array_equal(serial_means[~spread], batch_means[~spread])
+    z = np.abs(serial_means[spread] - batch_means[spread]) / error[spread]
+    assert z.max() < MAX_Z, z.max()
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from plain import Plain
+from walker import Walker
+from simulation import Simulation
+
+STOP_AFTER: int = 300  # The simulations the interrupted run finishes before it is cancelled
+
+
+def make_simulation(engine: str, workers: int, checkpoint_path: str) -> Simulation:
+    "A seeded run of a lattice walker with every kind of item, saved to checkpoint_path after every batch"
+    plain = Plain(obstacles=[(2, 0)], magic_portals={(0, 3): (5, 5)}, walls={(1, 1): (1, -1)})
+    walker = Walker(movement_type=3, reset=0.05, history='all')
+    return Simulation(plain, walker, 40, 1000, engine=engine, workers=workers, seed=7, batch_size=150,
+                      checkpoint_path=checkpoint_path)
+
+
+def assert_same_results(expected: Simulation, actual: Simulation) -> None:
+    "Check that two runs have the same statistics, bit for bit"
+    expected_results, actual_results = expected.get_results(), actual.get_results()
+    assert actual_results['num_simulations_run'] == expected_results['num_simulations_run']
+    for name, summary in expected_results['statistics'].items():
+        for key, value in summary.items():
+            assert np.array_equal(actual_results['statistics'][name][key], value, equal_nan=True), (name, key)
+
+
+@pytest.mark.parametrize('engine', ['serial', 'batch'])
+@pytest.mark.parametrize('workers', [1, 2])
+def test_resumed_run_matches_uninterrupted_run(tmp_path, engine: str, workers: int) -> None:
+    uninterrupted = make_simulation(engine, workers, str(tmp_path / 'uninterrupted.npz'))
+    uninterrupted.run_simulations()
+
+    checkpoint_path = str(tmp_path / 'interrupted.npz')
+    interrupted = make_simulation(engine, workers, checkpoint_path)
+
+    def stop(completed: int, num_simulations: int) -> None:
+        if completed >= STOP_AFTER:
+            interrupted.cancel()
+
+    interrupted.set_progress_callback(stop)
+    interrupted.run_simulations()
+    assert interrupted.get_num_simulations_run() < 1000
+
+    resumed = Simulation.from_checkpoint(checkpoint_path)
+    assert resumed.get_num_simulations_run() == interrupted.get_num_simulations_run()
+    resumed.run_simulations()
+    assert_same_results(uninterrupted, resumed)
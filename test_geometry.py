@@ -0,0 +1,43 @@
+import random
+import numpy as np
+from typing import List, Tuple
+from shapely.geometry import LineString, Polygon
+from geometry import segments_intersect, segments_intersect_many, are_collinear
+
+CHECKS: int = 20000
+
+
+def random_segment_pairs(seed: int = 0) -> List[Tuple[Tuple[float, float], ...]]:
+    """
+    Random pairs of segments, many of them degenerate, touching or collinear because half of them have small integer
+    coordinates
+    :param seed: the seed of the random generator, fixed so every run checks the same pairs
+    :return: a list of (p1, p2, q1, q2) tuples, the segments p1-p2 and q1-q2
+    """
+    generator = random.Random(seed)
+    pairs = []
+    for _ in range(CHECKS):
+        if generator.random() < 0.5:
+            pairs.append(tuple((generator.randint(-3, 3), generator.randint(-3, 3)) for _ in range(4)))
+        else:
+            pairs.append(tuple((generator.uniform(-3, 3), generator.uniform(-3, 3)) for _ in range(4)))
+    return pairs
+
+
+def test_segments_intersect_matches_shapely() -> None:
+    for p1, p2, q1, q2 in random_segment_pairs():
+        expected = LineString([p1, p2]).intersects(LineString([q1, q2]))
+        assert segments_intersect(p1, p2, q1, q2) == expected, (p1, p2, q1, q2)
+
+
+def test_segments_intersect_many_matches_shapely() -> None:
+    for p1, p2, q1, q2 in random_segment_pairs(1):
+        expected = LineString([p1, p2]).intersects(LineString([q1, q2]))
+        vectorized = segments_intersect_many(*p1, *p2, np.array([q1[0]]), np.array([q1[1]]), np.array([q2[0]]),
+                                             np.array([q2[1]]))
+        assert bool(vectorized[0]) == expected, (p1, p2, q1, q2)
+
+
+def test_are_collinear_matches_shapely() -> None:
+    for p1, p2, _, _ in random_segment_pairs(2):
+        assert are_collinear(p1, p2, (0, 0)) == (Polygon([p1, p2, (0, 0)]).area == 0), (p1, p2)
@@ -0,0 +1,61 @@
+import random
+import pytest
+from typing import Dict, Tuple
+from plain import Plain
+from walker import Walker
+
+Point = Tuple[float, float]
+
+
+def follow_chain(magic_portals: Dict[Point, Point], entrance: Point) -> Tuple[Point, int]:
+    """
+    Resolve a portal one teleport at a time: a walker sent to the entrance of another portal goes through it too, and
+    stops at the entrance of the first portal it would go through again
+    :param magic_portals: a dictionary from the entrance of every portal to its destination
+    :param entrance: the entrance of the portal the walker enters
+    :return: where the walker ends and the number of portals it went through
+    """
+    location, seen, teleports = entrance, set(), 0
+    while location in magic_portals and location not in seen:
+        seen.add(location)
+        location = magic_portals[location]
+        teleports += 1
+    return location, teleports
+
+
+def enter(plain: Plain, entrance: Point) -> Tuple[Point, int]:
+    "Step a walker over the entrance of a portal with Plain.magic_portal, return where it ends and the teleports"
+    walker = Walker(history='off')
+    walker.set_location((entrance[0] + 0.5, entrance[1] + 0.25))
+    teleports = plain.magic_portal(walker, (entrance[0] - 0.5, entrance[1] - 0.25))
+    return walker.get_location(), teleports
+
+
+CHAIN = {(0, 0): (10, 0), (10, 0): (20, 0), (20, 0): (30, 5)}
+CYCLE = {(0, 0): (10, 0), (10, 0): (0, 0)}
+SELF_LOOP = {(0, 0): (0, 0), (10, 0): (0, 0)}
+
+
+@pytest.mark.parametrize('magic_portals, expected', [
+    (CHAIN, {(0, 0): ((30, 5), 3), (10, 0): ((30, 5), 2), (20, 0): ((30, 5), 1)}),
+    (CYCLE, {(0, 0): ((0, 0), 2), (10, 0): ((10, 0), 2)}),
+    (SELF_LOOP, {(0, 0): ((0, 0), 1), (10, 0): ((0, 0), 2)}),
+])
+def test_portal_chains(magic_portals: Dict[Point, Point], expected: Dict[Point, Tuple[Point, int]]) -> None:
+    plain = Plain(magic_portals=magic_portals)
+    for entrance, (end, teleports) in expected.items():
+        assert follow_chain(magic_portals, entrance) == (end, teleports)
+        assert enter(plain, entrance) == (end, teleports)
+
+
+def test_portal_table_matches_step_by_step_resolution() -> None:
+    generator = random.Random(0)
+    for _ in range(200):
+        # Few distinct points, so the portals form long chains, cycles and self-loops
+        points = [(10 * generator.randint(0, 7), 0) for _ in range(12)]
+        magic_portals = {points[i]: points[generator.randrange(len(points))] for i in range(len(points))}
+        plain = Plain(magic_portals=magic_portals)
+        entrances, ends, lengths = plain.get_portal_table()
+        for entrance, end, length in zip(entrances.tolist(), ends.tolist(), lengths.tolist()):
+            expected_end, expected_length = follow_chain(magic_portals, tuple(entrance))
+            assert (tuple(end), length) == (expected_end, expected_length), (magic_portals, entrance)
@@ -0,0 +1,34 @@
+import random
+import pytest
+from plain import Plain
+from walker import Walker
+from scene import save_scene, load_scene
+
+
+def make_plain() -> Plain:
+    "A plain with every kind of item, and a wall long enough to be kept out of the cells of the grid of the walls"
+    generator = random.Random(0)
+    walls = {(float(generator.randint(-8, 8)), float(generator.randint(-8, 8))):
+             (float(generator.randint(-8, 8)), float(generator.randint(-8, 8))) for _ in range(60)}
+    walls[(-1e6, 5.0)] = (1e6, 5.0)
+    return Plain(obstacles=[(1.0, 1.0), (-2.0, 0.0)], magic_portals={(2.0, 0.0): (-4.0, 4.0), (0.0, -2.0): (5.0, -1.0)},
+                 walls=walls)
+
+
+@pytest.mark.parametrize('extension', ['.json', '.npz'])
+def test_scene_round_trip(tmp_path, extension: str) -> None:
+    plain = make_plain()
+    path = str(tmp_path / f'scene{extension}')
+    save_scene(plain, path)
+    loaded = load_scene(path)
+    assert loaded.to_dict() == plain.to_dict()
+    assert loaded.get_walls_index().get_long_segments() == plain.get_walls_index().get_long_segments()
+    generator = random.Random(1)
+    walker = Walker(history='off')
+    for _ in range(2000):
+        last_location = (generator.uniform(-10, 10), generator.uniform(-10, 10))
+        walker.set_location((generator.uniform(-10, 10), generator.uniform(-10, 10)))
+        for first_move in [False, True]:
+            plain.set_first_move(first_move)
+            loaded.set_first_move(first_move)
+            assert loaded.hit_walls(walker, last_location) == plain.hit_walls(walker, last_location)
@@ -0,0 +1,78 @@
+import random
+import numpy as np
+from typing import List, Tuple
+from geometry import segments_intersect, are_collinear
+from plain import Plain
+from walker import Walker
+from spatial_index import SegmentGrid, PointGrid, MAX_SEGMENT_CELLS
+
+Point = Tuple[float, float]
+
+
+def random_point(generator: random.Random, size: int) -> Point:
+    "A point near the origin, with small integer coordinates half of the time so segments touch and overlap"
+    if generator.random() < 0.5:
+        return float(generator.randint(-size, size)), float(generator.randint(-size, size))
+    return generator.uniform(-size, size), generator.uniform(-size, size)
+
+
+def random_segments(generator: random.Random, count: int, size: int) -> List[Tuple[Point, Point]]:
+    "Short random segments, and a few long ones that cross far more than MAX_SEGMENT_CELLS cells"
+    segments = [(random_point(generator, size), random_point(generator, size)) for _ in range(count)]
+    for _ in range(3):
+        y = float(generator.randint(-size, size))
+        segments.append(((-1e4, y), (1e4, y + generator.random())))
+    return segments
+
+
+def test_segment_grid_matches_linear_scan() -> None:
+    generator = random.Random(0)
+    segments = random_segments(generator, 200, 6)
+    grid = SegmentGrid(segments)
+    assert len(grid.get_long_segments()) == 3
+    assert all(max(abs(end[0] - start[0]), abs(end[1] - start[1])) / grid.get_cell_size() > MAX_SEGMENT_CELLS
+               for start, end in (segments[index] for index in grid.get_long_segments()))
+    queries = [(random_point(generator, 8), random_point(generator, 8)) for _ in range(500)]
+    x1, y1, x2, y2 = np.array([(p[0], p[1], q[0], q[1]) for p, q in queries]).T
+    pairs, candidates = grid.query_many(x1, y1, x2, y2)
+    for query, (point1, point2) in enumerate(queries):
+        expected = {index for index, (start, end) in enumerate(segments)
+                    if segments_intersect(point1, point2, start, end)}
+        found = grid.query(point1, point2)
+        assert {index for index in found if segments_intersect(point1, point2, *segments[index])} == expected
+        assert set(candidates[pairs == query].tolist()) == set(found)
+
+
+def test_point_grid_matches_linear_scan() -> None:
+    generator = random.Random(1)
+    points = [random_point(generator, 6) for _ in range(300)]
+    grid = PointGrid(points)
+    queries = [(random_point(generator, 8), random_point(generator, 8)) for _ in range(500)]
+    queries += [((-1e4, float(y)), (1e4, float(y))) for y in range(-3, 4)]  # Longer than MAX_SEGMENT_CELLS cells
+    for point1, point2 in queries:
+        expected = {index for index, point in enumerate(points)
+                    if are_collinear(point1, point2, point) and
+                    min(point1[0], point2[0]) <= point[0] <= max(point1[0], point2[0]) and
+                    min(point1[1], point2[1]) <= point[1] <= max(point1[1], point2[1])}
+        assert expected <= set(grid.query(point1, point2)), (point1, point2)
+
+
+def test_plain_collisions_match_linear_scan() -> None:
+    generator = random.Random(2)
+    walls = dict(random_segments(generator, 300, 5))
+    obstacles = list({random_point(generator, 5) for _ in range(100)})
+    plain = Plain(obstacles=obstacles, walls=walls)
+    walker = Walker(history='off')
+    crowded_steps = 0
+    for _ in range(2000):
+        last_location, location = random_point(generator, 6), random_point(generator, 6)
+        walker.set_location(location)
+        crowded_steps += len(plain.get_walls_index().query(last_location, location)) >= 16
+        for first_move in [False, True]:
+            plain.set_first_move(first_move)
+            expected = any(segments_intersect(last_location, location, start, end) and
+                           not (first_move and are_collinear(start, end, (0, 0))) for start, end in walls.items())
+            assert plain.hit_walls(walker, last_location) == expected, (last_location, location, first_move)
+        expected = any(plain.crossed_point(walker, last_location, obstacle) for obstacle in obstacles)
+        assert plain.is_obstacle(walker, last_location) == expected, (last_location, location)
+    assert crowded_steps > 100  # The steps with many walls near them take the vectorized path of hit_walls
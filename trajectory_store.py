@@ -0,0 +1,84 @@
+import os
+import json
+import numpy as np
+from typing import Dict, Optional
+
+
+class TrajectoryStore:
+    """
+    A class to represent the (x, y) location after every step of every simulation, kept in a memory-mapped .npy file
+    of shape (num_simulations, num_steps + 1, 2), so it does not need to fit in memory. Next to the .npy file there is
+    a small .json sidecar with the metadata of the run (the plain, the walker and the seed).
+    """
+
+    def __init__(self, path: str, positions: np.ndarray, metadata: Dict) -> None:
+        self.__path: str = path
+        self.__positions: np.ndarray = positions
+        self.__metadata: Dict = metadata
+
+    @staticmethod
+    def metadata_path(path: str) -> str:
+        "The path of the metadata sidecar of a trajectory file"
+        return os.path.splitext(path)[0] + '.json'
+
+    @classmethod
+    def create(cls, path: str, num_simulations: int, num_steps: int, metadata: Optional[Dict] = None) -> 'TrajectoryStore':
+        """
+        Create a new trajectory file and its metadata sidecar
+        :param path: the path of the .npy file
+        :param num_simulations: the number of simulations in the file
+        :param num_steps: the number of steps of every simulation
+        :param metadata: the configuration of the run, it must be JSON serializable
+        :return: a TrajectoryStore open for writing
+        """
+        metadata = dict(metadata) if metadata else {}
+        metadata.update({'num_simulations': num_simulations, 'num_steps': num_steps})
+        positions = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64,
+                                              shape=(num_simulations, num_steps + 1, 2))
+        with open(cls.metadata_path(path), 'w') as file:
+            json.dump(metadata, file, indent=2)
+        return cls(path, positions, metadata)
+
+    @classmethod
+    def open(cls, path: str, mode: str = 'r') -> 'TrajectoryStore':
+        """
+        Open an existing trajectory file lazily, nothing is read until the positions are used
+        :param path: the path of the .npy file
+        :param mode: 'r' to read or 'r+' to write into the existing file (used by the parallel workers)
+        :return: a TrajectoryStore
+        """
+        positions = np.load(path, mmap_mode=mode)
+        with open(cls.metadata_path(path)) as file:
+            metadata = json.load(file)
+        return cls(path, positions, metadata)
+
+    def get_path(self) -> str:
+        return self.__path
+
+    def get_positions(self) -> np.ndarray:
+        return self.__positions
+
+    def get_metadata(self) -> Dict:
+        return self.__metadata
+
+    def get_num_simulations(self) -> int:
+        return self.__positions.shape[0]
+
+    def get_num_steps(self) -> int:
+        return self.__positions.shape[1] - 1
+
+    def write(self, first_simulation: int, first_step: int, positions: np.ndarray) -> None:
+        """
+        Write a block of locations into the file
+        :param first_simulation: the index of the first simulation of the block
+        :param first_step: the index of the first step of the block
+        :param positions: an array of shape (simulations, steps, 2)
+        :return: None
+        """
+        simulations, steps = positions.shape[:2]
+        self.__positions[first_simulation:first_simulation + simulations, first_step:first_step + steps] = positions
+
+    def flush(self) -> None:
+        "The method writes the changes of the memory map to the disk"
+        if isinstance(self.__positions, np.memmap):
+            self.__positions.flush()
@@ -1,18 +1,90 @@
-import random
 import math
-import matplotlib.pyplot as plt
-from typing import List, Tuple, Optional
+import bisect
+import itertools
+import numpy as np
+from array import array
+from random_buffer import RandomBuffer
+from typing import List, Tuple, Dict, Optional
 
 
 class Walker:
-    def __init__(self, movement_type: int = 1, weights_list: Optional[List[float]] = None, reset: float = 0) -> None:
+    """
+    A class to represent a walker on a plain. The walker can keep the history of its locations: 'off' keeps nothing,
+    'last' keeps only the current run and 'all' keeps every run. The history is a flat buffer of floats (x, y, x, y...)
+    instead of a list of tuples, so it takes 16 bytes per step.
+    The random numbers come from NumPy Generators in blocks. Every step uses one row of RANDOMS_PER_STEP numbers:
+    the angle or the direction, and the step size. The resets come from a stream of their own: the number of steps
+    until the next reset is drawn from a geometric distribution, so a step without a reset only counts down.
+    """
+    HISTORY_MODES: Tuple[str, ...] = ('off', 'last', 'all')
+    RANDOMS_PER_STEP: int = 2
+    TO_ORIGIN: int = 4  # The index of the direction back to the origin among the directions of movement type 4
+    __LATTICE_DIRECTIONS: List[Tuple[int, int]] = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+
+    def __init__(self, movement_type: int = 1, weights_list: Optional[List[float]] = None, reset: float = 0,
+                 history: str = 'last', seed: Optional[int] = None) -> None:
+        if history not in self.HISTORY_MODES:
+            raise ValueError(f"history must be one of {', '.join(self.HISTORY_MODES)}")
         self.__x: float = 0.0
         self.__y: float = 0.0
         self.__movement_type: int = movement_type
-        self.__history: List[Tuple[float, float]] = [(self.__x, self.__y)]
+        self.__history_mode: str = history
+        self.__history: array = array('d')
+        self.__history_length: int = 0  # The number of points in the history, the buffer may be bigger
+        self.__run_starts: List[int] = [0]  # The index of the first point of every run in the history
+        self.clear_history()
         self.__weights_list: List[float] = weights_list if weights_list is not None and len(weights_list) == 5 else [
             0.2, 0.2, 0.2, 0.2, 0.2]
+        # The cumulative weights of the directions of movement type 4, so a step only searches them
+        self.__cum_weights: List[float] = list(itertools.accumulate(self.__weights_list))
         self.__reset = reset
+        # log(1 - reset), the geometric distribution of the steps between resets is drawn by inversion with it
+        self.__log_no_reset: float = math.log1p(-reset) if 0 < reset < 1 else 0.0
+        step_seed, reset_seed = np.random.SeedSequence(seed).spawn(2)
+        self.__randoms: RandomBuffer = RandomBuffer(self.RANDOMS_PER_STEP, step_seed)
+        self.__reset_randoms: RandomBuffer = RandomBuffer(1, reset_seed)
+        self.__steps_to_reset: Optional[int] = self.__draw_reset_gap()  # The steps without a reset before the next
+
+    def set_seed(self, seed: Optional[int]) -> None:
+        "The method starts the random numbers of the walker again from a seed, None for a seed from the system"
+        step_seed, reset_seed = np.random.SeedSequence(seed).spawn(2)
+        self.__randoms.seed(step_seed)
+        self.__reset_randoms.seed(reset_seed)
+        self.__steps_to_reset = self.__draw_reset_gap()
+
+    def get_random_state(self) -> Dict:
+        "The method returns the position in the random numbers of the walker as a JSON friendly dictionary"
+        return {'steps': self.__randoms.get_state(), 'resets': self.__reset_randoms.get_state(),
+                'steps_to_reset': self.__steps_to_reset}
+
+    def set_random_state(self, state: Dict) -> None:
+        "The method moves the random numbers of the walker to a position returned by get_random_state"
+        self.__randoms.set_state(state['steps'])
+        self.__reset_randoms.set_state(state['resets'])
+        self.__steps_to_reset = state['steps_to_reset']
+
+    def reset_gaps(self, uniforms: np.ndarray) -> np.ndarray:
+        """
+        Turn uniform random numbers into numbers of steps without a reset before a reset, the way the walker draws them
+        :param uniforms: uniform random numbers in [0, 1)
+        :return: the numbers of steps, geometric with the reset probability (the number of failures before the first
+        success), -1 where the walker is never reset
+        """
+        uniforms = np.asarray(uniforms, dtype=float)
+        if self.__reset <= 0:
+            return np.full(uniforms.shape, -1, dtype=np.int64)
+        if self.__reset >= 1:
+            return np.zeros(uniforms.shape, dtype=np.int64)
+        return np.floor(np.log1p(-uniforms) / self.__log_no_reset).astype(np.int64)
+
+    def __draw_reset_gap(self) -> Optional[int]:
+        "The method draws the number of steps before the next reset, None if the walker is never reset"
+        if self.__reset <= 0:
+            return None
+        if self.__reset >= 1:
+            return 0
+        uniform = self.__reset_randoms.next_row()[0]
+        return math.floor(math.log1p(-uniform) / self.__log_no_reset)
 
     def set_location(self, location: Tuple[float, float]) -> None:
         self.__x, self.__y = location
@@ -35,6 +107,22 @@ class Walker:
     def set_movement_type(self, movement_type: int) -> None:
         self.__movement_type = movement_type
 
+    def get_weights_list(self) -> List[float]:
+        return self.__weights_list
+
+    def get_reset(self) -> float:
+        return self.__reset
+
+    def choose_directions(self, uniforms: np.ndarray) -> np.ndarray:
+        """
+        Choose the directions of many steps of movement type 4 at once, the way step chooses one
+        :param uniforms: uniform random numbers in [0, 1), one for every step or walker
+        :return: the indices of the directions, 0 to 3 for up, down, right and left and TO_ORIGIN for the origin
+        """
+        # Same as random.choices, pick the first cumulative weight above the draw
+        choices = np.searchsorted(self.__cum_weights, np.asarray(uniforms) * self.__cum_weights[-1], side='right')
+        return np.minimum(choices, self.TO_ORIGIN)
+
     def back_to_origin(self) -> Tuple[float, float]:
         "The method to calculate the direction the walker needs to go in order to return back to the origin"
         if self.__x == 0 and self.__y == 0:
@@ -46,10 +134,13 @@ class Walker:
         return (step_x, step_y)
 
     def reset(self) -> bool:
-        "The method to check if the random reset of the walker is set"
-        if self.__reset > 0:
-            reset = random.choices([True, False], weights=[self.__reset, 1 - self.__reset])[0]
-            return reset
+        "The method to check if the random reset of the walker is set, it counts down the steps to the next reset"
+        if self.__steps_to_reset is None:
+            return False
+        if self.__steps_to_reset == 0:
+            self.__steps_to_reset = self.__draw_reset_gap()
+            return True
+        self.__steps_to_reset -= 1
         return False
 
     def move(self) -> bool:
@@ -59,41 +150,105 @@ class Walker:
             self.__y = 0
             return True
         else:
-            dx = 0.0
-            dy = 0.0
-            if self.__movement_type == 1:
-                angle = random.uniform(0, 2 * math.pi)
-                dx = math.cos(angle)
-                dy = math.sin(angle)
-            elif self.__movement_type == 2:
-                angle = random.uniform(0, 2 * math.pi)
-                step_size = random.uniform(0.5, 1.5)
-                dx = step_size * math.cos(angle)
-                dy = step_size * math.sin(angle)
-            elif self.__movement_type == 3:
-                direction = random.choices([(0, 1), (0, -1), (1, 0), (-1, 0)])[0]
-                dx, dy = direction
-            elif self.__movement_type == 4:
-                back_to_origin = self.back_to_origin()
-                probabilities = [(0, 1), (0, -1), (1, 0), (-1, 0), back_to_origin]
-                weights = self.__weights_list  # Adjust probabilities as needed
-                dx, dy = random.choices(population=probabilities, weights=weights)[0]
-            self.__x += dx
-            self.__y += dy
+            self.step()
             return False
 
+    def step(self) -> None:
+        "The method to take one step according to the movement type, move checks the reset first"
+        randoms = self.__randoms.next_row()
+        dx = 0.0
+        dy = 0.0
+        if self.__movement_type == 1:
+            angle = randoms[0] * (2 * math.pi)
+            dx = math.cos(angle)
+            dy = math.sin(angle)
+        elif self.__movement_type == 2:
+            angle = randoms[0] * (2 * math.pi)
+            step_size = 0.5 + randoms[1]
+            dx = step_size * math.cos(angle)
+            dy = step_size * math.sin(angle)
+        elif self.__movement_type == 3:
+            dx, dy = self.__LATTICE_DIRECTIONS[int(randoms[0] * 4)]
+        elif self.__movement_type == 4:
+            # The scalar form of choose_directions
+            direction = bisect.bisect(self.__cum_weights, randoms[0] * self.__cum_weights[-1], 0, self.TO_ORIGIN)
+            if direction == self.TO_ORIGIN:
+                dx, dy = self.back_to_origin()  # Only computed when it is chosen
+            else:
+                dx, dy = self.__LATTICE_DIRECTIONS[direction]
+        self.__x += dx
+        self.__y += dy
+
     def get_location(self) -> Tuple[float, float]:
         return (self.__x, self.__y)
 
+    def to_dict(self) -> Dict:
+        "The method returns the configuration of the walker, Walker(**walker.to_dict()) builds a walker like it"
+        return {'movement_type': self.__movement_type, 'weights_list': list(self.__weights_list),
+                'reset': self.__reset, 'history': self.__history_mode}
+
+    def get_history_mode(self) -> str:
+        return self.__history_mode
+
+    def reserve_history(self, points: int) -> None:
+        "The method to preallocate the history buffer for the given number of points"
+        missing = 2 * points - len(self.__history)
+        if self.__history_mode != 'off' and missing > 0:
+            self.__history.frombytes(bytes(8 * missing))
+
     def get_history(self) -> List[Tuple[float, float]]:
-        return self.__history
+        "The method returns the history of the current run as a list of (x, y) tuples"
+        return [tuple(point) for point in self.get_history_array().tolist()]
+
+    def get_history_array(self) -> np.ndarray:
+        "The method returns the history of the current run as an array of shape (points, 2)"
+        return self.__history_points(self.__run_starts[-1], self.__history_length)
+
+    def get_all_histories(self) -> List[np.ndarray]:
+        "The method returns the history of every run that was kept, as arrays of shape (points, 2)"
+        if self.__history_mode == 'off':
+            return []
+        ends = self.__run_starts[1:] + [self.__history_length]
+        return [self.__history_points(start, end) for start, end in zip(self.__run_starts, ends)]
+
+    def __history_points(self, start: int, end: int) -> np.ndarray:
+        "The method copies the points start to end of the history buffer into an array"
+        return np.frombuffer(self.__history, dtype=float)[2 * start:2 * end].reshape(-1, 2).copy()
 
     def add_to_history(self, location: Tuple[float, float]) -> None:
         "The method to add a location to the walker's history"
-        self.__history.append(location)
+        if self.__history_mode == 'off':
+            return
+        index = 2 * self.__history_length
+        if index == len(self.__history):
+            self.reserve_history(max(16, self.__history_length * 2))  # Grow the buffer
+        self.__history[index] = location[0]
+        self.__history[index + 1] = location[1]
+        self.__history_length += 1
+
+    def extend_history(self, locations: np.ndarray) -> None:
+        "The method to add many locations, an array of shape (points, 2), to the walker's history at once"
+        if self.__history_mode == 'off' or len(locations) == 0:
+            return
+        self.reserve_history(self.__history_length + len(locations))
+        index = 2 * self.__history_length
+        values = np.asarray(locations, dtype=float).ravel()
+        self.__history[index:index + len(values)] = array('d', values.tobytes())
+        self.__history_length += len(locations)
+
+    def reset_history(self) -> None:
+        "The method to forget every run of the walker's history"
+        self.__history_length = 0
+        self.__run_starts = [0]
+
     def clear_history(self) -> None:
-        "The method to clear the walker's history"
-        self.__history = [(self.__x, self.__y)]
+        "The method to start a new run of the walker's history, in 'all' mode the earlier runs are kept"
+        if self.__history_mode == 'all' and self.__history_length > 0:
+            self.__run_starts.append(self.__history_length)
+        else:
+            self.__history_length = 0
+            self.__run_starts = [0]
+        self.add_to_history((self.__x, self.__y))
 
 
 if __name__ == '__main__':
@@ -108,6 +263,8 @@ if __name__ == '__main__':
     y_coords = [pos[1] for pos in walker.get_history()]
 
     # Plot the walker's movement
+    import matplotlib.pyplot as plt
+
     plt.plot(x_coords, y_coords, marker='o', linestyle='-')
     plt.title("Random Walker Movement")
     plt.xlabel("X-coordinate")